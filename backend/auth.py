@@ -2,11 +2,13 @@ from datetime import datetime, timedelta
 from typing import Optional, Union
 from jose import JWTError, jwt
 from passlib.context import CryptContext
-from fastapi import HTTPException, status, Depends
+from fastapi import HTTPException, Request, status, Depends
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from sqlalchemy.orm import Session
-from database import get_db
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from database import get_async_db
 from models import User, TokenData, UserRole
+from services.rate_limiter import rate_limiter, RateLimitExceeded
 import os
 
 # 从环境变量获取配置
@@ -19,6 +21,8 @@ pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
 # HTTP Bearer 认证
 security = HTTPBearer()
+# 可选认证（未携带令牌时不报错）
+optional_security = HTTPBearer(auto_error=False)
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     """验证密码"""
@@ -52,26 +56,34 @@ def verify_token(token: str) -> Optional[TokenData]:
     except JWTError:
         return None
 
-def get_user_by_username(db: Session, username: str) -> Optional[User]:
+async def get_user_by_username(db: AsyncSession, username: str) -> Optional[User]:
     """根据用户名获取用户"""
-    return db.query(User).filter(User.username == username).first()
+    return await db.scalar(select(User).where(User.username == username).limit(1))
 
-def get_user_by_email(db: Session, email: str) -> Optional[User]:
+async def get_user_by_email(db: AsyncSession, email: str) -> Optional[User]:
     """根据邮箱获取用户"""
-    return db.query(User).filter(User.email == email).first()
+    return await db.scalar(select(User).where(User.email == email).limit(1))
 
-def authenticate_user(db: Session, username: str, password: str) -> Union[User, bool]:
+async def authenticate_user(db: AsyncSession, username: str, password: str) -> Union[User, bool]:
     """验证用户身份"""
-    user = get_user_by_username(db, username)
+    user = await get_user_by_username(db, username)
     if not user:
         return False
     if not verify_password(password, user.hashed_password):
         return False
     return user
 
-def get_current_user(
+async def release_connection(db: AsyncSession):
+    """结束查询用户的只读事务，把连接归还连接池
+
+    请求级会话在响应结束后才关闭，流式响应期间会一直占用连接；
+    提交后会话仍可继续使用（下次查询时重新获取连接），用户对象保留在会话中且不会过期
+    """
+    await db.commit()
+
+async def get_current_user(
     credentials: HTTPAuthorizationCredentials = Depends(security),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ) -> User:
     """获取当前认证用户"""
     credentials_exception = HTTPException(
@@ -84,10 +96,11 @@ def get_current_user(
     if token_data is None:
         raise credentials_exception
     
-    user = get_user_by_username(db, username=token_data.username)
+    user = await get_user_by_username(db, username=token_data.username)
     if user is None:
         raise credentials_exception
     
+    await release_connection(db)
     return user
 
 def get_current_active_user(current_user: User = Depends(get_current_user)) -> User:
@@ -113,17 +126,40 @@ def check_admin_permission(current_user: User = Depends(get_current_active_user)
     return current_user.role == UserRole.ADMIN
 
 # 可选的认证依赖（不强制要求登录）
-def get_optional_user(
-    credentials: Optional[HTTPAuthorizationCredentials] = Depends(security),
-    db: Session = Depends(get_db)
+async def get_optional_user(
+    credentials: Optional[HTTPAuthorizationCredentials] = Depends(optional_security),
+    db: AsyncSession = Depends(get_async_db)
 ) -> Optional[User]:
     """获取可选的当前用户（允许未登录）"""
     if not credentials:
         return None
-    
-    token_data = verify_token(credentials.credentials)
+    return await get_user_from_token(credentials.credentials, db)
+
+async def get_user_from_token(token: str, db: AsyncSession) -> Optional[User]:
+    """根据访问令牌获取活跃用户，令牌无效时返回None（WebSocket等无法使用依赖注入的场景）"""
+    token_data = verify_token(token)
     if token_data is None:
         return None
     
-    user = get_user_by_username(db, username=token_data.username)
-    return user if user and user.is_active else None
\ No newline at end of file
+    user = await get_user_by_username(db, username=token_data.username)
+    await release_connection(db)
+    return user if user and user.is_active else None
+
+# 限流依赖：返回限流身份，供请求完成后按实际用量扣除token配额
+async def check_rate_limit(
+    request: Request,
+    user: Optional[User] = Depends(get_optional_user)
+) -> Optional[str]:
+    """按用户或匿名IP检查请求频率和每日token配额，超出时返回429"""
+    if rate_limiter.is_exempt(user):
+        return None
+    identity = rate_limiter.identity(user, request.client.host if request.client else None)
+    try:
+        await rate_limiter.check(identity)
+    except RateLimitExceeded as e:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail=str(e),
+            headers=e.headers()
+        )
+    return identity
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""
+数据库并发基准：并发读取消息历史时，流式输出的帧间隔是否受影响
+
+模拟一个每隔固定时间输出一帧的流式响应，同时运行多个协程反复读取一段较长的消息历史：
+同步：在async函数中使用同步Session查询（查询期间事件循环被阻塞，移植前的路由写法）
+异步：使用AsyncSession查询（aiosqlite在独立线程中执行，事件循环继续输出帧）
+输出帧间隔的中位数、P99和最大值，以及期间完成的历史读取次数
+
+用法: python benchmark_db_concurrency.py [--readers 8] [--messages 2000] [--seconds 3]
+"""
+
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import argparse
+import asyncio
+import statistics
+import tempfile
+import time
+from pathlib import Path
+from sqlalchemy import create_engine, select
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.orm import sessionmaker
+from database import Base
+from models import User, ChatSession, MessageRecord
+
+FRAME_INTERVAL = 0.01
+
+def history_query(session_pk: int):
+    """与消息历史接口相同的查询"""
+    return (
+        select(
+            MessageRecord.id, MessageRecord.role, MessageRecord.content, MessageRecord.timestamp,
+            MessageRecord.model_used, MessageRecord.alternative_group, MessageRecord.is_complete
+        )
+        .where(MessageRecord.session_id == session_pk)
+        .order_by(MessageRecord.timestamp.asc(), MessageRecord.id.asc())
+    )
+
+def prepare_database(path: Path, message_count: int) -> int:
+    engine = create_engine(f"sqlite:///{path}")
+    Base.metadata.create_all(bind=engine)
+    db = sessionmaker(bind=engine)()
+    try:
+        user = User(username="bench", email="bench@example.com", hashed_password="x")
+        db.add(user)
+        db.flush()
+        session = ChatSession(user_id=user.id, title="bench")
+        db.add(session)
+        db.flush()
+        db.add_all([
+            MessageRecord(
+                session_id=session.id,
+                role="user" if index % 2 == 0 else "assistant",
+                content="这是一条用于测试的消息，包含中文和 **Markdown** 以及 $E=mc^2$ 公式。" * 8
+            )
+            for index in range(message_count)
+        ])
+        db.commit()
+        return session.id
+    finally:
+        db.close()
+        engine.dispose()
+
+async def stream(seconds: float) -> list:
+    """按固定间隔输出帧，返回实际帧间隔（毫秒）"""
+    gaps = []
+    last = time.perf_counter()
+    deadline = last + seconds
+    while last < deadline:
+        await asyncio.sleep(FRAME_INTERVAL)
+        now = time.perf_counter()
+        gaps.append((now - last) * 1000)
+        last = now
+    return gaps
+
+async def run(mode: str, path: Path, session_pk: int, readers: int, seconds: float) -> dict:
+    done = asyncio.Event()
+    reads = 0
+
+    if mode == "sync":
+        engine = create_engine(f"sqlite:///{path}", connect_args={"check_same_thread": False})
+        factory = sessionmaker(bind=engine)
+
+        async def reader():
+            nonlocal reads
+            while not done.is_set():
+                db = factory()
+                try:
+                    db.execute(history_query(session_pk)).all()
+                finally:
+                    db.close()
+                reads += 1
+                await asyncio.sleep(0)
+    else:
+        engine = create_async_engine(f"sqlite+aiosqlite:///{path}")
+        factory = async_sessionmaker(engine, class_=AsyncSession)
+
+        async def reader():
+            nonlocal reads
+            while not done.is_set():
+                async with factory() as db:
+                    (await db.execute(history_query(session_pk))).all()
+                reads += 1
+
+    tasks = [asyncio.create_task(reader()) for _ in range(readers)]
+    gaps = await stream(seconds)
+    done.set()
+    await asyncio.gather(*tasks)
+    if mode == "sync":
+        engine.dispose()
+    else:
+        await engine.dispose()
+
+    gaps.sort()
+    return {
+        "p50": statistics.median(gaps),
+        "p99": gaps[min(len(gaps) - 1, int(len(gaps) * 0.99))],
+        "max": gaps[-1],
+        "reads": reads
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="数据库并发基准")
+    parser.add_argument("--readers", type=int, default=8, help="并发读取历史的协程数")
+    parser.add_argument("--messages", type=int, default=2000, help="历史消息条数")
+    parser.add_argument("--seconds", type=float, default=3.0, help="每种模式的运行时间")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = Path(directory) / "bench.db"
+        session_pk = prepare_database(path, args.messages)
+
+        print(f"流式帧间隔（目标 {FRAME_INTERVAL * 1000:.0f} ms），{args.readers} 个协程并发读取 {args.messages} 条消息的历史")
+        print(f"{'模式':<8}{'P50(ms)':>10}{'P99(ms)':>10}{'最大(ms)':>10}{'历史读取':>10}")
+        for mode, label in (("sync", "同步"), ("async", "异步")):
+            result = asyncio.run(run(mode, path, session_pk, args.readers, args.seconds))
+            print(f"{label:<8}{result['p50']:>10.2f}{result['p99']:>10.2f}{result['max']:>10.2f}{result['reads']:>10}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""
+序列化性能基准：对比聊天流、模型目录和消息历史三个接口优化前后每个请求的CPU时间
+
+优化前：构造并校验pydantic模型，经FastAPI按response_model重新校验、jsonable_encoder转换后用标准库json序列化；
+        流式接口每个增量调用json.dumps
+优化后：构造模型后由TrustedJSONResponse直接用orjson序列化，跳过重新校验；流式接口使用预构建的帧模板
+
+用法: python benchmark_serialization.py [--iterations 200]
+"""
+
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import argparse
+import asyncio
+import json
+import time
+from datetime import datetime
+from typing import List
+from fastapi.responses import JSONResponse
+from fastapi.routing import serialize_response
+from fastapi.utils import create_response_field
+from models import MessageResponse, ModelInfo
+from services.serialization import sse_frame, trusted_response
+
+HISTORY_SIZE = 200
+CATALOG_SIZE = 300
+STREAM_CHUNKS = 500
+
+def make_history_rows():
+    now = datetime.utcnow()
+    return [
+        {
+            "id": index,
+            "role": "user" if index % 2 == 0 else "assistant",
+            "content": "这是一条用于测试的消息，包含中文和 **Markdown** 以及 $E=mc^2$ 公式。" * 8,
+            "timestamp": now.isoformat(),
+            "model_used": "gpt-4o-mini",
+            "alternative_group": None
+        }
+        for index in range(HISTORY_SIZE)
+    ]
+
+def make_catalog_rows():
+    return [
+        {"id": f"model-{index}", "name": f"model-{index}", "provider": "openai", "description": "测试模型"}
+        for index in range(CATALOG_SIZE)
+    ]
+
+def make_chunks():
+    return ["增量", " token", "，", "公式 $x^2$", "\n"] * (STREAM_CHUNKS // 5)
+
+async def before_list(model_class, rows):
+    """优化前：校验构造 -> response_model重新校验 -> jsonable_encoder -> json"""
+    field = create_response_field(name="response", type_=List[model_class])
+    content = [model_class(**row) for row in rows]
+    serialized = await serialize_response(field=field, response_content=content, is_coroutine=True)
+    return JSONResponse(serialized).body
+
+async def after_list(model_class, rows):
+    """优化后：校验构造 -> orjson"""
+    return trusted_response([model_class(**row) for row in rows]).body
+
+async def before_stream(chunks):
+    return [f"data: {json.dumps({'content': chunk, 'type': 'content'})}\n\n".encode("utf-8") for chunk in chunks]
+
+async def after_stream(chunks):
+    return [sse_frame({'content': chunk, 'type': 'content'}) for chunk in chunks]
+
+def measure(label: str, factory, iterations: int) -> float:
+    """返回每个请求的CPU时间（毫秒）"""
+    loop = asyncio.new_event_loop()
+    try:
+        for _ in range(min(20, iterations)):
+            loop.run_until_complete(factory())
+        start = time.process_time()
+        for _ in range(iterations):
+            loop.run_until_complete(factory())
+        elapsed = (time.process_time() - start) / iterations * 1000
+    finally:
+        loop.close()
+    return elapsed
+
+def main():
+    parser = argparse.ArgumentParser(description="序列化性能基准")
+    parser.add_argument("--iterations", type=int, default=200)
+    args = parser.parse_args()
+
+    history, catalog, chunks = make_history_rows(), make_catalog_rows(), make_chunks()
+    cases = [
+        (f"聊天流 ({STREAM_CHUNKS} 帧)", lambda: before_stream(chunks), lambda: after_stream(chunks)),
+        (f"模型目录 ({CATALOG_SIZE} 个模型)", lambda: before_list(ModelInfo, catalog), lambda: after_list(ModelInfo, catalog)),
+        (f"消息历史 ({HISTORY_SIZE} 条消息)", lambda: before_list(MessageResponse, history), lambda: after_list(MessageResponse, history)),
+    ]
+
+    print(f"每个请求的CPU时间（{args.iterations} 次平均）")
+    print(f"{'接口':<24}{'优化前(ms)':>12}{'优化后(ms)':>12}{'加速':>8}")
+    for label, before, after in cases:
+        before_ms = measure(label, before, args.iterations)
+        after_ms = measure(label, after, args.iterations)
+        print(f"{label:<24}{before_ms:>12.3f}{after_ms:>12.3f}{before_ms / after_ms:>7.1f}x")
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,5 @@
 from pydantic_settings import BaseSettings
-from typing import Optional
+from typing import Optional, List, Dict, Any
 import os
 from crypto_utils import secure_storage
 
@@ -38,6 +38,151 @@ class Settings(BaseSettings):
     algorithm: str = "HS256"
     access_token_expire_minutes: int = 43200  # 30天
     
+    # 模型健康探测配置
+    health_probe_enabled: bool = True
+    health_probe_interval: int = 60  # 探测间隔（秒）
+    health_probe_models: list = []  # 探测目标，格式为 "provider:model"，省略provider时使用当前供应商
+    health_probe_max_tokens: int = 8
+    health_probe_timeout: float = 15.0
+    health_window_size: int = 50  # 滚动窗口保留的样本数
+    health_window_seconds: int = 900  # 滚动窗口时间跨度（秒）
+    health_error_threshold: float = 0.5  # 错误率超过该值视为不健康
+    
+    # 故障转移与熔断配置
+    failover_enabled: bool = True
+    circuit_failure_threshold: int = 3  # 连续失败多少次后熔断
+    circuit_recovery_timeout: int = 30  # 熔断后多久进入半开状态（秒）
+    circuit_probe_timeout: int = 60  # 半开状态试探请求占用名额的最长时间（秒），超时后允许新的试探
+    provider_catalog_ttl: int = 600  # 供应商模型列表缓存时间（秒）
+    provider_catalog_failure_ttl: int = 30  # 模型列表获取失败时空结果的缓存时间（秒）
+    
+    # 对冲请求配置
+    hedging_enabled: bool = False
+    hedge_delay_ms: Optional[int] = None  # 固定对冲延迟；不设置时使用供应商观测到的TTFT p90
+    hedge_default_delay_ms: int = 2000  # 没有观测数据时的对冲延迟
+    hedge_min_delay_ms: int = 200
+    hedge_max_per_user: int = 2  # 每个用户同时进行的对冲请求上限
+    hedge_max_global: int = 20  # 全局同时进行的对冲请求上限
+    
+    # API密钥池配置
+    key_pool_strategy: str = "least_in_flight"  # least_in_flight 或 weighted_round_robin
+    key_cooldown_seconds: int = 30  # 密钥返回429后移出轮换的时间（无Retry-After时）
+    
+    # 自适应并发限制配置（按供应商和密钥）
+    concurrency_initial_limit: int = 8
+    concurrency_min_limit: int = 1
+    concurrency_max_limit: int = 64
+    concurrency_backoff_ratio: float = 0.7  # 遇到429时上限乘以该系数
+    concurrency_latency_tolerance: float = 2.0  # 延迟超过基线该倍数时降低上限
+    concurrency_queue_timeout: float = 10.0  # 超出上限的请求最长排队时间（秒）
+    
+    # 上游重试配置（非流式聊天、模型列表、健康探测）
+    retry_max_attempts: int = 3
+    retry_base_delay: float = 0.5  # 指数退避基数（秒）
+    retry_max_delay: float = 8.0  # 单次退避上限（秒）
+    retry_deadline: float = 60.0  # 包含所有重试的总时间预算（秒）
+    
+    # 上游请求公平调度配置
+    scheduler_enabled: bool = True
+    scheduler_max_concurrent: int = 64  # 同时进行的上游请求总数
+    scheduler_queue_timeout: float = 30.0  # 最长排队时间（秒）
+    scheduler_priority_classes: dict = {"admin": 0, "user": 1, "anonymous": 2}  # 数字越小优先级越高
+    scheduler_default_weight: float = 1.0
+    scheduler_user_weights: dict = {}  # 按用户名配置的调度权重
+    
+    # 限流配置（令牌桶，0表示不限制）
+    rate_limit_enabled: bool = True
+    rate_limit_requests_per_minute: int = 30
+    rate_limit_tokens_per_day: int = 200000
+    rate_limit_anonymous_requests_per_minute: int = 10  # 匿名请求按IP限制
+    rate_limit_anonymous_tokens_per_day: int = 20000
+    rate_limit_admin_exempt: bool = True
+    rate_limit_backend: str = "memory"  # memory 或 redis（多worker部署共享配额）
+    rate_limit_redis_url: Optional[str] = None
+    
+    # 过载保护配置
+    admission_enabled: bool = True
+    admission_max_in_flight: int = 256  # 同时进行的聊天请求（含流式）上限
+    admission_max_queue_wait: float = 10.0  # 调度队列中最早请求的等待时间上限（秒）
+    admission_max_loop_lag: float = 0.5  # 事件循环延迟上限（秒）
+    admission_degrade_ratio: float = 0.8  # 任一指标超过上限的该比例时进入降级状态
+    admission_degrade_model: Optional[str] = None  # 降级时使用的更快/更便宜的模型，不配置则不降级
+    admission_retry_after: int = 5  # 拒绝时建议的重试等待时间（秒）
+    admission_lag_interval: float = 0.5  # 事件循环延迟采样间隔（秒）
+    admission_lag_window: float = 2.0  # 事件循环延迟需持续的时间（秒），取窗口内样本的最小值
+    
+    # 响应缓存配置（精确匹配）
+    response_cache_enabled: bool = False  # 请求可通过cache字段单独开启或关闭
+    response_cache_ttl: int = 3600  # 默认有效期（秒）
+    response_cache_max_entries: int = 1000
+    response_cache_max_bytes: int = 32 * 1024 * 1024  # 内存层大小上限
+    response_cache_disk_enabled: bool = False
+    response_cache_disk_path: str = "response_cache.db"  # 相对路径基于backend目录
+    response_cache_disk_max_bytes: int = 256 * 1024 * 1024
+    response_cache_replay_chunk_size: int = 16  # 流式重放时每帧的字符数
+    
+    # 语义缓存配置（需要numpy）
+    semantic_cache_enabled: bool = False
+    semantic_cache_embedding_model: str = "text-embedding-3-small"
+    semantic_cache_embed_timeout: float = 1.0  # 计算向量的超时（秒），只尝试一次，超时或失败按未命中处理
+    semantic_cache_default_threshold: float = 0.92  # 余弦相似度阈值
+    semantic_cache_thresholds: dict = {}  # 按模型配置的阈值
+    semantic_cache_top_k: int = 3
+    semantic_cache_max_entries: int = 2000  # 每个命名空间（租户+模型+系统提示词）的条目上限
+    semantic_cache_max_namespaces: int = 256
+    semantic_cache_ttl: int = 86400
+    
+    # 相同请求合并配置
+    single_flight_enabled: bool = True
+    single_flight_require_deterministic: bool = True  # 只合并温度为0的请求
+    
+    # 幂等键配置
+    idempotency_ttl: int = 86400  # 幂等键和结果的保存时间（秒）
+    idempotency_stale_after: int = 600  # 处理中的记录超过该时间且本进程没有在处理时视为已放弃
+    
+    # 批量聊天配置
+    batch_max_items: int = 1000
+    batch_max_concurrency: int = 16  # 单个批量请求同时进行的条目数（仍受供应商并发限制约束）
+    
+    # 回答检查点配置（流式生成过程中分批保存助手回答）
+    checkpoint_tokens: int = 32  # 每累计多少个增量写入一次
+    checkpoint_interval_ms: int = 1000  # 距上次写入超过该时间（毫秒）时写入
+    
+    # 写后持久化配置（会话和消息写入合并为批量事务，在后台提交）
+    write_behind_batch_size: int = 256  # 单个事务最多包含的写入数
+    write_behind_max_delay_ms: int = 5  # 收到写入后等待更多写入合并的时间（毫秒）
+    
+    # SQLite性能配置（每个连接建立时应用）
+    sqlite_journal_mode: str = "WAL"  # WAL模式下读写互不阻塞
+    sqlite_synchronous: str = "NORMAL"  # WAL模式下NORMAL只在检查点时fsync，断电最多丢失最后几个事务
+    sqlite_mmap_size: int = 268435456  # 内存映射读取的字节数，0表示关闭
+    sqlite_cache_size_kb: int = 65536  # 每个连接的页缓存大小（KB）
+    sqlite_busy_timeout_ms: int = 5000  # 等待写锁的时间（毫秒），超时后报database is locked
+    sqlite_pool_size: int = 10  # 连接池常驻连接数（同步和异步引擎各一个连接池）
+    sqlite_max_overflow: int = 20  # 连接池允许的额外连接数
+    sqlite_pool_timeout: float = 30.0  # 等待空闲连接的时间（秒）
+    sqlite_wal_autocheckpoint: int = 0  # 提交时自动检查点的WAL页数，0表示由后台定期检查点负责
+    sqlite_checkpoint_interval: float = 30.0  # 后台检查点间隔（秒），0表示关闭并使用SQLite默认的自动检查点
+    sqlite_journal_size_limit: int = 67108864  # 检查点后WAL文件保留的最大字节数
+    
+    # 多模型对比配置
+    compare_max_models: int = 4
+    
+    # WebSocket配置
+    ws_auth_timeout: float = 10.0  # 未在查询参数中提供token时，等待auth消息的时间（秒）
+    ws_max_generations: int = 8  # 单个连接同时进行的生成数
+    
+    # 异步任务配置
+    job_workers: int = 4  # 后台执行任务的工作协程数
+    job_max_attempts: int = 2  # 服务重启时中断的任务最多执行次数，超过后标记为失败
+    job_timeout: int = 1800  # 单个任务的最长执行时间（秒）
+    
+    # 响应压缩配置（按Accept-Encoding协商brotli/gzip，流式响应逐帧刷新）
+    compression_enabled: bool = True
+    compression_min_size: int = 1024  # 普通响应超过该字节数才压缩
+    compression_level: int = 6  # gzip压缩级别
+    compression_brotli_quality: int = 4  # brotli质量，流式压缩时较低的质量延迟更小
+    
     # CORS配置
     allowed_origins: list = ["http://localhost:3000", "http://127.0.0.1:3000", "http://localhost:3000/", "http://127.0.0.1:3000/"]
     
@@ -72,37 +217,61 @@ PROVIDERS = {
     }
 }
 
-def get_current_provider_config():
-    """获取当前供应商配置"""
-    provider = PROVIDERS.get(settings.current_provider)
+def get_provider_base_url(provider_name: str) -> str:
+    """获取供应商的base_url（加密存储中的自定义地址优先）"""
+    provider = PROVIDERS.get(provider_name)
+    if not provider:
+        raise ValueError(f"不支持的供应商: {provider_name}")
+    
+    # 从加密存储中获取自定义base_url（如果有）
+    provider_config = secure_storage.get_provider_config(provider_name)
+    if provider_config.get('base_url'):
+        return provider_config['base_url']
+    if provider_name == "custom":
+        return settings.custom_base_url
+    return provider["base_url"]
+
+def get_provider_keys(provider_name: str) -> List[Dict[str, Any]]:
+    """获取供应商所有启用的API Key（密钥池），没有时回退到环境变量"""
+    provider = PROVIDERS.get(provider_name)
     if not provider:
-        raise ValueError(f"不支持的供应商: {settings.current_provider}")
+        raise ValueError(f"不支持的供应商: {provider_name}")
     
-    # 优先从加密存储中获取API key
-    api_key = secure_storage.get_api_key(settings.current_provider)
+    keys = [entry for entry in secure_storage.get_api_keys(provider_name) if entry.get('enabled', True)]
     
     # 如果加密存储中没有，则从环境变量获取（向后兼容）
-    if not api_key:
-        api_key = getattr(settings, provider["api_key_field"], None)
-    
-    if not api_key:
-        raise ValueError(f"未配置 {provider['name']} 的 API Key")
+    if not keys:
+        env_key = getattr(settings, provider["api_key_field"], None)
+        if env_key:
+            keys.append({"id": "env", "api_key": env_key, "weight": 1, "label": None, "enabled": True})
     
-    # 获取base_url
-    base_url = provider["base_url"]
+    return keys
+
+def get_provider_config(provider_name: str):
+    """获取指定供应商配置"""
+    provider = PROVIDERS.get(provider_name)
+    if not provider:
+        raise ValueError(f"不支持的供应商: {provider_name}")
     
-    # 从加密存储中获取自定义base_url（如果有）
-    provider_config = secure_storage.get_provider_config(settings.current_provider)
-    if provider_config.get('base_url'):
-        base_url = provider_config['base_url']
-    elif settings.current_provider == "custom":
-        base_url = settings.custom_base_url
+    keys = get_provider_keys(provider_name)
+    if not keys:
+        raise ValueError(f"未配置 {provider['name']} 的 API Key")
     
     return {
-        "base_url": base_url,
-        "api_key": api_key
+        "base_url": get_provider_base_url(provider_name),
+        "api_key": keys[0]["api_key"]
     }
 
+def is_provider_configured(provider_name: str) -> bool:
+    """检查供应商是否已配置API Key"""
+    if provider_name not in PROVIDERS:
+        return False
+    return bool(get_provider_keys(provider_name))
+
+def get_current_provider_config():
+    """获取当前供应商配置"""
+    return get_provider_config(settings.current_provider)
+
 def update_provider_secure_config(provider: str, api_key: str, base_url: str = None):
     """更新供应商的加密配置"""
     if base_url:
@@ -6,11 +6,12 @@ API密钥加密存储工具
 import os
 import json
 import base64
+import uuid
 from pathlib import Path
 from cryptography.fernet import Fernet
 from cryptography.hazmat.primitives import hashes
 from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
-from typing import Dict, Optional
+from typing import Dict, List, Optional
 
 class SecureStorage:
     def __init__(self, storage_file: str = "secure_config.enc"):
@@ -89,9 +90,103 @@ class SecureStorage:
         return self.store_config(config)
     
     def get_api_key(self, provider: str) -> Optional[str]:
-        """获取特定供应商的API密钥"""
+        """获取特定供应商的API密钥（没有启用的单密钥配置时返回密钥池中第一个启用的密钥）"""
         config = self.load_config()
-        return config.get('api_keys', {}).get(provider)
+        api_key = config.get('api_keys', {}).get(provider)
+        if api_key and config.get('api_key_settings', {}).get(provider, {}).get('enabled', True):
+            return api_key
+        for entry in config.get('api_key_pools', {}).get(provider, []):
+            if entry.get('enabled', True):
+                return entry['api_key']
+        return None
+    
+    def add_api_key(self, provider: str, api_key: str, weight: int = 1, label: str = None) -> Optional[str]:
+        """向供应商的密钥池添加API密钥，返回密钥ID"""
+        config = self.load_config()
+        pool = config.setdefault('api_key_pools', {}).setdefault(provider, [])
+        
+        key_id = uuid.uuid4().hex[:8]
+        pool.append({
+            'id': key_id,
+            'api_key': api_key,
+            'weight': max(1, weight),
+            'label': label,
+            'enabled': True
+        })
+        
+        return key_id if self.store_config(config) else None
+    
+    def update_api_key_entry(self, provider: str, key_id: str, weight: int = None,
+                             enabled: bool = None, label: str = None) -> bool:
+        """更新密钥池中某个密钥的权重、启用状态或备注
+
+        key_id为default时更新单密钥配置，设置单独保存在api_key_settings中
+        """
+        config = self.load_config()
+        if key_id == 'default':
+            if provider not in config.get('api_keys', {}):
+                return False
+            entry = config.setdefault('api_key_settings', {}).setdefault(provider, {})
+            if weight is not None:
+                entry['weight'] = max(1, weight)
+            if enabled is not None:
+                entry['enabled'] = enabled
+            if label is not None:
+                entry['label'] = label
+            return self.store_config(config)
+        for entry in config.get('api_key_pools', {}).get(provider, []):
+            if entry['id'] == key_id:
+                if weight is not None:
+                    entry['weight'] = max(1, weight)
+                if enabled is not None:
+                    entry['enabled'] = enabled
+                if label is not None:
+                    entry['label'] = label
+                return self.store_config(config)
+        return False
+    
+    def remove_api_key(self, provider: str, key_id: str) -> bool:
+        """从密钥池删除密钥（key_id为default时删除单密钥配置）"""
+        config = self.load_config()
+        
+        if key_id == 'default':
+            if provider not in config.get('api_keys', {}):
+                return False
+            del config['api_keys'][provider]
+            config.get('api_key_settings', {}).pop(provider, None)
+            return self.store_config(config)
+        
+        pool = config.get('api_key_pools', {}).get(provider, [])
+        remaining = [entry for entry in pool if entry['id'] != key_id]
+        if len(remaining) == len(pool):
+            return False
+        config['api_key_pools'][provider] = remaining
+        return self.store_config(config)
+    
+    def get_api_keys(self, provider: str) -> List[Dict[str, any]]:
+        """获取供应商的所有API密钥
+        
+        单密钥配置（update_api_key写入）以ID为default的条目出现在密钥池最前面
+        """
+        config = self.load_config()
+        keys = []
+        
+        default_key = config.get('api_keys', {}).get(provider)
+        if default_key:
+            default_settings = config.get('api_key_settings', {}).get(provider, {})
+            keys.append({
+                'id': 'default',
+                'api_key': default_key,
+                'weight': default_settings.get('weight', 1),
+                'label': default_settings.get('label'),
+                'enabled': default_settings.get('enabled', True)
+            })
+        
+        for entry in config.get('api_key_pools', {}).get(provider, []):
+            if entry['api_key'] != default_key:
+                keys.append(dict(entry))
+        
+        return keys
     
     def update_provider_config(self, provider: str, base_url: str, api_key: str = None) -> bool:
         """更新供应商完整配置"""
@@ -117,6 +212,9 @@ class SecureStorage:
         config = self.load_config()
         provider_config = config.get('providers', {}).get(provider, {})
         api_key = config.get('api_keys', {}).get(provider)
+        if not api_key:
+            api_key = next((entry['api_key'] for entry in config.get('api_key_pools', {}).get(provider, [])
+                            if entry.get('enabled', True)), None)
         
         return {
             'base_url': provider_config.get('base_url'),
@@ -133,6 +231,11 @@ class SecureStorage:
         for provider in config.get('api_keys', {}):
             providers[provider] = self.get_provider_config(provider)
         
+        # 从密钥池中获取供应商
+        for provider in config.get('api_key_pools', {}):
+            if provider not in providers:
+                providers[provider] = self.get_provider_config(provider)
+        
         # 从providers配置中获取其他供应商
         for provider in config.get('providers', {}):
             if provider not in providers:
@@ -148,6 +251,10 @@ class SecureStorage:
         if 'api_keys' in config and provider in config['api_keys']:
             del config['api_keys'][provider]
         
+        # 删除密钥池
+        if 'api_key_pools' in config and provider in config['api_key_pools']:
+            del config['api_key_pools'][provider]
+        
         # 删除供应商配置
         if 'providers' in config and provider in config['providers']:
             del config['providers'][provider]
@@ -1,22 +1,66 @@
-from sqlalchemy import create_engine, MetaData
+from sqlalchemy import create_engine, event, MetaData
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 import os
 from pathlib import Path
+from typing import Tuple
+from config import settings
 
 # 数据库文件路径
 DATABASE_PATH = Path(__file__).parent / "app.db"
 SQLALCHEMY_DATABASE_URL = f"sqlite:///{DATABASE_PATH}"
+ASYNC_DATABASE_URL = f"sqlite+aiosqlite:///{DATABASE_PATH}"
+
+# 连接池配置
+POOL_OPTIONS = {
+    "pool_size": settings.sqlite_pool_size,
+    "max_overflow": settings.sqlite_max_overflow,
+    "pool_timeout": settings.sqlite_pool_timeout
+}
 
 # 创建数据库引擎
 engine = create_engine(
     SQLALCHEMY_DATABASE_URL, 
     connect_args={"check_same_thread": False},
-    echo=False  # 设置为True可以看到SQL语句
+    echo=False,  # 设置为True可以看到SQL语句
+    **POOL_OPTIONS
 )
 
+# 异步数据库引擎（aiosqlite在独立线程中执行查询，不阻塞事件循环）
+# aiosqlite方言默认不使用连接池，每个会话都会新建连接和线程并重新应用PRAGMA，这里显式使用连接池
+async_engine = create_async_engine(ASYNC_DATABASE_URL, echo=False, poolclass=AsyncAdaptedQueuePool, **POOL_OPTIONS)
+
+def _wal_autocheckpoint() -> int:
+    if settings.sqlite_wal_autocheckpoint <= 0 and settings.sqlite_checkpoint_interval <= 0:
+        # 没有后台检查点时不能关闭自动检查点，否则WAL文件会无限增长
+        return 1000
+    return settings.sqlite_wal_autocheckpoint
+
+def apply_sqlite_pragmas(dbapi_connection, connection_record=None):
+    """新连接建立时应用性能配置（同步引擎和异步引擎共用）"""
+    cursor = dbapi_connection.cursor()
+    try:
+        cursor.execute(f"PRAGMA busy_timeout = {int(settings.sqlite_busy_timeout_ms)}")
+        cursor.execute(f"PRAGMA journal_mode = {settings.sqlite_journal_mode}")
+        cursor.execute(f"PRAGMA synchronous = {settings.sqlite_synchronous}")
+        cursor.execute(f"PRAGMA cache_size = -{int(settings.sqlite_cache_size_kb)}")
+        cursor.execute(f"PRAGMA mmap_size = {int(settings.sqlite_mmap_size)}")
+        cursor.execute("PRAGMA temp_store = MEMORY")
+        cursor.execute(f"PRAGMA wal_autocheckpoint = {_wal_autocheckpoint()}")
+        cursor.execute(f"PRAGMA journal_size_limit = {int(settings.sqlite_journal_size_limit)}")
+    finally:
+        cursor.close()
+
+event.listen(engine, "connect", apply_sqlite_pragmas)
+event.listen(async_engine.sync_engine, "connect", apply_sqlite_pragmas)
+
 # 创建会话工厂
+# 同步会话用于启动初始化、迁移脚本和在线程中执行的后台写入
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# 异步会话用于路由和认证依赖；提交后不过期对象，避免在事件循环中隐式重新加载
+AsyncSessionLocal = async_sessionmaker(async_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
 
 # 创建基类
 Base = declarative_base()
@@ -29,6 +73,25 @@ def get_db():
     finally:
         db.close()
 
+# 获取异步数据库会话的依赖函数
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+def checkpoint_wal(mode: str = "PASSIVE") -> Tuple[int, int, int]:
+    """执行WAL检查点
+
+    Args:
+        mode: PASSIVE（不等待读写，尽可能回写）或 TRUNCATE（等待读写结束，回写后清空WAL文件）
+
+    Returns:
+        (是否因繁忙未完成, WAL中的页数, 已回写的页数)
+    """
+    with engine.connect() as connection:
+        row = connection.exec_driver_sql(f"PRAGMA wal_checkpoint({mode})").fetchone()
+        connection.commit()
+    return tuple(row)
+
 # 创建所有表
 def create_tables():
     Base.metadata.create_all(bind=engine)
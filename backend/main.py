@@ -1,15 +1,31 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, ORJSONResponse
 from config import settings
-from routers import chat, settings as settings_router, auth, models
-from database import create_tables
+from routers import chat, settings as settings_router, auth, models, openai_compat, jobs, chat_ws
+from database import create_tables, async_engine
+from services.health_service import health_monitor
+from services.provider_router import provider_router
+from services.hedging import hedge_budget
+from services.metrics import metrics
+from services.concurrency import concurrency_controller
+from services.scheduler import fair_scheduler
+from services.admission import admission_controller
+from services.response_cache import response_cache
+from services.semantic_cache import semantic_cache
+from services.single_flight import single_flight
+from services.job_queue import job_queue
+from services.write_behind import write_behind
+from services.wal_checkpointer import wal_checkpointer
+from services.session_events import session_events
+from services.compression import CompressionMiddleware
 
 # 创建FastAPI应用
 app = FastAPI(
     title="NeuralChat API",
     description="NeuralChat AI对话系统后端API",
-    version="2.0.0"
+    version="2.0.0",
+    default_response_class=ORJSONResponse
 )
 
 # 应用启动时初始化数据库
@@ -44,6 +60,26 @@ async def startup_event():
         print(f"❌ 创建管理员账户失败: {e}")
     finally:
         db.close()
+    
+    # 启动模型健康探测
+    health_monitor.start()
+    admission_controller.start()
+    job_queue.start()
+    write_behind.start()
+    wal_checkpointer.start()
+    # 预先获取各供应商的模型列表，供故障转移构建备用链
+    provider_router.refresh_catalog()
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """应用关闭时的清理操作"""
+    await health_monitor.stop()
+    await admission_controller.stop()
+    await job_queue.stop()
+    # 最后停止写后持久化，写完排队中的会话和消息
+    await write_behind.stop()
+    await async_engine.dispose()
+    await wal_checkpointer.stop()
 
 # 添加CORS中间件
 app.add_middleware(
@@ -54,11 +90,17 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# 添加响应压缩中间件
+app.add_middleware(CompressionMiddleware)
+
 # 包含路由
 app.include_router(auth.router, prefix="/api/auth", tags=["认证"])
 app.include_router(chat.router)
+app.include_router(chat_ws.router)
 app.include_router(settings_router.router)
 app.include_router(models.router)
+app.include_router(openai_compat.router)
+app.include_router(jobs.router)
 
 @app.get("/")
 async def root():
@@ -72,12 +114,31 @@ async def root():
 @app.get("/health")
 async def health_check():
     """健康检查"""
+    load = admission_controller.status()
     return JSONResponse({
-        "status": "healthy",
+        "status": {"shedding": "overloaded", "degraded": "degraded"}.get(load["state"], "healthy"),
         "provider": settings.current_provider,
-        "model": settings.current_model
+        "model": settings.current_model,
+        "load": load
     })
 
+@app.get("/metrics")
+async def get_metrics():
+    """运行指标"""
+    snapshot = metrics.snapshot()
+    snapshot["hedging"] = hedge_budget.status()
+    snapshot["concurrency"] = concurrency_controller.status()
+    snapshot["scheduler"] = fair_scheduler.status()
+    snapshot["admission"] = admission_controller.status()
+    snapshot["response_cache"] = response_cache.status()
+    snapshot["semantic_cache"] = semantic_cache.status()
+    snapshot["single_flight"] = single_flight.status()
+    snapshot["jobs"] = job_queue.status()
+    snapshot["websocket"] = session_events.status()
+    snapshot["write_behind"] = write_behind.status()
+    snapshot["sqlite"] = wal_checkpointer.status()
+    return JSONResponse(snapshot)
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(
@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+"""
+数据库迁移脚本：添加消息备选回答分组字段
+"""
+
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from sqlalchemy import create_engine, text
+from database import SQLALCHEMY_DATABASE_URL
+
+def migrate_add_alternative_group_column():
+    """添加alternative_group字段到现有消息表"""
+    engine = create_engine(SQLALCHEMY_DATABASE_URL)
+    
+    try:
+        with engine.connect() as connection:
+            # 检查alternative_group字段是否已存在
+            result = connection.execute(text("""
+                SELECT COUNT(*) as count 
+                FROM pragma_table_info('messages') 
+                WHERE name = 'alternative_group'
+            """))
+            
+            count = result.fetchone()[0]
+            
+            if count == 0:
+                print("添加alternative_group字段到messages表...")
+                connection.execute(text("""
+                    ALTER TABLE messages 
+                    ADD COLUMN alternative_group VARCHAR(36)
+                """))
+                connection.execute(text("""
+                    CREATE INDEX IF NOT EXISTS ix_messages_alternative_group 
+                    ON messages (alternative_group)
+                """))
+                connection.commit()
+                print("✅ alternative_group字段添加成功")
+            else:
+                print("✅ alternative_group字段已存在，跳过迁移")
+                
+    except Exception as e:
+        print(f"❌ 迁移失败: {e}")
+        return False
+    
+    return True
+
+def main():
+    print("🚀 开始数据库迁移...")
+    
+    if migrate_add_alternative_group_column():
+        print("🎉 迁移完成！")
+    else:
+        print("❌ 数据库结构迁移失败")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+"""
+数据库迁移脚本：添加消息完成状态字段
+"""
+
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from sqlalchemy import create_engine, text
+from database import SQLALCHEMY_DATABASE_URL
+
+def migrate_add_is_complete_column():
+    """添加is_complete字段到现有消息表"""
+    engine = create_engine(SQLALCHEMY_DATABASE_URL)
+    
+    try:
+        with engine.connect() as connection:
+            # 检查is_complete字段是否已存在
+            result = connection.execute(text("""
+                SELECT COUNT(*) as count 
+                FROM pragma_table_info('messages') 
+                WHERE name = 'is_complete'
+            """))
+            
+            count = result.fetchone()[0]
+            
+            if count == 0:
+                print("添加is_complete字段到messages表...")
+                # 已有的消息都是完整保存的，默认值为1
+                connection.execute(text("""
+                    ALTER TABLE messages 
+                    ADD COLUMN is_complete BOOLEAN DEFAULT 1 NOT NULL
+                """))
+                connection.commit()
+                print("✅ is_complete字段添加成功")
+            else:
+                print("✅ is_complete字段已存在，跳过迁移")
+                
+    except Exception as e:
+        print(f"❌ 迁移失败: {e}")
+        return False
+    
+    return True
+
+def main():
+    print("🚀 开始数据库迁移...")
+    
+    if migrate_add_is_complete_column():
+        print("🎉 迁移完成！")
+    else:
+        print("❌ 数据库结构迁移失败")
+
+if __name__ == "__main__":
+    main()
@@ -26,11 +26,16 @@ class ChatRequest(BaseModel):
     model: Optional[str] = None
     stream: bool = True
     max_tokens: Optional[int] = None
+    temperature: Optional[float] = None
+    top_p: Optional[float] = None
+    cache: Optional[bool] = None  # 是否使用响应缓存，不指定时按全局配置
+    cache_ttl: Optional[int] = None  # 缓存有效期（秒），不指定时使用默认值
 
 class ChatResponse(BaseModel):
     content: str
     model: str
     finish_reason: Optional[str] = None
+    provider: Optional[str] = None  # 实际提供服务的供应商
 
 class ModelInfo(BaseModel):
     id: str
@@ -57,6 +62,16 @@ class SettingsUpdateRequest(BaseModel):
     api_key: Optional[str] = None
     base_url: Optional[str] = None
 
+class ApiKeyCreateRequest(BaseModel):
+    api_key: str
+    weight: int = 1
+    label: Optional[str] = None
+
+class ApiKeyUpdateRequest(BaseModel):
+    weight: Optional[int] = None
+    enabled: Optional[bool] = None
+    label: Optional[str] = None
+
 class ApiResponse(BaseModel):
     success: bool
     message: str
@@ -106,10 +121,40 @@ class MessageRecord(Base):
     timestamp = Column(DateTime(timezone=True), server_default=func.now())
     model_used = Column(String(100), nullable=True)
     token_count = Column(Integer, nullable=True)
+    alternative_group = Column(String(36), nullable=True, index=True)  # 同一问题的多个模型回答共享分组ID
+    is_complete = Column(Boolean, default=True, nullable=False)  # 流式回答中断时为False，内容为最后一个检查点
     
     # 关系
     chat_session = relationship("ChatSession", back_populates="messages")
 
+class ChatJob(Base):
+    __tablename__ = "chat_jobs"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    job_id = Column(String(36), unique=True, index=True, default=lambda: str(uuid.uuid4()))
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    status = Column(String(20), default="queued", index=True, nullable=False)  # queued, running, completed, failed, cancelled
+    request = Column(Text, nullable=False)  # ChatRequest（JSON）
+    model_used = Column(String(100), nullable=True)
+    provider = Column(String(50), nullable=True)
+    result = Column(Text, nullable=True)
+    error = Column(Text, nullable=True)
+    attempts = Column(Integer, default=0, nullable=False)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    started_at = Column(DateTime(timezone=True), nullable=True)
+    completed_at = Column(DateTime(timezone=True), nullable=True)
+
+class IdempotencyRecord(Base):
+    __tablename__ = "idempotency_keys"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    scope_key = Column(String(255), unique=True, index=True, nullable=False)  # 身份:接口:Idempotency-Key
+    request_hash = Column(String(64), nullable=False)
+    status = Column(String(20), default="in_progress", nullable=False)  # in_progress, completed
+    response = Column(Text, nullable=True)  # 完成后的响应（JSON）
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    expires_at = Column(DateTime, index=True, nullable=False)
+
 # ==================== 用户相关Pydantic模型 ====================
 
 class UserBase(BaseModel):
@@ -184,6 +229,8 @@ class MessageResponse(BaseModel):
     content: str
     timestamp: str
     model_used: Optional[str]
+    alternative_group: Optional[str] = None
+    is_complete: bool = True
     
     class Config:
         from_attributes = True
@@ -191,4 +238,49 @@ class MessageResponse(BaseModel):
 # ==================== 扩展的聊天请求模型 ====================
 
 class AuthenticatedChatRequest(ChatRequest):
-    session_id: Optional[str] = None  # 如果提供，则使用现有会话；否则创建新会话
\ No newline at end of file
+    session_id: Optional[str] = None  # 如果提供，则使用现有会话；否则创建新会话
+
+class BatchChatItem(ChatRequest):
+    id: Optional[str] = None  # 调用方的条目标识，原样返回
+
+class BatchChatRequest(BaseModel):
+    items: List[BatchChatItem]
+
+class CompareChatRequest(AuthenticatedChatRequest):
+    models: List[str]  # 参与对比的模型，同时生成
+# ==================== OpenAI兼容接口模型 ====================
+
+class OpenAIChatCompletionRequest(BaseModel):
+    """/v1/chat/completions 请求（支持的字段子集，其余字段忽略）"""
+    model: str
+    messages: List[ChatMessage]
+    stream: bool = False
+    max_tokens: Optional[int] = None
+    temperature: Optional[float] = None
+    top_p: Optional[float] = None
+    n: int = 1
+    user: Optional[str] = None
+
+    def to_chat_request(self) -> ChatRequest:
+        return ChatRequest(
+            messages=self.messages,
+            model=self.model,
+            stream=self.stream,
+            max_tokens=self.max_tokens,
+            temperature=self.temperature,
+            top_p=self.top_p
+        )
+
+# ==================== 异步任务模型 ====================
+
+class ChatJobResponse(BaseModel):
+    job_id: str
+    status: str
+    model_used: Optional[str] = None
+    provider: Optional[str] = None
+    result: Optional[str] = None
+    error: Optional[str] = None
+    attempts: int = 0
+    created_at: Optional[str] = None
+    started_at: Optional[str] = None
+    completed_at: Optional[str] = None
@@ -1,11 +1,12 @@
 from datetime import timedelta
 from fastapi import APIRouter, Depends, HTTPException, status
 from fastapi.security import HTTPAuthorizationCredentials
-from sqlalchemy.orm import Session
-from database import get_db
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from database import get_async_db
 from models import (
     User, UserCreate, UserLogin, UserResponse, UserUpdate, 
-    Token, ChatSession, ChatSessionResponse, UserRole
+    Token, ChatSession, ChatSessionResponse, UserRole, MessageRecord
 )
 from auth import (
     get_password_hash, authenticate_user, create_access_token,
@@ -13,13 +14,15 @@ from auth import (
     get_current_admin_user, check_admin_permission,
     ACCESS_TOKEN_EXPIRE_MINUTES
 )
+from services.serialization import trusted_response
+from services.write_behind import write_behind
 
 router = APIRouter()
 
 @router.post("/register", response_model=Token, summary="用户注册")
 async def register_user(
     user_data: UserCreate,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     用户注册接口
@@ -30,14 +33,14 @@ async def register_user(
     - **full_name**: 全名（可选）
     """
     # 检查用户名是否已存在
-    if get_user_by_username(db, user_data.username):
+    if await get_user_by_username(db, user_data.username):
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="用户名已存在"
         )
     
     # 检查邮箱是否已存在
-    if get_user_by_email(db, user_data.email):
+    if await get_user_by_email(db, user_data.email):
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="邮箱地址已注册"
@@ -53,8 +56,8 @@ async def register_user(
     )
     
     db.add(db_user)
-    db.commit()
-    db.refresh(db_user)
+    await db.commit()
+    await db.refresh(db_user)
     
     # 生成访问令牌
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
@@ -83,7 +86,7 @@ async def register_user(
 @router.post("/login", response_model=Token, summary="用户登录")
 async def login_user(
     login_data: UserLogin,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     用户登录接口
@@ -91,7 +94,7 @@ async def login_user(
     - **username**: 用户名
     - **password**: 密码
     """
-    user = authenticate_user(db, login_data.username, login_data.password)
+    user = await authenticate_user(db, login_data.username, login_data.password)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -142,13 +145,13 @@ async def get_current_user_info(
 async def update_current_user(
     user_update: UserUpdate,
     current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """更新当前登录用户的信息"""
     
     # 检查邮箱是否已被其他用户使用
     if user_update.email and user_update.email != current_user.email:
-        existing_user = get_user_by_email(db, user_update.email)
+        existing_user = await get_user_by_email(db, user_update.email)
         if existing_user and existing_user.id != current_user.id:
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
@@ -161,8 +164,8 @@ async def update_current_user(
     if user_update.email is not None:
         current_user.email = user_update.email
     
-    db.commit()
-    db.refresh(current_user)
+    await db.commit()
+    await db.refresh(current_user)
     
     return UserResponse(
         id=current_user.id,
@@ -177,18 +180,26 @@ async def update_current_user(
 @router.get("/sessions", response_model=list[ChatSessionResponse], summary="获取用户的聊天会话列表")
 async def get_user_sessions(
     current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """获取当前用户的所有聊天会话"""
-    sessions = db.query(ChatSession).filter(
-        ChatSession.user_id == current_user.id,
-        ChatSession.is_active == True
-    ).order_by(ChatSession.updated_at.desc()).all()
+    # 读己之写：先等待该用户排队中的会话和消息写入提交
+    await write_behind.wait_user(current_user.id)
+    # 消息数量用子查询在同一条语句中统计，不逐个加载会话的消息
+    message_count = (
+        select(func.count(MessageRecord.id))
+        .where(MessageRecord.session_id == ChatSession.id)
+        .correlate(ChatSession)
+        .scalar_subquery()
+    )
+    rows = await db.execute(
+        select(ChatSession, message_count)
+        .where(ChatSession.user_id == current_user.id, ChatSession.is_active == True)
+        .order_by(ChatSession.updated_at.desc())
+    )
     
     session_responses = []
-    for session in sessions:
-        # 计算消息数量
-        message_count = len(session.messages)
+    for session, message_count in rows:
         
         session_response = ChatSessionResponse(
             id=session.id,
@@ -203,7 +214,7 @@ async def get_user_sessions(
         )
         session_responses.append(session_response)
     
-    return session_responses
+    return trusted_response(session_responses)
 
 @router.post("/logout", summary="用户登出")
 async def logout_user():
@@ -218,10 +229,10 @@ async def logout_user():
 @router.get("/users", response_model=list[UserResponse], summary="获取所有用户（管理员）")
 async def get_all_users(
     current_user: User = Depends(get_current_admin_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """获取所有用户列表（仅管理员可访问）"""
-    users = db.query(User).all()
+    users = (await db.scalars(select(User))).all()
     
     user_responses = []
     for user in users:
@@ -243,10 +254,10 @@ async def update_user_role(
     user_id: int,
     role: UserRole,
     current_user: User = Depends(get_current_admin_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """更新用户角色（仅管理员可访问）"""
-    user = db.query(User).filter(User.id == user_id).first()
+    user = await db.get(User, user_id)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -261,8 +272,8 @@ async def update_user_role(
         )
     
     user.role = role
-    db.commit()
-    db.refresh(user)
+    await db.commit()
+    await db.refresh(user)
     
     return {"message": f"用户 {user.username} 的角色已更新为 {role}"}
 
@@ -271,10 +282,10 @@ async def update_user_status(
     user_id: int,
     is_active: bool,
     current_user: User = Depends(get_current_admin_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """更新用户状态（仅管理员可访问）"""
-    user = db.query(User).filter(User.id == user_id).first()
+    user = await db.get(User, user_id)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -289,8 +300,8 @@ async def update_user_status(
         )
     
     user.is_active = is_active
-    db.commit()
-    db.refresh(user)
+    await db.commit()
+    await db.refresh(user)
     
     status_text = "启用" if is_active else "禁用"
     return {"message": f"用户 {user.username} 已{status_text}"}
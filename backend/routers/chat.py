@@ -1,125 +1,460 @@
-from fastapi import APIRouter, HTTPException, Depends
+from fastapi import APIRouter, HTTPException, Depends, Header, Request, Response
 from fastapi.responses import StreamingResponse
-from typing import List, Optional
-from sqlalchemy.orm import Session
-import json
+from typing import AsyncIterator, List, Optional
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+import asyncio
+import time
 import uuid
-from datetime import datetime
+from functools import partial
 from models import (
     ChatRequest, ChatResponse, ModelInfo, ApiResponse, AuthenticatedChatRequest,
     User, ChatSession, MessageRecord, ChatSessionCreate, ChatSessionResponse,
-    MessageResponse
+    MessageResponse, BatchChatRequest, BatchChatItem, CompareChatRequest
 )
 from services.openai_service import openai_service
-from auth import get_optional_user, get_current_active_user
-from database import get_db
+from services.provider_router import provider_router
+from services.retry import UpstreamError
+from services.rate_limiter import rate_limiter, RateLimitExceeded
+from services.admission import admission_controller, ServiceOverloaded, StreamGuard
+from services.chat_cache import lookup_chat_cache
+from services.chat_pipeline import complete_chat, stream_chat
+from services.idempotency import (
+    idempotency_store, hash_request, IdempotencyConflict, IdempotencyState, NEW, COMPLETED
+)
+from services.token_counter import estimate_tokens
+from services.metrics import metrics
+from services.session_events import session_events
+from services.checkpoint import MessageCheckpointWriter
+from services.write_behind import write_behind
+from services.framing import FrameEncoder, negotiate_encoder
+from services.serialization import dumps, trusted_response
+from auth import get_optional_user, get_current_active_user, check_rate_limit
+from database import AsyncSessionLocal, get_async_db
+from config import settings
 
 router = APIRouter(prefix="/api/chat", tags=["chat"])
 
-@router.post("/stream")
-async def chat_stream(
-    request: AuthenticatedChatRequest,
-    user: Optional[User] = Depends(get_optional_user),
-    db: Session = Depends(get_db)
-):
-    """流式聊天接口（支持用户会话）"""
+def admit_request(request: ChatRequest):
+    """过载保护准入：过载时返回503，降级时改用降级模型"""
     try:
-        # 获取或创建会话
-        session = None
-        if user and request.session_id:
-            # 查找现有会话
-            session = db.query(ChatSession).filter(
+        admission = admission_controller.admit(request.model)
+    except ServiceOverloaded as e:
+        raise HTTPException(status_code=503, detail=str(e), headers=e.headers())
+    if admission.degraded_model:
+        request.model = admission.degraded_model
+    return admission
+
+async def _begin_idempotency(http_request: Request, user: Optional[User], endpoint: str,
+                       key: Optional[str], request) -> Optional[IdempotencyState]:
+    """登记请求的Idempotency-Key，未携带时返回None"""
+    if not key:
+        return None
+    if len(key) > 128:
+        raise HTTPException(status_code=400, detail="Idempotency-Key过长")
+    identity = rate_limiter.identity(user, http_request.client.host if http_request.client else None)
+    try:
+        return await idempotency_store.begin(idempotency_store.scope(identity, endpoint, key), hash_request(request))
+    except IdempotencyConflict as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+
+# 流式响应头
+STREAM_HEADERS = {
+    "Cache-Control": "no-cache",
+    "Connection": "keep-alive",
+    "Access-Control-Allow-Origin": "*",
+    "Access-Control-Allow-Methods": "GET, POST, OPTIONS",
+    "Access-Control-Allow-Headers": "Content-Type"
+}
+
+async def _prepare_session(user: Optional[User], request: AuthenticatedChatRequest) -> Optional[ChatSession]:
+    """获取或创建登录用户的会话，并保存最后一条用户消息；未登录时返回None
+    
+    新会话和用户消息通过写后持久化队列保存，不等待提交；查询会话使用独立的短时数据库会话，
+    不在流式响应期间占用连接池中的连接
+    """
+    if not user:
+        return None
+    
+    # 查找现有会话
+    session = None
+    if request.session_id:
+        await write_behind.wait_session(request.session_id)
+        async with AsyncSessionLocal() as db:
+            session = await db.scalar(select(ChatSession).where(
                 ChatSession.session_id == request.session_id,
                 ChatSession.user_id == user.id,
                 ChatSession.is_active == True
-            ).first()
-        
-        # 如果用户已登录但没有指定会话，创建新会话
-        if user and not session:
-            session = ChatSession(
-                user_id=user.id,
-                title="新对话",
-                model_used=request.model or "default"
+            ).limit(1))
+    
+    # 没有指定会话或会话不存在时，创建新会话
+    if not session:
+        session, _ = write_behind.create_session(user.id, "新对话", request.model or "default")
+    
+    # 保存用户消息
+    if request.messages:
+        last_message = request.messages[-1]
+        if last_message.role == "user":
+            write_behind.add_message(
+                session,
+                role=last_message.role,
+                content=last_message.content,
+                model_used=request.model or "default",
+                token_count=estimate_tokens(last_message.content)
             )
-            db.add(session)
-            db.commit()
-            db.refresh(session)
+    return session
+
+async def encode_frames(events: AsyncIterator[dict], encoder: FrameEncoder) -> AsyncIterator:
+    """按协商的帧格式编码事件流"""
+    async for event in events:
+        # 升级前保存的幂等重放记录是已编码的SSE文本帧，原样输出
+        yield event if isinstance(event, str) else encoder.encode(event)
+
+async def chat_events(request: ChatRequest, cache, session: Optional[ChatSession], stream_meta: dict, user: Optional[User] = None,
+                      rate_identity: Optional[str] = None) -> AsyncIterator[dict]:
+    """会话聊天的事件序列：会话ID、供应商、增量内容和结束标记
+    
+    有会话时，开始生成即创建未完成的助手消息，生成过程中按检查点追加内容，结束时标记完成；
+    中途断开的回答保留已生成的部分并保持未完成状态。流式接口和WebSocket共用，由调用方负责编码输出
+    """
+    writer = None
+    if session:
+        writer = MessageCheckpointWriter.create(session, request.model or "default")
+    
+    provider_sent = False
+    finished = False
+    try:
+        # 发送会话ID（如果有）
+        if session:
+            yield {'session_id': session.session_id, 'type': 'session'}
         
-        # 保存用户消息（如果有会话）
-        user_message = None
-        if session and request.messages:
-            last_message = request.messages[-1]
-            if last_message.role == "user":
-                user_message = MessageRecord(
-                    session_id=session.id,
-                    role=last_message.role,
-                    content=last_message.content,
-                    model_used=request.model or "default"
-                )
-                db.add(user_message)
-                db.commit()
+        # 处理AI响应
+        async for chunk in stream_chat(request, cache, stream_meta, user, rate_identity):
+            # 首个token到达后告知实际提供服务的供应商
+            if not provider_sent and stream_meta.get('provider'):
+                provider_sent = True
+                yield {
+                    'provider': stream_meta['provider'],
+                    'queue_wait_ms': round(stream_meta.get('queue_wait', 0) * 1000, 2),
+                    'type': 'provider'
+                }
+            if writer:
+                writer.append(chunk)
+            yield {'content': chunk, 'type': 'content'}
+        finished = True
+    finally:
+        if writer and not finished:
+            writer.interrupt()
+    
+    # 保存AI响应（如果有会话）
+    if writer and writer.finish(
+        stream_meta.get('completed', False),
+        stream_meta.get('usage', {}).get('completion_tokens')
+    ):
+        # 更新会话的更新时间
+        write_behind.touch_session(session)
+        session_events.publish_session(session)
+    
+    # 发送结束标记
+    yield {'type': 'end'}
+
+@router.post("/stream")
+async def chat_stream(
+    request: AuthenticatedChatRequest,
+    http_request: Request,
+    user: Optional[User] = Depends(get_optional_user),
+    rate_identity: Optional[str] = Depends(check_rate_limit),
+    idempotency_key: Optional[str] = Header(None)
+):
+    """流式聊天接口（支持用户会话）
+    
+    携带Idempotency-Key重试时，挂接到处理中的输出流或重放已完成的输出，不会重复调用上游或写入消息
+    """
+    idempotency = await _begin_idempotency(http_request, user, "chat.stream", idempotency_key, request)
+    encoder = negotiate_encoder(http_request.headers.get("accept"), media_type="text/plain")
+    if idempotency and idempotency.status != NEW:
+        return StreamingResponse(
+            encode_frames(idempotency_store.attach_stream(idempotency.scope_key), encoder),
+            media_type=encoder.media_type,
+            headers={**STREAM_HEADERS, "Idempotent-Replayed": "true"}
+        )
+    
+    try:
+        admission = admit_request(request)
+    except HTTPException:
+        if idempotency:
+            await idempotency_store.abandon(idempotency.scope_key)
+        raise
+    try:
+        cache = await lookup_chat_cache(request, user)
+        session = await _prepare_session(user, request)
         
-        # 准备AI响应
-        ai_response_content = ""
+        stream_meta = {}
         
         async def generate():
-            nonlocal ai_response_content
-            
-            # 发送会话ID（如果有）
-            if session:
-                yield f"data: {json.dumps({'session_id': session.session_id, 'type': 'session'})}\n\n"
-            
-            # 处理AI响应
-            async for chunk in openai_service.chat_stream(request):
-                ai_response_content += chunk
-                # 返回SSE格式的数据
-                yield f"data: {json.dumps({'content': chunk, 'type': 'content'})}\n\n"
-            
-            # 保存AI响应（如果有会话）
-            if session and ai_response_content.strip():
-                ai_message = MessageRecord(
-                    session_id=session.id,
-                    role="assistant",
-                    content=ai_response_content.strip(),
-                    model_used=request.model or "default"
-                )
-                db.add(ai_message)
-                db.commit()
-                
-                # 更新会话的更新时间
-                session.updated_at = datetime.utcnow()
-                db.commit()
-            
-            # 发送结束标记
-            yield f"data: {json.dumps({'type': 'end'})}\n\n"
+            try:
+                async for event in chat_events(request, cache, session, stream_meta, user, rate_identity):
+                    yield event
+            finally:
+                admission.release()
         
-        return StreamingResponse(
-            generate(),
-            media_type="text/plain",
-            headers={
-                "Cache-Control": "no-cache",
-                "Connection": "keep-alive",
-                "Access-Control-Allow-Origin": "*",
-                "Access-Control-Allow-Methods": "GET, POST, OPTIONS",
-                "Access-Control-Allow-Headers": "Content-Type"
-            }
+        headers = dict(STREAM_HEADERS)
+        if admission.degraded_model:
+            headers["X-Degraded-Model"] = admission.degraded_model
+        headers.update(cache.headers())
+        
+        if idempotency:
+            # 客户端断开后继续生成并保存，重试时可以挂接或重放
+            body = idempotency_store.run_stream(
+                idempotency.scope_key, generate,
+                lambda: cache.hit or stream_meta.get('completed', False)
+            )
+        else:
+            body = generate()
+        guard = StreamGuard(
+            admission,
+            partial(idempotency_store.abandon, idempotency.scope_key) if idempotency else None
         )
+        return StreamingResponse(guard.wrap(encode_frames(body, encoder)), media_type=encoder.media_type,
+                                 headers=headers, background=guard.background())
     except Exception as e:
+        admission.release()
+        if idempotency:
+            await idempotency_store.abandon(idempotency.scope_key)
         raise HTTPException(status_code=500, detail=str(e))
 
+async def _run_chat(request: ChatRequest, response: Response, user: Optional[User],
+                    rate_identity: Optional[str]) -> ChatResponse:
+    """执行非流式聊天：缓存、相同请求合并、上游调用和配额扣除"""
+    chat_meta = {}
+    content = await complete_chat(request, chat_meta, user, rate_identity)
+    response.headers.update(chat_meta["cache"].headers())
+    return ChatResponse(
+        content=content,
+        model=request.model or "default",
+        finish_reason="stop",
+        provider=chat_meta.get("provider")
+    )
+
 @router.post("/", response_model=ChatResponse)
-async def chat(request: ChatRequest):
+async def chat(
+    request: ChatRequest,
+    response: Response,
+    http_request: Request,
+    user: Optional[User] = Depends(get_optional_user),
+    rate_identity: Optional[str] = Depends(check_rate_limit),
+    idempotency_key: Optional[str] = Header(None)
+):
     """非流式聊天接口"""
+    idempotency = await _begin_idempotency(http_request, user, "chat", idempotency_key, request)
     try:
-        content = await openai_service.chat(request)
-        return ChatResponse(
-            content=content,
-            model=request.model or "default",
-            finish_reason="stop"
-        )
+        if idempotency and idempotency.status != NEW:
+            response.headers["Idempotent-Replayed"] = "true"
+            if idempotency.status == COMPLETED:
+                return ChatResponse(**idempotency.response)
+            result = await idempotency_store.attach_call(idempotency.scope_key)
+            if result is None:
+                raise HTTPException(status_code=409, detail="相同Idempotency-Key的请求处理失败，请重试")
+            return ChatResponse(**result)
+        
+        try:
+            admission = admit_request(request)
+        except HTTPException:
+            if idempotency:
+                await idempotency_store.abandon(idempotency.scope_key)
+            raise
+        try:
+            if idempotency:
+                result = await idempotency_store.run_call(
+                    idempotency.scope_key,
+                    lambda: _run_chat(request, response, user, rate_identity)
+                )
+            else:
+                result = await _run_chat(request, response, user, rate_identity)
+            return trusted_response(result, headers=dict(response.headers))
+        finally:
+            admission.release()
+    except HTTPException:
+        raise
+    except UpstreamError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e), headers=e.headers())
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@router.post("/batch")
+async def chat_batch(
+    batch: BatchChatRequest,
+    user: User = Depends(get_current_active_user),
+    rate_identity: Optional[str] = Depends(check_rate_limit)
+):
+    """批量聊天接口
+    
+    条目并发执行（受单批并发数和供应商并发限制约束），每完成一条即以NDJSON输出一行结果；
+    单个条目失败只影响该条目。每个条目按一次请求计入限流，开始前检查当天token配额，
+    超出配额的条目返回429而不调用上游
+    """
+    if not batch.items:
+        raise HTTPException(status_code=400, detail="批量请求不能为空")
+    if len(batch.items) > settings.batch_max_items:
+        raise HTTPException(status_code=400, detail=f"批量请求最多 {settings.batch_max_items} 条")
+    
+    try:
+        admission = admission_controller.admit()
+    except ServiceOverloaded as e:
+        raise HTTPException(status_code=503, detail=str(e), headers=e.headers())
+    
+    semaphore = asyncio.Semaphore(settings.batch_max_concurrency)
+    
+    async def run_item(index: int, item: BatchChatItem) -> dict:
+        if admission.degraded_model:
+            item.model = admission.degraded_model
+        result = {"index": index, "id": item.id, "model": item.model or settings.current_model}
+        async with semaphore:
+            start_time = time.perf_counter()
+            try:
+                # 第一个条目已由本次请求的限流检查计入
+                if rate_identity and index > 0:
+                    await rate_limiter.check(rate_identity)
+                item_meta = {}
+                content = await complete_chat(item, item_meta, user, rate_identity)
+                result.update({
+                    "success": True,
+                    "content": content,
+                    "provider": item_meta.get("provider"),
+                    "cached": item_meta["cache"].hit,
+                    "usage": item_meta.get("usage")
+                })
+            except RateLimitExceeded as e:
+                result.update({"success": False, "error": str(e), "status_code": 429,
+                               "retry_after": round(e.retry_after, 2)})
+            except UpstreamError as e:
+                result.update({"success": False, "error": str(e), "status_code": e.status_code})
+            except Exception as e:
+                result.update({"success": False, "error": str(e), "status_code": 500})
+            result["latency_ms"] = round((time.perf_counter() - start_time) * 1000, 2)
+        return result
+    
+    async def generate():
+        tasks = [asyncio.create_task(run_item(index, item)) for index, item in enumerate(batch.items)]
+        try:
+            for finished in asyncio.as_completed(tasks):
+                yield dumps(await finished) + b"\n"
+        finally:
+            # 客户端断开时取消未完成的条目
+            for task in tasks:
+                task.cancel()
+            admission.release()
+    
+    guard = StreamGuard(admission)
+    return StreamingResponse(guard.wrap(generate()), media_type="application/x-ndjson",
+                             headers={"Cache-Control": "no-cache"}, background=guard.background())
+
+@router.post("/compare")
+async def chat_compare(
+    request: CompareChatRequest,
+    http_request: Request,
+    user: Optional[User] = Depends(get_optional_user),
+    rate_identity: Optional[str] = Depends(check_rate_limit)
+):
+    """多模型对比接口
+    
+    同一对话同时发送给多个模型，各模型的增量交错输出到同一个SSE流，帧中的model和index标明来源；
+    每个模型结束时输出首token延迟和总耗时。登录用户的各模型回答作为同一问题的备选回答保存到会话
+    """
+    models = list(dict.fromkeys(request.models))
+    if len(models) < 2:
+        raise HTTPException(status_code=400, detail="至少需要两个不同的模型")
+    if len(models) > settings.compare_max_models:
+        raise HTTPException(status_code=400, detail=f"最多同时对比 {settings.compare_max_models} 个模型")
+    
+    try:
+        admission = admission_controller.admit()
+    except ServiceOverloaded as e:
+        raise HTTPException(status_code=503, detail=str(e), headers=e.headers())
+    if admission.degraded_model:
+        # 降级时所有模型都会被替换为降级模型，对比没有意义
+        admission.release()
+        raise HTTPException(status_code=503, detail="服务繁忙，暂不支持多模型对比",
+                            headers={"Retry-After": str(settings.admission_retry_after)})
+    
+    try:
+        session = await _prepare_session(user, request)
+    except Exception as e:
+        admission.release()
+        raise HTTPException(status_code=500, detail=str(e))
+    
+    frames: asyncio.Queue = asyncio.Queue()
+    start_time = time.perf_counter()
+    
+    encoder = negotiate_encoder(http_request.headers.get("accept"))
+    
+    async def run_model(index: int, model: str) -> dict:
+        model_request = request.model_copy(update={"model": model})
+        model_meta = {}
+        parts: List[str] = []
+        result = {"index": index, "model": model, "ttft_ms": None}
+        try:
+            cache = await lookup_chat_cache(model_request, user)
+            async for chunk in stream_chat(model_request, cache, model_meta, user, rate_identity):
+                if model_meta.get("error"):
+                    break
+                if not parts:
+                    result["ttft_ms"] = round((time.perf_counter() - start_time) * 1000, 2)
+                    metrics.observe("compare.ttft", result["ttft_ms"] / 1000, model=provider_router.model_label(model))
+                parts.append(chunk)
+                await frames.put({"type": "content", "index": index, "model": model, "content": chunk})
+        except Exception as e:
+            model_meta["error"] = str(e)
+        result.update({
+            "content": "".join(parts),
+            "provider": model_meta.get("provider"),
+            "error": model_meta.get("error"),
+            "completion_tokens": model_meta.get("usage", {}).get("completion_tokens"),
+            "latency_ms": round((time.perf_counter() - start_time) * 1000, 2)
+        })
+        metrics.observe("compare.latency", result["latency_ms"] / 1000, model=provider_router.model_label(model))
+        await frames.put({"type": "done", **{k: v for k, v in result.items() if k != "content"}})
+        return result
+    
+    async def generate():
+        tasks = [asyncio.create_task(run_model(index, model)) for index, model in enumerate(models)]
+        try:
+            if session:
+                yield encoder.encode({"type": "session", "session_id": session.session_id})
+            pending = len(tasks)
+            while pending:
+                data = await frames.get()
+                if data["type"] == "done":
+                    pending -= 1
+                yield encoder.encode(data)
+            results = [task.result() for task in tasks]
+            
+            # 各模型的回答作为备选回答保存，共享同一个分组ID
+            alternative_group = str(uuid.uuid4())
+            if session and any(result["content"].strip() for result in results):
+                for result in results:
+                    if result["content"].strip():
+                        write_behind.add_message(
+                            session,
+                            role="assistant",
+                            content=result["content"].strip(),
+                            model_used=result["model"],
+                            token_count=result["completion_tokens"],
+                            alternative_group=alternative_group
+                        )
+                write_behind.touch_session(session)
+                session_events.publish_session(session)
+            yield encoder.encode({"type": "end", "alternative_group": alternative_group if session else None})
+        finally:
+            # 客户端断开时取消未完成的模型
+            for task in tasks:
+                task.cancel()
+            admission.release()
+    
+    guard = StreamGuard(admission)
+    return StreamingResponse(guard.wrap(generate()), media_type=encoder.media_type,
+                             headers=STREAM_HEADERS, background=guard.background())
+
 @router.get("/models", response_model=List[ModelInfo])
 async def get_models(provider: Optional[str] = None):
     """获取可用模型列表
@@ -129,7 +464,7 @@ async def get_models(provider: Optional[str] = None):
     """
     try:
         models = await openai_service.get_models(provider)
-        return [ModelInfo(**model) for model in models]
+        return trusted_response([ModelInfo(**model) for model in models])
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -147,19 +482,25 @@ async def reload_config():
 @router.post("/sessions", response_model=ChatSessionResponse)
 async def create_session(
     session_data: ChatSessionCreate,
+    http_request: Request,
     user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    idempotency_key: Optional[str] = Header(None)
 ):
-    """创建新的聊天会话"""
-    session = ChatSession(
-        user_id=user.id,
-        title=session_data.title
-    )
-    db.add(session)
-    db.commit()
-    db.refresh(session)
+    """创建新的聊天会话（携带Idempotency-Key重试时返回同一个会话）"""
+    idempotency = await _begin_idempotency(http_request, user, "sessions.create", idempotency_key, session_data)
+    if idempotency and idempotency.status == COMPLETED:
+        return ChatSessionResponse(**idempotency.response)
     
-    return ChatSessionResponse(
+    try:
+        session, saved = write_behind.create_session(user.id, session_data.title)
+        # 响应中包含会话主键，等待这次写入随批量事务提交
+        await saved
+    except Exception:
+        if idempotency:
+            await idempotency_store.abandon(idempotency.scope_key)
+        raise
+    
+    session_response = ChatSessionResponse(
         id=session.id,
         session_id=session.session_id,
         user_id=session.user_id,
@@ -170,67 +511,83 @@ async def create_session(
         is_active=session.is_active,
         message_count=0
     )
+    if idempotency:
+        await idempotency_store.complete(idempotency.scope_key, session_response.model_dump(mode="json"))
+    return trusted_response(session_response)
 
 @router.get("/sessions/{session_id}/messages", response_model=List[MessageResponse])
 async def get_session_messages(
     session_id: str,
     user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """获取会话的消息历史"""
+    # 读己之写：先等待该会话排队中的写入提交
+    await write_behind.wait_session(session_id)
+    
     # 验证会话所有权
-    session = db.query(ChatSession).filter(
+    session = await db.scalar(select(ChatSession).where(
         ChatSession.session_id == session_id,
         ChatSession.user_id == user.id,
         ChatSession.is_active == True
-    ).first()
+    ).limit(1))
     
     if not session:
         raise HTTPException(status_code=404, detail="会话不存在")
     
     # 获取消息
-    messages = db.query(MessageRecord).filter(
-        MessageRecord.session_id == session.id
-    ).order_by(MessageRecord.timestamp.asc()).all()
+    # 只查询需要的列，结果行在事件循环中处理，不构造ORM对象
+    messages = (await db.execute(
+        select(
+            MessageRecord.id, MessageRecord.role, MessageRecord.content, MessageRecord.timestamp,
+            MessageRecord.model_used, MessageRecord.alternative_group, MessageRecord.is_complete
+        )
+        .where(MessageRecord.session_id == session.id)
+        .order_by(MessageRecord.timestamp.asc(), MessageRecord.id.asc())
+    )).all()
     
-    return [
+    return trusted_response([
         MessageResponse(
             id=msg.id,
             role=msg.role,
             content=msg.content,
             timestamp=msg.timestamp.isoformat(),
-            model_used=msg.model_used
+            model_used=msg.model_used,
+            alternative_group=msg.alternative_group,
+            is_complete=msg.is_complete
         )
         for msg in messages
-    ]
+    ])
 
 @router.put("/sessions/{session_id}", response_model=ChatSessionResponse)
 async def update_session(
     session_id: str,
     session_update: ChatSessionCreate,
     user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """更新聊天会话信息"""
-    session = db.query(ChatSession).filter(
+    await write_behind.wait_session(session_id)
+    session = await db.scalar(select(ChatSession).where(
         ChatSession.session_id == session_id,
         ChatSession.user_id == user.id,
         ChatSession.is_active == True
-    ).first()
+    ).limit(1))
     
     if not session:
         raise HTTPException(status_code=404, detail="会话不存在")
     
     session.title = session_update.title
-    db.commit()
-    db.refresh(session)
+    await db.commit()
+    await db.refresh(session)
+    session_events.publish_session(session)
     
     # 计算消息数量
-    message_count = db.query(MessageRecord).filter(
-        MessageRecord.session_id == session.id
-    ).count()
+    message_count = await db.scalar(
+        select(func.count(MessageRecord.id)).where(MessageRecord.session_id == session.id)
+    )
     
-    return ChatSessionResponse(
+    return trusted_response(ChatSessionResponse(
         id=session.id,
         session_id=session.session_id,
         user_id=session.user_id,
@@ -240,26 +597,28 @@ async def update_session(
         updated_at=session.updated_at.isoformat() if session.updated_at else None,
         is_active=session.is_active,
         message_count=message_count
-    )
+    ))
 
 @router.delete("/sessions/{session_id}")
 async def delete_session(
     session_id: str,
     user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """删除聊天会话"""
-    session = db.query(ChatSession).filter(
+    await write_behind.wait_session(session_id)
+    session = await db.scalar(select(ChatSession).where(
         ChatSession.session_id == session_id,
         ChatSession.user_id == user.id,
         ChatSession.is_active == True
-    ).first()
+    ).limit(1))
     
     if not session:
         raise HTTPException(status_code=404, detail="会话不存在")
     
     # 软删除：设置为不活跃
     session.is_active = False
-    db.commit()
+    await db.commit()
+    session_events.publish_session(session, "deleted")
     
     return ApiResponse(success=True, message="会话已删除")
\ No newline at end of file
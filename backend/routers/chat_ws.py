@@ -0,0 +1,178 @@
+from fastapi import APIRouter, HTTPException, WebSocket, WebSocketDisconnect
+from pydantic import ValidationError
+from typing import Any, Dict, Optional
+import asyncio
+import json
+from models import AuthenticatedChatRequest, User
+from services.chat_cache import lookup_chat_cache
+from services.rate_limiter import rate_limiter, RateLimitExceeded
+from services.session_events import session_events
+from services.framing import msgpack, MSGPACK_SUBPROTOCOL, pack_event, unpack_event
+from services.serialization import dumps
+from auth import get_user_from_token
+from database import AsyncSessionLocal
+from config import settings
+from routers.chat import admit_request, chat_events, _prepare_session
+
+router = APIRouter(prefix="/api/chat", tags=["chat"])
+
+async def _receive(websocket: WebSocket) -> Any:
+    """接收一条消息：文本消息按JSON解析，二进制消息按MessagePack解析
+
+    Raises:
+        ValueError: 消息无法解析
+        WebSocketDisconnect: 连接已断开
+    """
+    message = await websocket.receive()
+    if message["type"] == "websocket.disconnect":
+        raise WebSocketDisconnect(message.get("code", 1000))
+    if message.get("bytes") is not None:
+        if msgpack is None:
+            raise ValueError("不支持二进制消息")
+        try:
+            return unpack_event(message["bytes"])
+        except Exception:
+            raise ValueError("消息不是有效的MessagePack")
+    try:
+        return json.loads(message["text"])
+    except ValueError:
+        raise ValueError("消息不是有效的JSON")
+
+async def _authenticate(websocket: WebSocket, token: Optional[str]) -> Optional[User]:
+    """连接级认证：查询参数中的token，或连接后的第一条auth消息"""
+    if not token:
+        try:
+            message = await asyncio.wait_for(_receive(websocket), settings.ws_auth_timeout)
+        except (asyncio.TimeoutError, ValueError, WebSocketDisconnect):
+            return None
+        if not isinstance(message, dict) or message.get("type") != "auth":
+            return None
+        token = message.get("token")
+    if not token:
+        return None
+    # 关闭会话时用户对象脱离会话，已加载的属性在连接期间继续使用
+    async with AsyncSessionLocal() as db:
+        return await get_user_from_token(token, db)
+
+@router.websocket("/ws")
+async def chat_websocket(websocket: WebSocket, token: Optional[str] = None):
+    """WebSocket聊天接口
+
+    一个连接只认证一次，可同时进行多个生成，并接收会话更新推送。
+
+    客户端消息：
+        {"type": "auth", "token": "..."}  未在查询参数中提供token时，作为第一条消息
+        {"type": "chat", "id": "...", "request": {...}}  开始生成，request与/stream的请求体相同
+        {"type": "cancel", "id": "..."}  取消生成
+        {"type": "ping"}
+    服务端消息与/stream的事件相同并带上生成的id，另有 error、cancelled、pong 和 session_updated。
+    握手时请求子协议 msgpack 的连接以二进制MessagePack消息收发，消息格式与流式接口的MessagePack帧相同
+    （WebSocket消息自带长度，不加长度前缀）
+    """
+    binary = msgpack is not None and MSGPACK_SUBPROTOCOL in websocket.scope.get("subprotocols", [])
+    await websocket.accept(subprotocol=MSGPACK_SUBPROTOCOL if binary else None)
+    user = await _authenticate(websocket, token)
+    if user is None:
+        await websocket.close(code=1008, reason="认证失败")
+        return
+
+    client_host = websocket.client.host if websocket.client else None
+    rate_identity = None if rate_limiter.is_exempt(user) else rate_limiter.identity(user, client_host)
+    outgoing: asyncio.Queue = asyncio.Queue()
+    generations: Dict[str, asyncio.Task] = {}
+
+    async def writer():
+        # 所有输出经同一协程发送，避免并发写入
+        try:
+            while True:
+                event = await outgoing.get()
+                if binary:
+                    await websocket.send_bytes(pack_event(event))
+                else:
+                    await websocket.send_text(dumps(event).decode("utf-8"))
+        except (WebSocketDisconnect, RuntimeError):
+            # 连接已关闭，由接收循环负责清理
+            pass
+
+    def send_error(gen_id: Any, status_code: int, detail: str, **extra):
+        outgoing.put_nowait({"type": "error", "id": gen_id, "status_code": status_code, "detail": detail, **extra})
+
+    async def run_generation(gen_id: str, request: AuthenticatedChatRequest):
+        try:
+            cache = await lookup_chat_cache(request, user)
+            session = await _prepare_session(user, request)
+            stream_meta = {}
+            async for event in chat_events(request, cache, session, stream_meta, user, rate_identity):
+                outgoing.put_nowait({**event, "id": gen_id})
+        except Exception as e:
+            send_error(gen_id, 500, str(e))
+
+    def finish_generation(gen_id: str, task: asyncio.Task, admission):
+        # 在完成回调中清理，开始执行前就被取消的生成也会释放准入
+        admission.release()
+        generations.pop(gen_id, None)
+        if task.cancelled():
+            outgoing.put_nowait({"type": "cancelled", "id": gen_id})
+
+    async def start_generation(message: Dict[str, Any]):
+        gen_id = message.get("id")
+        if not isinstance(gen_id, str) or not gen_id:
+            send_error(gen_id, 400, "缺少生成id")
+            return
+        if gen_id in generations:
+            send_error(gen_id, 409, "该id的生成正在进行中")
+            return
+        if len(generations) >= settings.ws_max_generations:
+            send_error(gen_id, 429, f"单个连接最多同时进行 {settings.ws_max_generations} 个生成")
+            return
+        try:
+            request = AuthenticatedChatRequest.model_validate(message.get("request") or {})
+        except ValidationError as e:
+            send_error(gen_id, 422, "请求格式错误", errors=json.loads(e.json()))
+            return
+        if rate_identity:
+            try:
+                await rate_limiter.check(rate_identity)
+            except RateLimitExceeded as e:
+                send_error(gen_id, 429, str(e), retry_after=e.retry_after)
+                return
+        try:
+            admission = admit_request(request)
+        except HTTPException as e:
+            send_error(gen_id, e.status_code, e.detail)
+            return
+        task = generations[gen_id] = asyncio.create_task(run_generation(gen_id, request))
+        task.add_done_callback(lambda _: finish_generation(gen_id, task, admission))
+
+    writer_task = asyncio.create_task(writer())
+    session_events.subscribe(user.id, outgoing)
+    try:
+        while True:
+            try:
+                message = await _receive(websocket)
+            except ValueError as e:
+                send_error(None, 400, str(e))
+                continue
+            if not isinstance(message, dict):
+                send_error(None, 400, "消息格式错误")
+                continue
+
+            message_type = message.get("type")
+            if message_type == "chat":
+                await start_generation(message)
+            elif message_type == "cancel":
+                task = generations.get(message.get("id"))
+                if task is not None:
+                    task.cancel()
+            elif message_type == "ping":
+                outgoing.put_nowait({"type": "pong"})
+            else:
+                send_error(message.get("id"), 400, f"未知的消息类型: {message_type}")
+    except WebSocketDisconnect:
+        pass
+    finally:
+        session_events.unsubscribe(user.id, outgoing)
+        # 连接断开时取消所有进行中的生成
+        for task in list(generations.values()):
+            task.cancel()
+        writer_task.cancel()
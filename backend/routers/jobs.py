@@ -0,0 +1,72 @@
+from fastapi import APIRouter, HTTPException, Depends, Request
+from fastapi.responses import StreamingResponse
+from typing import List, Optional
+from models import ChatRequest, ApiResponse, User, ChatJobResponse
+from services.job_queue import job_queue, job_to_response, TERMINAL_STATUSES, COMPLETED
+from auth import get_current_active_user, check_rate_limit
+from services.framing import negotiate_encoder
+from routers.chat import STREAM_HEADERS
+
+router = APIRouter(prefix="/api/jobs", tags=["jobs"])
+
+async def _get_job(job_id: str, user: User):
+    job = await job_queue.get(job_id, user)
+    if not job:
+        raise HTTPException(status_code=404, detail="任务不存在")
+    return job
+
+@router.post("", response_model=ApiResponse)
+async def submit_job(
+    request: ChatRequest,
+    user: User = Depends(get_current_active_user),
+    rate_identity: Optional[str] = Depends(check_rate_limit)
+):
+    """提交异步聊天任务，适用于长文档、推理模型等耗时较长的补全
+
+    返回任务ID，可轮询状态、订阅状态流或稍后获取结果
+    """
+    job = await job_queue.submit(user, request)
+    return ApiResponse(
+        success=True,
+        message="任务已提交",
+        data={"job_id": job.job_id, "status": job.status}
+    )
+
+@router.get("", response_model=List[ChatJobResponse])
+async def list_jobs(limit: int = 50, user: User = Depends(get_current_active_user)):
+    """获取用户最近的任务"""
+    return [job_to_response(job).model_copy(update={"result": None}) for job in await job_queue.list_jobs(user, limit)]
+
+@router.get("/{job_id}", response_model=ChatJobResponse)
+async def get_job(job_id: str, user: User = Depends(get_current_active_user)):
+    """查询任务状态"""
+    return job_to_response(await _get_job(job_id, user)).model_copy(update={"result": None})
+
+@router.get("/{job_id}/result", response_model=ChatJobResponse)
+async def get_job_result(job_id: str, user: User = Depends(get_current_active_user)):
+    """获取任务结果，任务未结束时返回409"""
+    job = await _get_job(job_id, user)
+    if job.status not in TERMINAL_STATUSES:
+        raise HTTPException(status_code=409, detail="任务尚未完成")
+    return job_to_response(job)
+
+@router.get("/{job_id}/stream")
+async def stream_job(job_id: str, http_request: Request, user: User = Depends(get_current_active_user)):
+    """以SSE订阅任务状态和增量内容，直到任务结束"""
+    job = await _get_job(job_id, user)
+    encoder = negotiate_encoder(http_request.headers.get("accept"))
+
+    async def generate():
+        async for event in job_queue.subscribe(job.job_id):
+            yield encoder.encode(event)
+        yield encoder.encode({"type": "end"})
+
+    return StreamingResponse(generate(), media_type=encoder.media_type, headers=STREAM_HEADERS)
+
+@router.delete("/{job_id}", response_model=ApiResponse)
+async def cancel_job(job_id: str, user: User = Depends(get_current_active_user)):
+    """取消排队中或运行中的任务"""
+    job = await _get_job(job_id, user)
+    if job.status == COMPLETED or not await job_queue.cancel(job.job_id):
+        raise HTTPException(status_code=409, detail="任务已结束，无法取消")
+    return ApiResponse(success=True, message="任务已取消")
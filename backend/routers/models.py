@@ -3,6 +3,9 @@ from typing import Optional, List, Dict, Any
 from models import ApiResponse
 from config import settings, PROVIDERS
 from services.openai_service import openai_service
+from services.health_service import health_monitor
+from services.provider_router import provider_router
+from services.admission import admission_controller
 from crypto_utils import secure_storage
 import asyncio
 import time
@@ -116,6 +119,70 @@ async def get_models(
             data={"models": [], "total_count": 0, "categories": {}}
         )
 
+@router.get("/health", response_model=ApiResponse)
+async def get_models_health(
+    provider: Optional[str] = Query(None, description="供应商过滤"),
+    model: Optional[str] = Query(None, description="模型过滤")
+):
+    """获取模型健康评分
+    
+    基于后台定时探测和真实请求的滚动窗口统计，按评分降序返回
+    """
+    try:
+        stats = health_monitor.snapshot()
+        if provider:
+            stats = [item for item in stats if item["provider"] == provider]
+        if model:
+            stats = [item for item in stats if item["model"] == model]
+        
+        healthy = [item for item in stats if item["healthy"]]
+        
+        return ApiResponse(
+            success=True,
+            message=f"获取到 {len(stats)} 个模型的健康状态",
+            data={
+                "models": stats,
+                "best": healthy[0] if healthy else None,
+                "circuit_breakers": provider_router.status(),
+                "load": admission_controller.status(),
+                "probe": {
+                    "enabled": settings.health_probe_enabled,
+                    "interval_seconds": settings.health_probe_interval,
+                    "targets": settings.health_probe_models
+                }
+            }
+        )
+    except Exception as e:
+        return ApiResponse(
+            success=False,
+            message=f"获取模型健康状态失败: {str(e)}",
+            data={"models": []}
+        )
+
+@router.post("/health/probe", response_model=ApiResponse)
+async def probe_models_health(
+    provider: Optional[str] = Query(None, description="供应商名称，不指定则使用当前供应商"),
+    model: Optional[str] = Query(None, description="模型ID，不指定则探测所有配置的目标")
+):
+    """立即执行一次健康探测"""
+    try:
+        if model:
+            results = [await health_monitor.probe(provider or settings.current_provider, model)]
+        else:
+            results = await health_monitor.probe_all()
+        
+        return ApiResponse(
+            success=True,
+            message=f"完成 {len(results)} 个模型的健康探测",
+            data={"models": results}
+        )
+    except Exception as e:
+        return ApiResponse(
+            success=False,
+            message=f"健康探测失败: {str(e)}",
+            data={"models": []}
+        )
+
 @router.get("/categories", response_model=ApiResponse)
 async def get_model_categories(provider: Optional[str] = Query(None)):
     """获取模型类别统计"""
@@ -0,0 +1,123 @@
+from fastapi import APIRouter, HTTPException, Depends, Response
+from fastapi.responses import StreamingResponse
+from typing import Any, Dict, Optional
+import time
+import uuid
+from models import OpenAIChatCompletionRequest, User
+from services.chat_cache import lookup_chat_cache
+from services.chat_pipeline import complete_chat, stream_chat
+from services.provider_router import provider_router
+from services.retry import UpstreamError
+from services.admission import StreamGuard
+from services.serialization import sse_frame, SSE_DONE
+from auth import get_current_active_user, check_rate_limit
+from routers.chat import admit_request, STREAM_HEADERS
+
+router = APIRouter(prefix="/v1", tags=["openai-compatible"])
+
+def _chunk_frame(completion_id: str, created: int, model: str,
+                 delta: Dict[str, Any], finish_reason: Optional[str] = None) -> bytes:
+    """构造 chat.completion.chunk 帧（缓存重放和结束帧使用）"""
+    chunk = {
+        "id": completion_id,
+        "object": "chat.completion.chunk",
+        "created": created,
+        "model": model,
+        "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]
+    }
+    return sse_frame(chunk)
+
+@router.post("/chat/completions")
+async def chat_completions(
+    body: OpenAIChatCompletionRequest,
+    response: Response,
+    user: User = Depends(get_current_active_user),
+    rate_identity: Optional[str] = Depends(check_rate_limit)
+):
+    """OpenAI兼容的聊天补全接口
+
+    使用ART-FS令牌认证，经过与会话聊天相同的准入、缓存、请求合并、故障切换和配额扣除流程
+    """
+    if body.n != 1:
+        raise HTTPException(status_code=400, detail="仅支持 n=1")
+
+    request = body.to_chat_request()
+    admission = admit_request(request)
+    completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+    created = int(time.time())
+
+    if not body.stream:
+        try:
+            chat_meta = {}
+            content = await complete_chat(request, chat_meta, user, rate_identity)
+            response.headers.update(chat_meta["cache"].headers())
+            usage = chat_meta.get("usage") or {"prompt_tokens": 0, "completion_tokens": 0}
+            return {
+                "id": completion_id,
+                "object": "chat.completion",
+                "created": created,
+                "model": request.model,
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": content},
+                    "finish_reason": "stop"
+                }],
+                "usage": {**usage, "total_tokens": usage["prompt_tokens"] + usage["completion_tokens"]}
+            }
+        except UpstreamError as e:
+            raise HTTPException(status_code=e.status_code, detail=str(e), headers=e.headers())
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=str(e))
+        finally:
+            admission.release()
+
+    try:
+        cache = await lookup_chat_cache(request, user)
+    except Exception as e:
+        admission.release()
+        raise HTTPException(status_code=500, detail=str(e))
+
+    async def generate():
+        nonlocal completion_id, created
+        stream_meta = {}
+        try:
+            async for delta in stream_chat(request, cache, stream_meta, user, rate_identity):
+                if stream_meta.get("error"):
+                    error = {"error": {"message": stream_meta["error"], "type": "upstream_error"}}
+                    yield sse_frame(error)
+                    return
+                chunk = getattr(delta, "chunk", None)
+                if chunk is not None:
+                    # 上游数据块原样转发，不重新构造；结束帧沿用上游的id
+                    completion_id, created = chunk.id, chunk.created
+                    yield f"data: {chunk.model_dump_json(exclude_unset=True)}\n\n"
+                else:
+                    yield _chunk_frame(completion_id, created, request.model, {"content": delta})
+            yield _chunk_frame(completion_id, created, request.model, {}, "stop")
+            yield SSE_DONE
+        finally:
+            admission.release()
+
+    headers = dict(STREAM_HEADERS)
+    headers.update(cache.headers())
+    if admission.degraded_model:
+        headers["X-Degraded-Model"] = admission.degraded_model
+    guard = StreamGuard(admission)
+    return StreamingResponse(guard.wrap(generate()), media_type="text/event-stream",
+                             headers=headers, background=guard.background())
+
+@router.get("/models")
+async def list_models(user: User = Depends(get_current_active_user)):
+    """OpenAI兼容的模型列表，汇总所有已配置供应商的模型"""
+    catalog = await provider_router.get_catalog()
+    owners: Dict[str, str] = {}
+    for provider, model_ids in catalog.items():
+        for model_id in sorted(model_ids):
+            owners.setdefault(model_id, provider)
+    return {
+        "object": "list",
+        "data": [
+            {"id": model_id, "object": "model", "created": 0, "owned_by": provider}
+            for model_id, provider in owners.items()
+        ]
+    }
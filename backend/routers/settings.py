@@ -1,8 +1,11 @@
-from fastapi import APIRouter, HTTPException
-from models import Settings, SettingsUpdateRequest, ApiResponse
+from fastapi import APIRouter, Depends, HTTPException
+from models import Settings, SettingsUpdateRequest, ApiResponse, ApiKeyCreateRequest, ApiKeyUpdateRequest, User
 from config import settings, PROVIDERS, update_provider_secure_config
 from services.openai_service import openai_service
+from services.provider_router import provider_router
+from services.key_pool import key_pool
 from crypto_utils import secure_storage
+from auth import get_current_admin_user
 import os
 from pathlib import Path
 
@@ -90,12 +93,83 @@ async def get_providers():
             providers[key] = {
                 "name": provider["name"],
                 "base_url": provider["base_url"],
-                "configured": is_configured
+                "configured": is_configured,
+                "key_count": len(secure_storage.get_api_keys(key))
             }
         return ApiResponse(success=True, message="获取供应商列表成功", data=providers)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+def _mask_api_key(api_key: str) -> str:
+    """脱敏显示API Key"""
+    if len(api_key) <= 8:
+        return "*" * len(api_key)
+    return f"{api_key[:4]}...{api_key[-4:]}"
+
+def _reload_provider_keys(provider: str):
+    """密钥变更后刷新密钥池和客户端"""
+    key_pool.invalidate(provider)
+    openai_service.reload_config()
+    provider_router.invalidate_catalog(provider)
+
+@router.get("/providers/{provider}/keys")
+async def list_provider_keys(provider: str, current_user: User = Depends(get_current_admin_user)):
+    """获取供应商密钥池（密钥脱敏，需要管理员权限）"""
+    if provider not in PROVIDERS:
+        raise HTTPException(status_code=404, detail=f"供应商 {provider} 不存在")
+    try:
+        runtime = {item["id"]: item for item in key_pool.status(provider)}
+        keys = []
+        for entry in secure_storage.get_api_keys(provider):
+            keys.append({
+                "id": entry["id"],
+                "label": entry.get("label"),
+                "api_key": _mask_api_key(entry["api_key"]),
+                "weight": entry.get("weight", 1),
+                "enabled": entry.get("enabled", True),
+                "runtime": runtime.get(entry["id"])
+            })
+        return ApiResponse(
+            success=True,
+            message=f"获取到 {len(keys)} 个密钥",
+            data={"provider": provider, "strategy": settings.key_pool_strategy, "keys": keys}
+        )
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.post("/providers/{provider}/keys")
+async def add_provider_key(provider: str, request: ApiKeyCreateRequest,
+                           current_user: User = Depends(get_current_admin_user)):
+    """向供应商密钥池添加密钥（需要管理员权限）"""
+    if provider not in PROVIDERS:
+        raise HTTPException(status_code=404, detail=f"供应商 {provider} 不存在")
+    key_id = secure_storage.add_api_key(provider, request.api_key, request.weight, request.label)
+    if not key_id:
+        raise HTTPException(status_code=500, detail="保存加密配置失败")
+    _reload_provider_keys(provider)
+    return ApiResponse(success=True, message="密钥添加成功", data={"id": key_id})
+
+@router.put("/providers/{provider}/keys/{key_id}")
+async def update_provider_key(provider: str, key_id: str, request: ApiKeyUpdateRequest,
+                              current_user: User = Depends(get_current_admin_user)):
+    """更新密钥的权重、启用状态或备注（需要管理员权限，key_id为default时更新单密钥配置）"""
+    if provider not in PROVIDERS:
+        raise HTTPException(status_code=404, detail=f"供应商 {provider} 不存在")
+    if not secure_storage.update_api_key_entry(provider, key_id, request.weight, request.enabled, request.label):
+        raise HTTPException(status_code=404, detail="密钥不存在")
+    _reload_provider_keys(provider)
+    return ApiResponse(success=True, message="密钥更新成功")
+
+@router.delete("/providers/{provider}/keys/{key_id}")
+async def delete_provider_key(provider: str, key_id: str, current_user: User = Depends(get_current_admin_user)):
+    """从供应商密钥池删除密钥（需要管理员权限）"""
+    if provider not in PROVIDERS:
+        raise HTTPException(status_code=404, detail=f"供应商 {provider} 不存在")
+    if not secure_storage.remove_api_key(provider, key_id):
+        raise HTTPException(status_code=404, detail="密钥不存在")
+    _reload_provider_keys(provider)
+    return ApiResponse(success=True, message="密钥删除成功")
+
 @router.put("/")
 async def update_settings(request: SettingsUpdateRequest):
     """更新设置"""
@@ -132,6 +206,7 @@ async def update_settings(request: SettingsUpdateRequest):
         
         # 重新加载OpenAI服务配置
         openai_service.reload_config()
+        provider_router.invalidate_catalog()
         
         # 持久化基本设置到.env文件
         _update_env_file()
@@ -0,0 +1,173 @@
+"""
+过载保护与准入控制
+根据进行中的请求数、调度排队时间和事件循环延迟判断负载状态：
+接近上限时把请求降级到配置的更快/更便宜的模型，超出上限时直接拒绝（503）
+"""
+
+import asyncio
+import time
+from collections import deque
+from typing import AsyncIterator, Awaitable, Callable, Deque, Dict, Optional, Any, Tuple
+from starlette.background import BackgroundTask
+from config import settings
+from services.metrics import metrics
+from services.scheduler import fair_scheduler
+
+NORMAL = "normal"
+DEGRADED = "degraded"
+SHEDDING = "shedding"
+
+class ServiceOverloaded(Exception):
+    """服务过载，请求被拒绝"""
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+    def headers(self) -> Dict[str, str]:
+        return {"Retry-After": str(max(1, round(self.retry_after)))}
+
+class AdmissionTicket:
+    """准入名额，请求（流式请求为整个流）结束时释放"""
+
+    def __init__(self, controller: "AdmissionController", degraded_model: Optional[str] = None):
+        self.degraded_model = degraded_model
+        self._controller = controller
+        self._released = False
+
+    def release(self):
+        if not self._released:
+            self._released = True
+            self._controller.in_flight -= 1
+
+class StreamGuard:
+    """流式响应的准入名额保护
+
+    流式响应体在生成器的finally中释放名额，但客户端在响应体开始迭代前断开时，生成器从未启动，finally不会执行。
+    wrap包装响应体并记录是否已开始迭代，background作为响应的后台任务在响应结束（包括客户端断开）后执行：
+    响应体没有开始时释放名额并执行额外的清理
+    """
+
+    def __init__(self, ticket: AdmissionTicket, on_unstarted: Optional[Callable[[], Awaitable[None]]] = None):
+        self.started = False
+        self._ticket = ticket
+        self._on_unstarted = on_unstarted
+
+    async def wrap(self, body: AsyncIterator) -> AsyncIterator:
+        self.started = True
+        async for item in body:
+            yield item
+
+    async def _finish(self):
+        if not self.started:
+            self._ticket.release()
+            if self._on_unstarted:
+                await self._on_unstarted()
+
+    def background(self) -> BackgroundTask:
+        return BackgroundTask(self._finish)
+
+class AdmissionController:
+    def __init__(self):
+        self.in_flight = 0
+        self.loop_lag = 0.0
+        # (采样时间, 延迟)
+        self._lag_samples: Deque[Tuple[float, float]] = deque()
+        self.state = NORMAL
+        self.state_since = time.time()
+        self._lag_task: Optional[asyncio.Task] = None
+
+    def _pressure(self) -> Dict[str, float]:
+        """各项负载指标相对上限的比例"""
+        return {
+            "in_flight": self.in_flight / max(1, settings.admission_max_in_flight),
+            "queue_wait": fair_scheduler.oldest_wait() / settings.admission_max_queue_wait,
+            "loop_lag": self.loop_lag / settings.admission_max_loop_lag
+        }
+
+    def _update_state(self) -> str:
+        pressure = max(self._pressure().values())
+        if pressure >= 1:
+            state = SHEDDING
+        elif pressure >= settings.admission_degrade_ratio:
+            state = DEGRADED
+        else:
+            state = NORMAL
+        if state != self.state:
+            print(f"负载状态变化: {self.state} -> {state}")
+            self.state = state
+            self.state_since = time.time()
+        return state
+
+    def admit(self, model: Optional[str] = None) -> AdmissionTicket:
+        """请求准入
+
+        Args:
+            model: 请求的模型，降级时会替换为配置的降级模型
+
+        Raises:
+            ServiceOverloaded: 负载超出上限
+        """
+        if not settings.admission_enabled:
+            self.in_flight += 1
+            return AdmissionTicket(self)
+
+        state = self._update_state()
+        if state == SHEDDING:
+            metrics.incr("admission.rejected")
+            retry_after = max(settings.admission_retry_after, fair_scheduler.oldest_wait())
+            raise ServiceOverloaded("服务繁忙，请稍后再试", retry_after)
+
+        degraded_model = None
+        if state == DEGRADED and settings.admission_degrade_model and model != settings.admission_degrade_model:
+            degraded_model = settings.admission_degrade_model
+            metrics.incr("admission.degraded")
+
+        self.in_flight += 1
+        return AdmissionTicket(self, degraded_model)
+
+    async def _measure_loop_lag(self):
+        """定时睡眠，实际唤醒时间与预期的差值即事件循环延迟"""
+        interval = settings.admission_lag_interval
+        while True:
+            start = time.perf_counter()
+            await asyncio.sleep(interval)
+            lag = max(0.0, time.perf_counter() - start - interval)
+            # 取时间窗口内样本的最小值：单个慢请求造成的一次延迟会被窗口内的正常样本抵消，
+            # 只有整个窗口内持续存在的延迟才计入负载；回落立即生效
+            now = time.perf_counter()
+            self._lag_samples.append((now, lag))
+            while len(self._lag_samples) > 1 and now - self._lag_samples[0][0] > settings.admission_lag_window:
+                self._lag_samples.popleft()
+            self.loop_lag = min(sample for _, sample in self._lag_samples)
+            metrics.observe("admission.loop_lag", lag)
+
+    def start(self):
+        """启动事件循环延迟监测"""
+        if settings.admission_enabled and self._lag_task is None:
+            self._lag_task = asyncio.create_task(self._measure_loop_lag())
+
+    async def stop(self):
+        if self._lag_task:
+            self._lag_task.cancel()
+            try:
+                await self._lag_task
+            except asyncio.CancelledError:
+                pass
+            self._lag_task = None
+
+    def status(self) -> Dict[str, Any]:
+        """获取当前负载状态"""
+        return {
+            "enabled": settings.admission_enabled,
+            "state": self._update_state() if settings.admission_enabled else NORMAL,
+            "state_since": self.state_since,
+            "in_flight": self.in_flight,
+            "queue_wait_ms": round(fair_scheduler.oldest_wait() * 1000, 2),
+            "loop_lag_ms": round(self.loop_lag * 1000, 2),
+            "pressure": {key: round(value, 3) for key, value in self._pressure().items()},
+            "degrade_model": settings.admission_degrade_model
+        }
+
+# 全局准入控制实例
+admission_controller = AdmissionController()
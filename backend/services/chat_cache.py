@@ -0,0 +1,84 @@
+"""
+聊天缓存查询
+按顺序查询精确匹配缓存和语义缓存，未命中时在上游返回后写回两层缓存
+"""
+
+from typing import AsyncIterator, Dict, Optional
+from config import settings
+from models import ChatRequest, User
+from services.response_cache import response_cache, make_cache_key
+from services.semantic_cache import semantic_cache, SemanticLookup
+
+class ChatCacheLookup:
+    """一次请求的缓存查询结果"""
+
+    def __init__(self, key: Optional[str] = None, semantic: Optional[SemanticLookup] = None,
+                 content: Optional[str] = None, source: Optional[str] = None):
+        self.key = key
+        self.semantic = semantic
+        self.content = content
+        self.source = source  # exact 或 semantic
+
+    @property
+    def hit(self) -> bool:
+        return self.content is not None
+
+    def headers(self) -> Dict[str, str]:
+        """缓存状态响应头"""
+        headers = {}
+        if self.key:
+            headers["X-Cache"] = "HIT" if self.source == "exact" else "MISS"
+        if self.semantic:
+            headers["X-Semantic-Cache"] = "HIT" if self.source == "semantic" else "MISS"
+            if self.semantic.similarity is not None:
+                headers["X-Semantic-Similarity"] = f"{self.semantic.similarity:.4f}"
+        return headers
+
+    async def store(self, content: str, ttl: Optional[int] = None):
+        """上游返回完整回答后写入缓存"""
+        if self.hit or not content:
+            return
+        if self.key:
+            await response_cache.set(self.key, content, ttl)
+        if self.semantic:
+            semantic_cache.add(self.semantic, content)
+
+def get_cache_key(request: ChatRequest) -> Optional[str]:
+    """请求使用精确匹配缓存时返回缓存键"""
+    if not response_cache.is_enabled(request.cache):
+        return None
+    return get_request_fingerprint(request)
+
+def get_request_fingerprint(request: ChatRequest) -> str:
+    """请求的规范化哈希，相同哈希的请求上游回答相同（采样参数确定时）"""
+    from services.openai_service import openai_service
+
+    return make_cache_key(
+        settings.current_provider,
+        request.model or settings.current_model,
+        [{"role": msg.role.value, "content": msg.content} for msg in request.messages],
+        request.max_tokens,
+        openai_service.get_sampling_params(request)
+    )
+
+async def lookup_chat_cache(request: ChatRequest, user: Optional[User] = None) -> ChatCacheLookup:
+    """依次查询精确匹配缓存和语义缓存"""
+    lookup = ChatCacheLookup(get_cache_key(request))
+    if lookup.key:
+        lookup.content = await response_cache.get(lookup.key)
+        if lookup.hit:
+            lookup.source = "exact"
+            return lookup
+
+    if semantic_cache.is_enabled(request.cache):
+        lookup.semantic = await semantic_cache.lookup(request, user)
+        if lookup.semantic and lookup.semantic.content is not None:
+            lookup.content = lookup.semantic.content
+            lookup.source = "semantic"
+    return lookup
+
+async def replay_chunks(content: str) -> AsyncIterator[str]:
+    """把缓存的完整回答按固定长度切分，模拟流式输出"""
+    size = max(1, settings.response_cache_replay_chunk_size)
+    for start in range(0, len(content), size):
+        yield content[start:start + size]
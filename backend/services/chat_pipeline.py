@@ -0,0 +1,81 @@
+"""
+聊天处理流程
+各聊天入口（会话聊天、OpenAI兼容接口等）共用：查询缓存、合并相同请求、调用上游、
+写回缓存并按用量扣除token配额
+"""
+
+from typing import Any, AsyncIterator, Dict, List, Optional
+from models import ChatRequest, User
+from services.chat_cache import ChatCacheLookup, lookup_chat_cache, replay_chunks
+from services.rate_limiter import rate_limiter
+from services.single_flight import coalesced_chat_stream, coalesced_chat
+from services.token_counter import estimate_tokens, estimate_messages_tokens
+
+def estimate_usage(request: ChatRequest, content: str) -> Dict[str, int]:
+    """上游没有返回用量时估算"""
+    return {
+        "prompt_tokens": estimate_messages_tokens(msg.content for msg in request.messages),
+        "completion_tokens": estimate_tokens(content)
+    }
+
+async def complete_chat(request: ChatRequest, meta: Optional[Dict[str, Any]] = None,
+                        user: Optional[User] = None, rate_identity: Optional[str] = None) -> str:
+    """非流式聊天
+
+    Args:
+        request: 聊天请求
+        meta: 可选的字典，回传供应商、用量(usage)和缓存查询结果(cache)
+        user: 发起请求的用户
+        rate_identity: 限流身份，不为空时按用量扣除token配额
+
+    Raises:
+        UpstreamError: 上游调用失败
+    """
+    if meta is None:
+        meta = {}
+    cache = await lookup_chat_cache(request, user)
+    meta["cache"] = cache
+    if cache.hit:
+        return cache.content
+
+    content = await coalesced_chat(request, meta, user)
+    await cache.store(content, request.cache_ttl)
+    # 优先使用上游返回的用量，没有时估算
+    meta["usage"] = meta.get("usage") or estimate_usage(request, content)
+    if rate_identity:
+        await rate_limiter.charge_tokens(
+            rate_identity, meta["usage"]["prompt_tokens"] + meta["usage"]["completion_tokens"]
+        )
+    return content
+
+async def stream_chat(request: ChatRequest, cache: ChatCacheLookup, meta: Dict[str, Any],
+                      user: Optional[User] = None, rate_identity: Optional[str] = None) -> AsyncIterator[str]:
+    """流式聊天，缓存命中时重放缓存内容
+
+    Args:
+        request: 聊天请求
+        cache: 调用方预先查询的缓存结果（用于在开始输出前设置响应头）
+        meta: 回传供应商、完成状态(completed)、错误(error)和估算用量(usage)
+        user: 发起请求的用户
+        rate_identity: 限流身份，不为空时按估算用量扣除token配额
+    """
+    if cache.hit:
+        async for chunk in replay_chunks(cache.content):
+            yield chunk
+        meta["completed"] = True
+        return
+
+    parts: List[str] = []
+    async for chunk in coalesced_chat_stream(request, meta, user):
+        parts.append(chunk)
+        yield chunk
+
+    content = "".join(parts)
+    if meta.get("completed"):
+        await cache.store(content, request.cache_ttl)
+    # 流式响应没有用量信息，按估算值扣除token配额
+    meta["usage"] = estimate_usage(request, content)
+    if rate_identity and content:
+        await rate_limiter.charge_tokens(
+            rate_identity, meta["usage"]["prompt_tokens"] + meta["usage"]["completion_tokens"]
+        )
@@ -0,0 +1,104 @@
+"""
+助手回答的增量检查点
+流式生成开始时先创建助手消息（标记为未完成），生成过程中每累计N个增量或每隔T毫秒
+把新增内容追加写入数据库；进程崩溃或重新部署时已生成的部分不会丢失，未完成的回答保留is_complete=False
+"""
+
+import time
+from typing import List, Optional
+from sqlalchemy import delete, update
+from sqlalchemy.orm import Session
+from config import settings
+from models import ChatSession, MessageRecord
+from services.write_behind import write_behind, session_pk
+
+class MessageCheckpointWriter:
+    """单条助手消息的缓冲写入器
+
+    增量保存在列表中（整体O(n)拼接），检查点只写入上次检查点之后的增量，
+    由数据库在原内容后追加，不重复写入已保存的部分。创建和检查点都通过写后持久化队列提交，不阻塞流式输出
+    """
+
+    def __init__(self, session: ChatSession):
+        self.session = session
+        # 消息主键，创建写入执行后回填
+        self.message_id: Optional[int] = None
+        self.parts: List[str] = []
+        self._flushed = 0
+        self._last_flush = time.monotonic()
+
+    @classmethod
+    def create(cls, session: ChatSession, model_used: str) -> "MessageCheckpointWriter":
+        """创建未完成的助手消息"""
+        writer = cls(session)
+        pk = session_pk(session)
+
+        def op(db: Session):
+            message = MessageRecord(
+                session_id=pk(),
+                role="assistant",
+                content="",
+                model_used=model_used,
+                is_complete=False
+            )
+            db.add(message)
+            db.flush()
+            writer.message_id = message.id
+
+        write_behind.submit(session, op)
+        return writer
+
+    def _update(self, **values):
+        def op(db: Session):
+            db.execute(update(MessageRecord).where(MessageRecord.id == self.message_id).values(**values))
+
+        write_behind.submit(self.session, op)
+
+    def _delete(self):
+        def op(db: Session):
+            db.execute(delete(MessageRecord).where(MessageRecord.id == self.message_id))
+
+        write_behind.submit(self.session, op)
+
+    def append(self, chunk: str):
+        self.parts.append(chunk)
+        if (len(self.parts) - self._flushed >= settings.checkpoint_tokens
+                or (time.monotonic() - self._last_flush) * 1000 >= settings.checkpoint_interval_ms):
+            self.flush()
+
+    def flush(self):
+        """写入检查点"""
+        if self._flushed == len(self.parts):
+            return
+        delta = "".join(self.parts[self._flushed:])
+        self._update(content=MessageRecord.content + delta)
+        self._flushed = len(self.parts)
+        self._last_flush = time.monotonic()
+
+    @property
+    def content(self) -> str:
+        return "".join(self.parts)
+
+    def finish(self, complete: bool, token_count: Optional[int] = None) -> bool:
+        """生成结束：写入最终内容和完成状态，没有内容时删除消息
+
+        Returns:
+            消息是否保留
+        """
+        content = self.content.strip()
+        self._flushed = len(self.parts)
+        if not content:
+            self._delete()
+            return False
+        self._update(content=content, is_complete=complete, token_count=token_count)
+        return True
+
+    def interrupt(self):
+        """生成被中断（客户端断开、取消）：写入剩余增量，消息保持未完成状态"""
+        try:
+            if self.parts:
+                self.flush()
+            else:
+                self._delete()
+        except Exception as e:
+            print(f"保存中断的回答失败: {e}")
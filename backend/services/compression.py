@@ -0,0 +1,187 @@
+"""
+响应压缩
+按Accept-Encoding协商brotli或gzip：普通响应超过大小阈值时整体压缩；
+流式响应（SSE、NDJSON、MessagePack帧）逐帧压缩并立即刷新，压缩器不缓存数据，不增加首token延迟
+"""
+
+import zlib
+from typing import Dict, List, Optional, Tuple
+from config import settings
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSIBLE_TYPES = (
+    "text/",
+    "application/json",
+    "application/x-ndjson",
+    "application/x-msgpack",
+    "application/javascript",
+    "application/xml",
+)
+
+def parse_accept_encoding(header: Optional[str]) -> Dict[str, float]:
+    """解析Accept-Encoding，返回编码及其q值"""
+    encodings = {}
+    for part in (header or "").split(","):
+        params = [param.strip() for param in part.split(";")]
+        if not params[0]:
+            continue
+        quality = 1.0
+        for param in params[1:]:
+            if param.startswith("q="):
+                try:
+                    quality = float(param[2:])
+                except ValueError:
+                    quality = 0.0
+        encodings[params[0].lower()] = quality
+    return encodings
+
+def select_encoding(header: Optional[str]) -> Optional[str]:
+    """选择压缩编码，同等q值时优先brotli"""
+    accepted = parse_accept_encoding(header)
+    candidates = ["br", "gzip"] if brotli is not None else ["gzip"]
+    best, best_quality = None, 0.0
+    for encoding in candidates:
+        quality = accepted.get(encoding, accepted.get("*", 0.0))
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+class _StreamCompressor:
+    """增量压缩器，每次compress都刷新输出，保证帧立即送达客户端"""
+
+    def __init__(self, encoding: str):
+        self.encoding = encoding
+        if encoding == "br":
+            self._compressor = brotli.Compressor(quality=settings.compression_brotli_quality)
+        else:
+            # wbits=31 输出gzip格式
+            self._compressor = zlib.compressobj(settings.compression_level, zlib.DEFLATED, 31)
+
+    def compress(self, data: bytes) -> bytes:
+        if self.encoding == "br":
+            return self._compressor.process(data) + self._compressor.flush()
+        return self._compressor.compress(data) + self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self) -> bytes:
+        if self.encoding == "br":
+            return self._compressor.finish()
+        return self._compressor.flush(zlib.Z_FINISH)
+
+def compress_body(data: bytes, encoding: str) -> bytes:
+    """一次性压缩完整响应体"""
+    if encoding == "br":
+        return brotli.compress(data, quality=settings.compression_brotli_quality)
+    compressor = zlib.compressobj(settings.compression_level, zlib.DEFLATED, 31)
+    return compressor.compress(data) + compressor.flush()
+
+class _Headers:
+    """ASGI原始响应头的简单封装"""
+
+    def __init__(self, raw: List[Tuple[bytes, bytes]]):
+        self.raw = list(raw)
+
+    def get(self, name: str) -> Optional[str]:
+        key = name.encode("latin-1")
+        for header, value in self.raw:
+            if header.lower() == key:
+                return value.decode("latin-1")
+        return None
+
+    def remove(self, name: str):
+        key = name.encode("latin-1")
+        self.raw = [(header, value) for header, value in self.raw if header.lower() != key]
+
+    def set(self, name: str, value: str):
+        self.remove(name)
+        self.raw.append((name.encode("latin-1"), value.encode("latin-1")))
+
+    def append_vary(self, value: str):
+        vary = self.get("vary")
+        self.set("vary", f"{vary}, {value}" if vary else value)
+
+def _should_compress(status: int, headers: _Headers) -> bool:
+    if status < 200 or status in (204, 304) or headers.get("content-encoding"):
+        return False
+    content_type = (headers.get("content-type") or "").lower()
+    return content_type.startswith(COMPRESSIBLE_TYPES)
+
+class CompressionMiddleware:
+    """ASGI压缩中间件
+
+    与Starlette的GZipMiddleware不同，流式响应每个body消息都同步刷新压缩器，
+    SSE帧不会滞留在压缩缓冲区中，响应头也不会等到首帧才发送；同时支持brotli
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not settings.compression_enabled:
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict((key.decode("latin-1").lower(), value.decode("latin-1")) for key, value in scope["headers"])
+        encoding = select_encoding(headers.get("accept-encoding"))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        # 普通响应的响应头，等到响应体确认超过阈值再发送
+        pending_start = None
+        compressor: Optional[_StreamCompressor] = None
+
+        async def send_wrapper(message):
+            nonlocal pending_start, compressor
+            if message["type"] == "http.response.start":
+                response_headers = _Headers(message["headers"])
+                if not _should_compress(message["status"], response_headers):
+                    await send(message)
+                elif response_headers.get("content-length") is None:
+                    # 没有Content-Length的是流式响应，立即发送响应头，之后逐帧压缩
+                    response_headers.set("content-encoding", encoding)
+                    response_headers.append_vary("Accept-Encoding")
+                    compressor = _StreamCompressor(encoding)
+                    await send({**message, "headers": response_headers.raw})
+                else:
+                    pending_start = message
+                return
+
+            if message["type"] != "http.response.body":
+                await send(message)
+                return
+
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+
+            if compressor is not None:
+                data = compressor.compress(body) if body else b""
+                if not more_body:
+                    data += compressor.finish()
+                if data or not more_body:
+                    await send({"type": "http.response.body", "body": data, "more_body": more_body})
+                return
+
+            if pending_start is None:
+                await send(message)
+                return
+
+            start, pending_start = pending_start, None
+            if more_body or len(body) < settings.compression_min_size:
+                # 分多次发送的普通响应（如文件）或小响应不压缩
+                await send(start)
+                await send(message)
+                return
+
+            compressed = compress_body(body, encoding)
+            response_headers = _Headers(start["headers"])
+            response_headers.set("content-encoding", encoding)
+            response_headers.set("content-length", str(len(compressed)))
+            response_headers.append_vary("Accept-Encoding")
+            await send({**start, "headers": response_headers.raw})
+            await send({"type": "http.response.body", "body": compressed})
+
+        await self.app(scope, receive, send_wrapper)
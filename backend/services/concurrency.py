@@ -0,0 +1,119 @@
+"""
+自适应并发限制
+按供应商和密钥维护并发上限，采用AIMD控制：请求成功且延迟正常时线性增加上限，
+遇到429或延迟明显高于基线时按比例降低上限；超出上限的请求短暂排队而不是直接失败
+"""
+
+import asyncio
+from collections import deque
+from typing import Deque, Dict, List, Optional, Tuple, Any
+from config import settings
+
+class ConcurrencyLimitExceeded(Exception):
+    """排队超时，未能获得并发名额"""
+    pass
+
+class AdaptiveLimiter:
+    def __init__(self, provider: str, key_id: str):
+        self.provider = provider
+        self.key_id = key_id
+        self.limit = float(settings.concurrency_initial_limit)
+        self.in_flight = 0
+        self.baseline_latency: Optional[float] = None
+        self.queue_timeouts = 0
+        self._waiters: Deque[asyncio.Future] = deque()
+
+    @property
+    def queue_depth(self) -> int:
+        return sum(1 for waiter in self._waiters if not waiter.done())
+
+    def _has_capacity(self) -> bool:
+        return self.in_flight < max(1, int(self.limit))
+
+    async def acquire(self, timeout: Optional[float] = None):
+        """获取并发名额，没有名额时排队等待"""
+        if self._has_capacity() and not self.queue_depth:
+            self.in_flight += 1
+            return
+
+        waiter = asyncio.get_event_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await asyncio.wait({waiter}, timeout=timeout)
+        except asyncio.CancelledError:
+            # 调用方被取消：如果名额已经分配则归还
+            if waiter.done() and not waiter.cancelled():
+                self.release()
+            else:
+                waiter.cancel()
+            raise
+
+        if not waiter.done():
+            waiter.cancel()
+            self.queue_timeouts += 1
+            raise ConcurrencyLimitExceeded(
+                f"供应商 {self.provider} 密钥 {self.key_id} 并发已满（上限 {int(self.limit)}），排队超时"
+            )
+
+    def release(self):
+        """归还并发名额并唤醒排队的请求"""
+        self.in_flight -= 1
+        self._wake_waiters()
+
+    def _wake_waiters(self):
+        while self._waiters and self._has_capacity():
+            waiter = self._waiters.popleft()
+            if waiter.done():
+                continue
+            # 名额直接转交给等待者
+            self.in_flight += 1
+            waiter.set_result(True)
+
+    def record_success(self, latency: float):
+        """记录成功请求的延迟（流式请求使用首字延迟）"""
+        if self.baseline_latency is None:
+            self.baseline_latency = latency
+        else:
+            # 基线取近期最小延迟，并缓慢上浮以适应上游整体变化
+            self.baseline_latency = min(latency, self.baseline_latency * 1.01)
+
+        if latency > self.baseline_latency * settings.concurrency_latency_tolerance:
+            # 延迟明显升高，说明上游开始排队，温和降低上限
+            self.limit = max(settings.concurrency_min_limit, self.limit * 0.9)
+        elif self.in_flight >= self.limit / 2:
+            # 加性增加：每个满窗口的成功请求约增加1；上限远未用满时不增长
+            self.limit = min(settings.concurrency_max_limit, self.limit + 1 / self.limit)
+            self._wake_waiters()
+
+    def record_rate_limited(self):
+        """上游返回429，乘性降低上限"""
+        self.limit = max(settings.concurrency_min_limit, self.limit * settings.concurrency_backoff_ratio)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "provider": self.provider,
+            "key_id": self.key_id,
+            "limit": round(self.limit, 2),
+            "in_flight": self.in_flight,
+            "queue_depth": self.queue_depth,
+            "queue_timeouts": self.queue_timeouts,
+            "baseline_latency_ms": round(self.baseline_latency * 1000, 2) if self.baseline_latency else None
+        }
+
+class ConcurrencyController:
+    def __init__(self):
+        self._limiters: Dict[Tuple[str, str], AdaptiveLimiter] = {}
+
+    def get(self, provider: str, key_id: str) -> AdaptiveLimiter:
+        """获取供应商密钥的并发限制器"""
+        key = (provider, key_id)
+        if key not in self._limiters:
+            self._limiters[key] = AdaptiveLimiter(provider, key_id)
+        return self._limiters[key]
+
+    def status(self) -> List[Dict[str, Any]]:
+        """获取所有限制器的当前上限和排队深度"""
+        return [limiter.to_dict() for limiter in self._limiters.values()]
+
+# 全局并发控制实例
+concurrency_controller = ConcurrencyController()
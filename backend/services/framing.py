@@ -0,0 +1,107 @@
+"""
+流式输出帧编码
+默认输出SSE文本帧（data: JSON）；客户端通过Accept头请求 application/x-msgpack 时，
+输出带长度前缀的MessagePack二进制帧：4字节大端长度 + [类型编号, 内容]，
+类型用小整数表示，省去每帧重复的 "type" 键和JSON转义
+"""
+
+import struct
+from typing import Any, Dict, Optional
+from services.serialization import sse_frame
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+MSGPACK_MEDIA_TYPE = "application/x-msgpack"
+MSGPACK_SUBPROTOCOL = "msgpack"
+
+# 事件类型编号，新类型只能追加
+FRAME_TYPES = {
+    "content": 1,
+    "session": 2,
+    "provider": 3,
+    "end": 4,
+    "error": 5,
+    "done": 6,
+    "status": 7,
+    "cancelled": 8,
+    "pong": 9,
+    "session_updated": 10,
+}
+FRAME_TYPE_NAMES = {tag: name for name, tag in FRAME_TYPES.items()}
+UNKNOWN_FRAME_TYPE = 0
+
+_LENGTH_PREFIX = struct.Struct(">I")
+
+def pack_event(event: Dict[str, Any]) -> bytes:
+    """把事件编码为MessagePack（不含长度前缀）
+
+    content事件编码为 [1, 内容] 或 [1, 内容, 其他字段]，其余事件编码为 [类型编号, 其他字段]；
+    未登记的类型使用编号0并保留完整事件
+    """
+    tag = FRAME_TYPES.get(event.get("type"), UNKNOWN_FRAME_TYPE)
+    if tag == UNKNOWN_FRAME_TYPE:
+        return msgpack.packb([tag, event])
+    fields = {key: value for key, value in event.items() if key != "type"}
+    if tag == FRAME_TYPES["content"]:
+        content = fields.pop("content", "")
+        return msgpack.packb([tag, content, fields] if fields else [tag, content])
+    return msgpack.packb([tag, fields])
+
+def unpack_event(data: bytes) -> Dict[str, Any]:
+    """解码pack_event的输出（WebSocket二进制消息使用）"""
+    frame = msgpack.unpackb(data)
+    if isinstance(frame, dict):
+        return frame
+    tag, body = frame[0], frame[1]
+    if tag == UNKNOWN_FRAME_TYPE:
+        return body
+    event = {"type": FRAME_TYPE_NAMES.get(tag)}
+    if tag == FRAME_TYPES["content"]:
+        event["content"] = body
+        if len(frame) > 2:
+            event.update(frame[2])
+    else:
+        event.update(body)
+    return event
+
+class FrameEncoder:
+    """SSE文本帧"""
+
+    media_type = "text/event-stream"
+
+    def __init__(self, media_type: Optional[str] = None):
+        if media_type:
+            self.media_type = media_type
+
+    def encode(self, event: Dict[str, Any]) -> bytes:
+        return sse_frame(event)
+
+class MsgpackFrameEncoder(FrameEncoder):
+    """带长度前缀的MessagePack二进制帧"""
+
+    media_type = MSGPACK_MEDIA_TYPE
+
+    def encode(self, event: Dict[str, Any]) -> bytes:
+        payload = pack_event(event)
+        return _LENGTH_PREFIX.pack(len(payload)) + payload
+
+def accepts_msgpack(accept: Optional[str]) -> bool:
+    """Accept头是否请求MessagePack帧（未安装msgpack时按文本帧处理）"""
+    if not accept or msgpack is None:
+        return False
+    media_types = [part.split(";")[0].strip().lower() for part in accept.split(",")]
+    return MSGPACK_MEDIA_TYPE in media_types
+
+def negotiate_encoder(accept: Optional[str], media_type: Optional[str] = None) -> FrameEncoder:
+    """按Accept头选择帧编码
+
+    Args:
+        accept: 请求的Accept头
+        media_type: 文本帧使用的媒体类型，不指定时为text/event-stream
+    """
+    if accepts_msgpack(accept):
+        return MsgpackFrameEncoder()
+    return FrameEncoder(media_type)
@@ -0,0 +1,218 @@
+"""
+模型健康探测服务
+定期向配置的模型发送极小的补全请求，在滚动窗口内记录首字延迟(TTFT)、
+生成速度(tokens/s)和错误率，并据此给出健康评分供运维和路由使用
+"""
+
+import asyncio
+import math
+import time
+from collections import deque
+from typing import Deque, Dict, List, Optional, Tuple, Any
+from config import settings
+
+class HealthSample:
+    """单次请求的健康样本"""
+    __slots__ = ("timestamp", "success", "ttft", "tokens_per_sec", "error", "source")
+
+    def __init__(self, success: bool, ttft: Optional[float] = None,
+                 tokens_per_sec: Optional[float] = None, error: Optional[str] = None,
+                 source: str = "probe"):
+        self.timestamp = time.time()
+        self.success = success
+        self.ttft = ttft
+        self.tokens_per_sec = tokens_per_sec
+        self.error = error
+        self.source = source
+
+def _percentile(values: List[float], percent: float) -> Optional[float]:
+    """计算百分位数（最近秩法）"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, math.ceil(percent / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+class ModelHealthMonitor:
+    def __init__(self):
+        self._windows: Dict[Tuple[str, str], Deque[HealthSample]] = {}
+        self._last_probe: Dict[Tuple[str, str], float] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    def _window(self, provider: str, model: str) -> Deque[HealthSample]:
+        key = (provider, model)
+        if key not in self._windows:
+            self._windows[key] = deque(maxlen=settings.health_window_size)
+        return self._windows[key]
+
+    def record(self, provider: str, model: str, success: bool, ttft: Optional[float] = None,
+               tokens_per_sec: Optional[float] = None, error: Optional[str] = None,
+               source: str = "probe"):
+        """记录一次请求结果（探测或真实流量）
+
+        只记录已知模型：客户端可以传入任意模型名，为每个模型名建立窗口会使内存无限增长
+        """
+        from services.provider_router import provider_router
+
+        if not provider_router.is_known_model(model):
+            return
+        self._window(provider, model).append(
+            HealthSample(success, ttft, tokens_per_sec, error, source)
+        )
+
+    def _recent_samples(self, provider: str, model: str) -> List[HealthSample]:
+        """获取时间窗口内的样本"""
+        window = self._windows.get((provider, model))
+        if not window:
+            return []
+        cutoff = time.time() - settings.health_window_seconds
+        return [sample for sample in window if sample.timestamp >= cutoff]
+
+    def get_stats(self, provider: str, model: str) -> Dict[str, Any]:
+        """计算指定模型在滚动窗口内的统计和评分"""
+        samples = self._recent_samples(provider, model)
+        successes = [s for s in samples if s.success]
+        ttfts = [s.ttft for s in successes if s.ttft is not None]
+        speeds = [s.tokens_per_sec for s in successes if s.tokens_per_sec is not None]
+
+        error_rate = (len(samples) - len(successes)) / len(samples) if samples else None
+        ttft_p50 = _percentile(ttfts, 50)
+        tps_avg = sum(speeds) / len(speeds) if speeds else None
+        last_error = next((s.error for s in reversed(samples) if not s.success), None)
+
+        return {
+            "provider": provider,
+            "model": model,
+            "samples": len(samples),
+            "error_rate": round(error_rate, 4) if error_rate is not None else None,
+            "ttft_ms": {
+                "avg": round(sum(ttfts) / len(ttfts) * 1000, 2) if ttfts else None,
+                "p50": round(ttft_p50 * 1000, 2) if ttft_p50 is not None else None,
+                "p90": round(_percentile(ttfts, 90) * 1000, 2) if ttfts else None
+            },
+            "tokens_per_sec": round(tps_avg, 2) if tps_avg is not None else None,
+            "score": self._score(error_rate, ttft_p50, tps_avg),
+            "healthy": error_rate is not None and error_rate < settings.health_error_threshold,
+            "last_error": last_error,
+            "last_probe_at": self._last_probe.get((provider, model))
+        }
+
+    def _score(self, error_rate: Optional[float], ttft: Optional[float],
+               tokens_per_sec: Optional[float]) -> Optional[float]:
+        """综合评分（0-100）：成功率为乘数，首字延迟占70%，生成速度占30%"""
+        if error_rate is None:
+            return None
+        latency_score = 1 / (1 + ttft) if ttft is not None else 0.0
+        throughput_score = tokens_per_sec / (tokens_per_sec + 50) if tokens_per_sec else 0.0
+        return round(100 * (1 - error_rate) * (0.7 * latency_score + 0.3 * throughput_score), 2)
+
+    def get_score(self, provider: str, model: str) -> Optional[float]:
+        """获取指定模型的评分，没有样本时返回None"""
+        return self.get_stats(provider, model)["score"]
+
+    def get_ttft_percentile(self, provider: str, model: str, percent: float) -> Optional[float]:
+        """获取窗口内成功请求的TTFT百分位数（秒）"""
+        ttfts = [s.ttft for s in self._recent_samples(provider, model) if s.success and s.ttft is not None]
+        return _percentile(ttfts, percent)
+
+    def snapshot(self) -> List[Dict[str, Any]]:
+        """获取所有已观测模型的健康状态，按评分降序"""
+        stats = [self.get_stats(provider, model) for provider, model in list(self._windows)]
+        stats.sort(key=lambda item: item["score"] if item["score"] is not None else -1, reverse=True)
+        return stats
+
+    def _probe_targets(self) -> List[Tuple[str, str]]:
+        """解析探测目标配置"""
+        targets = []
+        for entry in settings.health_probe_models:
+            if ":" in entry:
+                provider, model = entry.split(":", 1)
+            else:
+                provider, model = settings.current_provider, entry
+            targets.append((provider.strip(), model.strip()))
+        return targets
+
+    async def probe(self, provider: str, model: str) -> Dict[str, Any]:
+        """向指定模型发送一次极小的流式补全探测"""
+        from services.openai_service import openai_service
+        from services.retry import RetryPolicy
+
+        def run_probe(timeout: float):
+            client = openai_service.get_client(provider)
+            start = time.perf_counter()
+            first_token_at = None
+            chunk_count = 0
+            stream = client.chat.completions.create(
+                model=model,
+                messages=[{"role": "user", "content": "ping"}],
+                stream=True,
+                max_tokens=settings.health_probe_max_tokens,
+                timeout=timeout
+            )
+            for chunk in stream:
+                if not chunk.choices:
+                    continue
+                if first_token_at is None:
+                    first_token_at = time.perf_counter()
+                chunk_count += 1
+            end = time.perf_counter()
+
+            ttft = (first_token_at or end) - start
+            generation_time = end - (first_token_at or end)
+            tokens_per_sec = chunk_count / generation_time if generation_time > 0 else None
+            return ttft, tokens_per_sec
+
+        from services.provider_router import provider_router
+
+        if provider_router.is_known_model(model):
+            self._last_probe[(provider, model)] = time.time()
+        try:
+            loop = asyncio.get_event_loop()
+
+            async def attempt(remaining: float):
+                return await loop.run_in_executor(
+                    None, run_probe, min(remaining, settings.health_probe_timeout)
+                )
+
+            # 探测也是幂等调用，临时故障短暂重试一次，避免瞬时抖动拉低评分
+            policy = RetryPolicy(max_attempts=2, deadline=settings.health_probe_timeout * 2)
+            ttft, tokens_per_sec = await policy.run(attempt, name="health_probe")
+            self.record(provider, model, True, ttft, tokens_per_sec)
+        except Exception as e:
+            print(f"模型健康探测失败 {provider}:{model}: {e}")
+            self.record(provider, model, False, error=str(e))
+        return self.get_stats(provider, model)
+
+    async def probe_all(self) -> List[Dict[str, Any]]:
+        """并发探测所有配置的目标"""
+        targets = self._probe_targets()
+        if not targets:
+            return []
+        return await asyncio.gather(*(self.probe(provider, model) for provider, model in targets))
+
+    async def _run(self):
+        """后台定时探测循环"""
+        while True:
+            try:
+                await self.probe_all()
+            except Exception as e:
+                print(f"模型健康探测循环错误: {e}")
+            await asyncio.sleep(settings.health_probe_interval)
+
+    def start(self):
+        """启动后台探测任务"""
+        if settings.health_probe_enabled and self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """停止后台探测任务"""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+# 全局健康监控实例
+health_monitor = ModelHealthMonitor()
@@ -0,0 +1,50 @@
+"""
+对冲请求预算
+限制每个用户和全局同时进行的对冲请求数量，保证额外开销有上限
+"""
+
+from collections import defaultdict
+from typing import Dict, Any
+from config import settings
+from services.health_service import health_monitor
+
+def get_hedge_delay(provider: str, model: str) -> float:
+    """计算对冲延迟（秒）：优先使用配置值，其次使用观测到的TTFT p90"""
+    if settings.hedge_delay_ms is not None:
+        delay_ms = settings.hedge_delay_ms
+    else:
+        p90 = health_monitor.get_ttft_percentile(provider, model, 90)
+        delay_ms = p90 * 1000 if p90 is not None else settings.hedge_default_delay_ms
+    return max(delay_ms, settings.hedge_min_delay_ms) / 1000
+
+class HedgeBudget:
+    def __init__(self):
+        self._per_user: Dict[str, int] = defaultdict(int)
+        self._total = 0
+
+    def acquire(self, user_key: str) -> bool:
+        """尝试占用一个对冲名额"""
+        if self._total >= settings.hedge_max_global:
+            return False
+        if self._per_user[user_key] >= settings.hedge_max_per_user:
+            return False
+        self._per_user[user_key] += 1
+        self._total += 1
+        return True
+
+    def release(self, user_key: str):
+        """释放对冲名额"""
+        self._per_user[user_key] -= 1
+        if self._per_user[user_key] <= 0:
+            del self._per_user[user_key]
+        self._total -= 1
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "in_flight": self._total,
+            "max_global": settings.hedge_max_global,
+            "max_per_user": settings.hedge_max_per_user
+        }
+
+# 全局对冲预算实例
+hedge_budget = HedgeBudget()
@@ -0,0 +1,196 @@
+"""
+幂等键（Idempotency-Key）
+客户端超时重试时，带相同幂等键的请求不会重复调用上游或重复写入消息：
+处理中的流式请求直接挂接到原来的输出流，已完成的请求重放保存的结果。
+幂等键和结果保存在数据库中，超过有效期后清理
+"""
+
+import hashlib
+import json
+import time
+from datetime import datetime, timedelta
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional
+from pydantic import BaseModel
+from sqlalchemy import delete, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from config import settings
+from database import AsyncSessionLocal
+from models import IdempotencyRecord
+from services.metrics import metrics
+from services.single_flight import SingleFlight
+
+NEW = "new"
+IN_PROGRESS = "in_progress"
+COMPLETED = "completed"
+
+class IdempotencyConflict(Exception):
+    """幂等键冲突：用于不同的请求（422）或正在其他进程中处理（409）"""
+
+    def __init__(self, message: str, status_code: int):
+        super().__init__(message)
+        self.status_code = status_code
+
+class IdempotencyState:
+    """幂等键的当前状态"""
+
+    def __init__(self, scope_key: str, status: str, response: Any = None):
+        self.scope_key = scope_key
+        self.status = status
+        self.response = response
+
+def hash_request(request: BaseModel) -> str:
+    """请求体的规范化哈希，用于检查同一幂等键是否被用于不同的请求"""
+    canonical = json.dumps(request.model_dump(mode="json"), sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+class IdempotencyStore:
+    def __init__(self):
+        # 本进程中正在处理的请求，重试时挂接到同一输出
+        self.flights = SingleFlight()
+        self._last_purge = 0.0
+
+    def scope(self, identity: str, endpoint: str, key: str) -> str:
+        """幂等键按身份和接口隔离"""
+        return f"{identity}:{endpoint}:{key}"
+
+    async def _purge_expired(self, db: AsyncSession):
+        now = time.time()
+        if now - self._last_purge < 60:
+            return
+        self._last_purge = now
+        await db.execute(delete(IdempotencyRecord).where(IdempotencyRecord.expires_at < datetime.utcnow()))
+        await db.commit()
+
+    @staticmethod
+    async def _get_record(db: AsyncSession, scope_key: str) -> Optional[IdempotencyRecord]:
+        return await db.scalar(select(IdempotencyRecord).where(IdempotencyRecord.scope_key == scope_key).limit(1))
+
+    async def begin(self, scope_key: str, request_hash: str) -> IdempotencyState:
+        """登记幂等键
+
+        Returns:
+            NEW: 首次出现，调用方负责处理并在结束后调用complete或abandon
+            IN_PROGRESS: 本进程正在处理，可以挂接
+            COMPLETED: 已完成，response为保存的结果
+
+        Raises:
+            IdempotencyConflict: 幂等键用于不同的请求，或在其他进程中处理
+        """
+        async with AsyncSessionLocal() as db:
+            await self._purge_expired(db)
+            now = datetime.utcnow()
+            record = await self._get_record(db, scope_key)
+
+            if record is not None:
+                stale = (record.status == IN_PROGRESS and not self.flights.is_in_flight(scope_key)
+                         and record.created_at is not None
+                         and record.created_at.replace(tzinfo=None) < now - timedelta(seconds=settings.idempotency_stale_after))
+                if record.expires_at < now or stale:
+                    # 已过期，或处理进程已退出未能完成
+                    await db.delete(record)
+                    await db.commit()
+                    record = None
+
+            if record is None:
+                db.add(IdempotencyRecord(
+                    scope_key=scope_key,
+                    request_hash=request_hash,
+                    status=IN_PROGRESS,
+                    expires_at=now + timedelta(seconds=settings.idempotency_ttl)
+                ))
+                try:
+                    await db.commit()
+                    return IdempotencyState(scope_key, NEW)
+                except IntegrityError:
+                    await db.rollback()
+                    record = await self._get_record(db, scope_key)
+
+            if record.request_hash != request_hash:
+                raise IdempotencyConflict("Idempotency-Key已用于不同的请求", 422)
+            metrics.incr("idempotency.repeat", status=record.status)
+            if record.status == COMPLETED:
+                return IdempotencyState(scope_key, COMPLETED, json.loads(record.response))
+            if self.flights.is_in_flight(scope_key):
+                return IdempotencyState(scope_key, IN_PROGRESS)
+            raise IdempotencyConflict("相同Idempotency-Key的请求正在处理中", 409)
+
+    async def complete(self, scope_key: str, response: Any):
+        """保存结果"""
+        async with AsyncSessionLocal() as db:
+            await db.execute(
+                update(IdempotencyRecord)
+                .where(IdempotencyRecord.scope_key == scope_key)
+                .values(status=COMPLETED, response=json.dumps(response, ensure_ascii=False))
+            )
+            await db.commit()
+
+    async def abandon(self, scope_key: str):
+        """处理失败，删除登记以便重试时重新处理"""
+        async with AsyncSessionLocal() as db:
+            await db.execute(delete(IdempotencyRecord).where(IdempotencyRecord.scope_key == scope_key))
+            await db.commit()
+
+    async def _load_response(self, scope_key: str) -> Any:
+        async with AsyncSessionLocal() as db:
+            record = await self._get_record(db, scope_key)
+            if record is None or record.status != COMPLETED:
+                return None
+            return json.loads(record.response)
+
+    def run_stream(self, scope_key: str, factory: Callable[[], AsyncIterator[str]],
+                   succeeded: Callable[[], bool]) -> AsyncIterator[str]:
+        """首次处理流式请求：输出事件同时保存，客户端断开后继续处理以便重试时挂接
+
+        Args:
+            scope_key: 幂等键
+            factory: 返回输出事件迭代器的函数，事件需可JSON序列化以便保存
+            succeeded: 输出结束后判断是否成功，失败时不保存结果
+        """
+        async def produce(_meta: Dict[str, Any]) -> AsyncIterator[str]:
+            frames: List[str] = []
+            finished = False
+            try:
+                async for frame in factory():
+                    frames.append(frame)
+                    yield frame
+                finished = True
+            finally:
+                if finished and succeeded():
+                    await self.complete(scope_key, frames)
+                else:
+                    await self.abandon(scope_key)
+
+        return self.flights.stream(scope_key, produce, {}, cancel_when_idle=False)
+
+    async def attach_stream(self, scope_key: str) -> AsyncIterator[str]:
+        """重试的流式请求：挂接到处理中的输出，或重放已保存的事件"""
+        if self.flights.is_in_flight(scope_key):
+            async for frame in self.flights.stream(scope_key, None, {}, cancel_when_idle=False):
+                yield frame
+            return
+        for frame in await self._load_response(scope_key) or []:
+            yield frame
+
+    async def run_call(self, scope_key: str, factory: Callable[[], Awaitable[BaseModel]]) -> BaseModel:
+        """首次处理非流式请求，成功时保存结果"""
+        async def produce(_meta: Dict[str, Any]) -> BaseModel:
+            try:
+                result = await factory()
+            except BaseException:
+                await self.abandon(scope_key)
+                raise
+            await self.complete(scope_key, result.model_dump(mode="json"))
+            return result
+
+        return await self.flights.call(scope_key, produce, {})
+
+    async def attach_call(self, scope_key: str) -> Any:
+        """重试的非流式请求：等待处理中的结果，或返回已保存的结果"""
+        if self.flights.is_in_flight(scope_key):
+            result = await self.flights.call(scope_key, None, {})
+            return result.model_dump(mode="json")
+        return await self._load_response(scope_key)
+
+# 全局幂等键存储实例
+idempotency_store = IdempotencyStore()
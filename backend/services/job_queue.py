@@ -0,0 +1,261 @@
+"""
+异步聊天任务队列
+长时间运行的补全（长文档、推理模型）以任务形式提交：任务保存在SQLite的chat_jobs表中，
+由后端进程内的asyncio工作协程池执行，客户端可以轮询或流式订阅状态、稍后获取结果。
+进程重启时，中断的任务按剩余尝试次数重新排队或标记为失败
+"""
+
+import asyncio
+from datetime import datetime
+from typing import Any, AsyncIterator, Dict, List, Optional
+from sqlalchemy import select, update
+from config import settings
+from database import AsyncSessionLocal, SessionLocal
+from models import ChatJob, ChatJobResponse, ChatRequest, User
+from services.chat_cache import lookup_chat_cache
+from services.chat_pipeline import stream_chat
+from services.metrics import metrics
+from services.rate_limiter import rate_limiter
+
+QUEUED = "queued"
+RUNNING = "running"
+COMPLETED = "completed"
+FAILED = "failed"
+CANCELLED = "cancelled"
+TERMINAL_STATUSES = {COMPLETED, FAILED, CANCELLED}
+
+def job_to_response(job: ChatJob) -> ChatJobResponse:
+    return ChatJobResponse(
+        job_id=job.job_id,
+        status=job.status,
+        model_used=job.model_used,
+        provider=job.provider,
+        result=job.result,
+        error=job.error,
+        attempts=job.attempts,
+        created_at=job.created_at.isoformat() if job.created_at else None,
+        started_at=job.started_at.isoformat() if job.started_at else None,
+        completed_at=job.completed_at.isoformat() if job.completed_at else None
+    )
+
+class JobQueue:
+    def __init__(self):
+        self._queue: Optional[asyncio.Queue] = None
+        self._workers: List[asyncio.Task] = []
+        # 运行中任务的执行协程和已生成的内容，供取消和流式订阅使用
+        self._running: Dict[str, asyncio.Task] = {}
+        self._partial: Dict[str, List[str]] = {}
+        self._listeners: Dict[str, List[asyncio.Queue]] = {}
+
+    async def _update(self, job_id: str, expected_status: Optional[str] = None, **fields) -> Optional[ChatJob]:
+        """更新任务并返回更新后的任务；指定expected_status时只在任务处于该状态时更新，否则返回None"""
+        async with AsyncSessionLocal() as db:
+            if fields:
+                query = update(ChatJob).where(ChatJob.job_id == job_id)
+                if expected_status is not None:
+                    query = query.where(ChatJob.status == expected_status)
+                result = await db.execute(query.values(**fields))
+                await db.commit()
+                if result.rowcount == 0:
+                    return None
+            return await db.scalar(select(ChatJob).where(ChatJob.job_id == job_id).limit(1))
+
+    def _publish(self, job_id: str, event: Dict[str, Any]):
+        for listener in self._listeners.get(job_id, []):
+            listener.put_nowait(event)
+
+    async def _set_status(self, job_id: str, status: str, expected_status: Optional[str] = None,
+                          **fields) -> Optional[ChatJob]:
+        job = await self._update(job_id, expected_status, status=status, **fields)
+        if job is not None:
+            self._publish(job_id, {"type": "status", **job_to_response(job).model_dump(exclude={"result"})})
+        return job
+
+    def _recover(self) -> List[str]:
+        """处理上次进程退出时未完成的任务，返回需要排队的任务ID"""
+        db = SessionLocal()
+        try:
+            pending = []
+            for job in db.query(ChatJob).filter(ChatJob.status.in_([QUEUED, RUNNING])).order_by(ChatJob.id).all():
+                if job.status == RUNNING:
+                    if job.attempts >= settings.job_max_attempts:
+                        job.status = FAILED
+                        job.error = "服务重启时任务中断，已达到最大尝试次数"
+                        job.completed_at = datetime.utcnow()
+                        continue
+                    job.status = QUEUED
+                pending.append(job.job_id)
+            db.commit()
+            return pending
+        finally:
+            db.close()
+
+    def start(self):
+        """启动工作协程池，并恢复未完成的任务"""
+        if self._workers:
+            return
+        self._queue = asyncio.Queue()
+        pending = self._recover()
+        for job_id in pending:
+            self._queue.put_nowait(job_id)
+        if pending:
+            print(f"ℹ️  恢复 {len(pending)} 个未完成的任务")
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(settings.job_workers)]
+
+    async def stop(self):
+        """停止工作协程，运行中的任务保持running状态，下次启动时恢复"""
+        for worker in self._workers:
+            worker.cancel()
+        for worker in self._workers:
+            try:
+                await worker
+            except asyncio.CancelledError:
+                pass
+        self._workers = []
+
+    async def submit(self, user: User, request: ChatRequest) -> ChatJob:
+        """提交任务"""
+        async with AsyncSessionLocal() as db:
+            job = ChatJob(
+                user_id=user.id,
+                request=request.model_dump_json(),
+                model_used=request.model or settings.current_model
+            )
+            db.add(job)
+            await db.commit()
+            await db.refresh(job)
+        self._queue.put_nowait(job.job_id)
+        metrics.incr("jobs.submitted")
+        return job
+
+    async def get(self, job_id: str, user: User) -> Optional[ChatJob]:
+        async with AsyncSessionLocal() as db:
+            return await db.scalar(
+                select(ChatJob).where(ChatJob.job_id == job_id, ChatJob.user_id == user.id).limit(1)
+            )
+
+    async def list_jobs(self, user: User, limit: int = 50) -> List[ChatJob]:
+        async with AsyncSessionLocal() as db:
+            result = await db.scalars(
+                select(ChatJob).where(ChatJob.user_id == user.id).order_by(ChatJob.id.desc()).limit(limit)
+            )
+            return list(result)
+
+    async def cancel(self, job_id: str) -> bool:
+        """取消排队中或运行中的任务"""
+        task = self._running.get(job_id)
+        if task is not None:
+            task.cancel()
+            return True
+        # 只取消仍在排队的任务，与工作协程开始执行的状态更新互斥
+        job = await self._set_status(job_id, CANCELLED, QUEUED, completed_at=datetime.utcnow())
+        return job is not None
+
+    async def _worker(self):
+        while True:
+            job_id = await self._queue.get()
+            try:
+                await self._run(job_id)
+            except Exception as e:
+                print(f"任务 {job_id} 执行异常: {e}")
+            finally:
+                self._queue.task_done()
+
+    async def _run(self, job_id: str):
+        async with AsyncSessionLocal() as db:
+            job = await db.scalar(select(ChatJob).where(ChatJob.job_id == job_id).limit(1))
+            if job is None or job.status != QUEUED:
+                return
+            user = await db.get(User, job.user_id)
+            request = ChatRequest.model_validate_json(job.request)
+            attempts = job.attempts + 1
+
+        if await self._set_status(job_id, RUNNING, QUEUED, attempts=attempts, started_at=datetime.utcnow()) is None:
+            # 读取后已被取消
+            return
+        self._partial[job_id] = []
+        task = asyncio.create_task(self._generate(job_id, request, user))
+        self._running[job_id] = task
+        try:
+            content, meta = await asyncio.wait_for(task, timeout=settings.job_timeout)
+            if meta.get("error") or not meta.get("completed"):
+                metrics.incr("jobs.failed")
+                await self._set_status(job_id, FAILED, error=meta.get("error") or "上游未返回完整结果",
+                                       result=content or None, provider=meta.get("provider"),
+                                       completed_at=datetime.utcnow())
+            else:
+                metrics.incr("jobs.completed")
+                await self._set_status(job_id, COMPLETED, result=content, provider=meta.get("provider"),
+                                       completed_at=datetime.utcnow())
+        except asyncio.TimeoutError:
+            metrics.incr("jobs.failed")
+            await self._set_status(job_id, FAILED, error=f"任务超时（{settings.job_timeout}秒）",
+                                   completed_at=datetime.utcnow())
+        except asyncio.CancelledError:
+            if task.cancelled() and not self._workers_stopping():
+                # 用户取消
+                await self._set_status(job_id, CANCELLED, completed_at=datetime.utcnow())
+            else:
+                raise
+        finally:
+            self._running.pop(job_id, None)
+            self._partial.pop(job_id, None)
+
+    def _workers_stopping(self) -> bool:
+        current = asyncio.current_task()
+        return current is not None and current.cancelling() > 0
+
+    async def _generate(self, job_id: str, request: ChatRequest, user: Optional[User]):
+        """以流式方式调用上游，避免长时间生成时连接超时，同时推送增量内容"""
+        rate_identity = None
+        if user is not None and not rate_limiter.is_exempt(user):
+            rate_identity = rate_limiter.identity(user, None)
+        cache = await lookup_chat_cache(request, user)
+        meta: Dict[str, Any] = {}
+        parts = self._partial[job_id]
+        async for chunk in stream_chat(request, cache, meta, user, rate_identity):
+            if meta.get("error"):
+                break
+            parts.append(chunk)
+            self._publish(job_id, {"type": "content", "content": chunk})
+        return "".join(parts), meta
+
+    async def subscribe(self, job_id: str) -> AsyncIterator[Dict[str, Any]]:
+        """订阅任务状态：先输出当前状态和已生成的内容，再输出后续事件直到任务结束
+
+        先登记监听再读取状态和已生成的内容，之间发布的事件不会丢失
+        """
+        listener: asyncio.Queue = asyncio.Queue()
+        self._listeners.setdefault(job_id, []).append(listener)
+        try:
+            # 登记后立即（不让出事件循环）取已生成的内容，之后的增量只会出现在监听队列中
+            partial = "".join(self._partial.get(job_id, []))
+            job = await self._update(job_id)
+            if job is None:
+                return
+            yield {"type": "status", **job_to_response(job).model_dump(exclude={"result"})}
+            if job.status in TERMINAL_STATUSES:
+                return
+            if partial:
+                yield {"type": "content", "content": partial}
+            while True:
+                event = await listener.get()
+                yield event
+                if event["type"] == "status" and event["status"] in TERMINAL_STATUSES:
+                    return
+        finally:
+            listeners = self._listeners.get(job_id, [])
+            if listener in listeners:
+                listeners.remove(listener)
+            if not listeners:
+                self._listeners.pop(job_id, None)
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "workers": len(self._workers),
+            "queued": self._queue.qsize() if self._queue else 0,
+            "running": len(self._running)
+        }
+
+# 全局任务队列实例
+job_queue = JobQueue()
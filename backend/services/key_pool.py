@@ -0,0 +1,143 @@
+"""
+供应商API密钥池
+每个供应商可以配置多个密钥，请求按最少在途或加权轮询分配到各个密钥，
+返回429的密钥会被暂时移出轮换，整体吞吐随密钥数量线性扩展
+"""
+
+import time
+from typing import Dict, Iterable, List, Optional, Any
+from config import settings, get_provider_keys
+
+class KeyState:
+    """单个密钥的运行时状态"""
+
+    def __init__(self, key_id: str, api_key: str, weight: int = 1, label: str = None):
+        self.key_id = key_id
+        self.api_key = api_key
+        self.weight = max(1, weight)
+        self.label = label
+        self.in_flight = 0
+        self.cooldown_until = 0.0
+        self.current_weight = 0  # 平滑加权轮询的当前权重
+        self.total_requests = 0
+        self.rate_limited_count = 0
+
+    def is_cooling(self) -> bool:
+        return time.time() < self.cooldown_until
+
+class KeyLease:
+    """一次请求对密钥的占用，请求结束时释放"""
+
+    def __init__(self, provider: str, state: KeyState):
+        self.provider = provider
+        self.key_id = state.key_id
+        self.api_key = state.api_key
+        self._state = state
+        self._released = False
+        self._release_callbacks = []
+
+    def on_release(self, callback):
+        """注册释放时的回调（如归还并发名额）"""
+        self._release_callbacks.append(callback)
+
+    def release(self):
+        if not self._released:
+            self._released = True
+            self._state.in_flight -= 1
+            for callback in self._release_callbacks:
+                callback()
+
+class KeyPool:
+    def __init__(self):
+        self._pools: Dict[str, Dict[str, KeyState]] = {}
+
+    def _keys(self, provider: str) -> Dict[str, KeyState]:
+        """获取供应商的密钥状态（首次使用时从配置加载）"""
+        if provider not in self._pools:
+            try:
+                entries = get_provider_keys(provider)
+            except ValueError:
+                entries = []
+            self._pools[provider] = {
+                entry["id"]: KeyState(entry["id"], entry["api_key"], entry.get("weight", 1), entry.get("label"))
+                for entry in entries
+            }
+        return self._pools[provider]
+
+    def invalidate(self, provider: str = None):
+        """密钥配置变更后重新加载
+
+        仍然存在且密钥未变的沿用原状态对象（只更新权重和名称），进行中的请求释放时扣减的就是当前状态的在途计数
+        """
+        providers = [provider] if provider else list(self._pools)
+        for name in providers:
+            old_states = self._pools.pop(name, {})
+            new_states = self._keys(name)
+            for key_id, state in new_states.items():
+                old = old_states.get(key_id)
+                if old and old.api_key == state.api_key:
+                    old.weight = state.weight
+                    old.label = state.label
+                    new_states[key_id] = old
+
+    def _available(self, provider: str, exclude: Iterable[str] = ()) -> List[KeyState]:
+        excluded = set(exclude)
+        return [state for state in self._keys(provider).values()
+                if state.key_id not in excluded and not state.is_cooling()]
+
+    def has_available(self, provider: str, exclude: Iterable[str] = ()) -> bool:
+        """是否还有可用（未冷却）的密钥"""
+        return bool(self._available(provider, exclude))
+
+    def acquire(self, provider: str, exclude: Iterable[str] = ()) -> Optional[KeyLease]:
+        """为请求选择一个密钥，没有可用密钥时返回None"""
+        candidates = self._available(provider, exclude)
+        if not candidates:
+            return None
+
+        if settings.key_pool_strategy == "weighted_round_robin":
+            # 平滑加权轮询（nginx算法）
+            total_weight = sum(state.weight for state in candidates)
+            for state in candidates:
+                state.current_weight += state.weight
+            chosen = max(candidates, key=lambda state: state.current_weight)
+            chosen.current_weight -= total_weight
+        else:
+            # 最少在途请求（按权重归一化），相同时选择累计请求较少的密钥
+            chosen = min(candidates, key=lambda state: (state.in_flight / state.weight,
+                                                        state.total_requests / state.weight))
+
+        chosen.in_flight += 1
+        chosen.total_requests += 1
+        return KeyLease(provider, chosen)
+
+    def mark_rate_limited(self, provider: str, key_id: str, retry_after: Optional[float] = None):
+        """密钥被限流（429），暂时移出轮换"""
+        state = self._keys(provider).get(key_id)
+        if state:
+            state.rate_limited_count += 1
+            state.cooldown_until = time.time() + (retry_after or settings.key_cooldown_seconds)
+
+    def get_api_key(self, provider: str, key_id: str) -> Optional[str]:
+        state = self._keys(provider).get(key_id)
+        return state.api_key if state else None
+
+    def status(self, provider: str) -> List[Dict[str, Any]]:
+        """获取供应商各密钥的运行时状态（不包含密钥明文）"""
+        now = time.time()
+        return [
+            {
+                "id": state.key_id,
+                "label": state.label,
+                "weight": state.weight,
+                "in_flight": state.in_flight,
+                "total_requests": state.total_requests,
+                "rate_limited_count": state.rate_limited_count,
+                "cooling_down": state.is_cooling(),
+                "cooldown_remaining": round(max(0.0, state.cooldown_until - now), 2)
+            }
+            for state in self._keys(provider).values()
+        ]
+
+# 全局密钥池实例
+key_pool = KeyPool()
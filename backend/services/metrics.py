@@ -0,0 +1,73 @@
+"""
+进程内指标统计
+提供计数器和延迟分布统计，通过 /metrics 端点导出
+"""
+
+import math
+import time
+from collections import defaultdict, deque
+from typing import Deque, Dict, Any
+
+def _metric_key(name: str, labels: Dict[str, Any]) -> str:
+    """生成带标签的指标名，如 hedge.win{provider=openai}"""
+    if not labels:
+        return name
+    label_str = ",".join(f"{key}={labels[key]}" for key in sorted(labels))
+    return f"{name}{{{label_str}}}"
+
+class MetricsRegistry:
+    def __init__(self, summary_size: int = 1000):
+        self._summary_size = summary_size
+        self._counters: Dict[str, float] = defaultdict(float)
+        self._summaries: Dict[str, Deque[float]] = {}
+        self._summary_totals: Dict[str, list] = defaultdict(lambda: [0, 0.0])
+        self._started_at = time.time()
+
+    def incr(self, name: str, value: float = 1, **labels):
+        """计数器累加"""
+        self._counters[_metric_key(name, labels)] += value
+
+    def observe(self, name: str, value: float, **labels):
+        """记录一次观测值（如延迟，单位秒）"""
+        key = _metric_key(name, labels)
+        if key not in self._summaries:
+            self._summaries[key] = deque(maxlen=self._summary_size)
+        self._summaries[key].append(value)
+        totals = self._summary_totals[key]
+        totals[0] += 1
+        totals[1] += value
+
+    def get_counter(self, name: str, **labels) -> float:
+        return self._counters.get(_metric_key(name, labels), 0)
+
+    def sum_counter(self, name: str) -> float:
+        """计数器在所有标签组合上的合计"""
+        prefix = name + "{"
+        return sum(value for key, value in self._counters.items() if key == name or key.startswith(prefix))
+
+    def _summarize(self, key: str) -> Dict[str, Any]:
+        values = sorted(self._summaries[key])
+        count, total = self._summary_totals[key]
+
+        def percentile(percent):
+            index = min(len(values) - 1, max(0, math.ceil(percent / 100 * len(values)) - 1))
+            return round(values[index], 4)
+
+        return {
+            "count": count,
+            "sum": round(total, 4),
+            "p50": percentile(50),
+            "p90": percentile(90),
+            "p99": percentile(99)
+        }
+
+    def snapshot(self) -> Dict[str, Any]:
+        """导出所有指标"""
+        return {
+            "uptime_seconds": round(time.time() - self._started_at, 2),
+            "counters": dict(self._counters),
+            "summaries": {key: self._summarize(key) for key in list(self._summaries)}
+        }
+
+# 全局指标实例
+metrics = MetricsRegistry()
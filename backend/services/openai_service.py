@@ -1,44 +1,67 @@
 from openai import OpenAI
-from typing import AsyncIterator, List, Dict, Any
+from typing import AsyncIterator, List, Dict, Any, Optional, Tuple
 import json
 import asyncio
 import os
-from config import get_current_provider_config, settings
-from models import ChatMessage, ChatRequest
+import threading
+import time
+from config import get_current_provider_config, get_provider_config, get_provider_base_url, settings
+from models import ChatMessage, ChatRequest, User
+from services.health_service import health_monitor
+from services.hedging import hedge_budget, get_hedge_delay
+from services.metrics import metrics
+from services.concurrency import concurrency_controller
+from services.key_pool import key_pool, KeyLease
+from services.provider_router import provider_router, get_status_code, get_retry_after
+from services.retry import retry_policy, RetryPolicy, UpstreamError
+from services.scheduler import fair_scheduler, SchedulerQueueTimeout
+
+# 请求未指定温度时的默认值
+DEFAULT_TEMPERATURE = 0.7
+
+class StreamDelta(str):
+    """流式增量内容，同时保留上游原始数据块，供兼容接口原样转发"""
+    chunk = None
 
 class OpenAIService:
     def __init__(self):
         self.client = None
+        self._clients: Dict[str, OpenAI] = {}
         self._update_client()
     
+    def _create_client(self, api_key: str, base_url: str) -> OpenAI:
+        """创建OpenAI客户端，避免代理问题"""
+        # 临时清除socks代理环境变量
+        original_all_proxy = os.environ.get('ALL_PROXY')
+        original_all_proxy_lower = os.environ.get('all_proxy')
+        
+        # 清除可能导致问题的socks代理
+        if original_all_proxy and 'socks' in original_all_proxy.lower():
+            os.environ.pop('ALL_PROXY', None)
+        if original_all_proxy_lower and 'socks' in original_all_proxy_lower.lower():
+            os.environ.pop('all_proxy', None)
+        
+        try:
+            # 重试由RetryPolicy和故障转移统一处理，关闭SDK内置重试避免重复等待
+            return OpenAI(
+                api_key=api_key,
+                base_url=base_url,
+                max_retries=0
+            )
+        finally:
+            # 恢复原始环境变量
+            if original_all_proxy:
+                os.environ['ALL_PROXY'] = original_all_proxy
+            if original_all_proxy_lower:
+                os.environ['all_proxy'] = original_all_proxy_lower
+    
     def _update_client(self):
         """更新OpenAI客户端配置"""
+        self._clients = {}
+        key_pool.invalidate()
         try:
             config = get_current_provider_config()
-            
-            # 创建OpenAI客户端，避免代理问题
-            # 临时清除socks代理环境变量
-            original_all_proxy = os.environ.get('ALL_PROXY')
-            original_all_proxy_lower = os.environ.get('all_proxy')
-            
-            # 清除可能导致问题的socks代理
-            if original_all_proxy and 'socks' in original_all_proxy.lower():
-                os.environ.pop('ALL_PROXY', None)
-            if original_all_proxy_lower and 'socks' in original_all_proxy_lower.lower():
-                os.environ.pop('all_proxy', None)
-            
-            try:
-                self.client = OpenAI(
-                    api_key=config["api_key"],
-                    base_url=config["base_url"]
-                )
-            finally:
-                # 恢复原始环境变量
-                if original_all_proxy:
-                    os.environ['ALL_PROXY'] = original_all_proxy
-                if original_all_proxy_lower:
-                    os.environ['all_proxy'] = original_all_proxy_lower
-                    
+            self.client = self._create_client(config["api_key"], config["base_url"])
         except Exception as e:
             print(f"OpenAI客户端配置错误: {e}")
             self.client = None
@@ -47,6 +70,44 @@ class OpenAIService:
         """重新加载配置"""
         self._update_client()
     
+    def get_client(self, provider: str = None, key_id: str = None) -> OpenAI:
+        """获取指定供应商的客户端（按供应商和密钥缓存）
+        
+        Args:
+            provider: 供应商名称，如果不指定则使用当前供应商
+            key_id: 密钥池中的密钥ID，如果不指定则使用供应商的主密钥
+        """
+        if key_id is None:
+            if not provider or provider == settings.current_provider:
+                if not self.client:
+                    raise Exception("OpenAI客户端未配置")
+                return self.client
+            
+            if provider not in self._clients:
+                config = get_provider_config(provider)
+                self._clients[provider] = self._create_client(config["api_key"], config["base_url"])
+            return self._clients[provider]
+        
+        provider = provider or settings.current_provider
+        cache_key = f"{provider}:{key_id}"
+        if cache_key not in self._clients:
+            api_key = key_pool.get_api_key(provider, key_id)
+            if not api_key:
+                raise ValueError(f"供应商 {provider} 的密钥 {key_id} 不存在")
+            self._clients[cache_key] = self._create_client(api_key, get_provider_base_url(provider))
+        return self._clients[cache_key]
+    
+    def _record_failure(self, provider: str, key_id: str, model: str, error: Exception):
+        """记录上游失败：429只冷却对应密钥，其余密钥仍可用时不计入供应商熔断"""
+        if get_status_code(error) == 429:
+            concurrency_controller.get(provider, key_id).record_rate_limited()
+            key_pool.mark_rate_limited(provider, key_id, get_retry_after(error))
+            if key_pool.has_available(provider):
+                health_monitor.record(provider, model, False, error=str(error), source="traffic")
+                return
+        provider_router.breaker(provider).record_failure(error)
+        health_monitor.record(provider, model, False, error=str(error), source="traffic")
+    
     def _categorize_model(self, model_id: str) -> str:
         """根据模型ID分类模型"""
         model_id_lower = model_id.lower()
@@ -86,53 +147,19 @@ class OpenAIService:
         Args:
             provider: 供应商名称，如果不指定则使用当前供应商
         """
-        # 如果指定了供应商，临时切换客户端配置
-        original_provider = settings.current_provider
-        temp_client = None
-        
         try:
-            if provider and provider != settings.current_provider:
-                # 临时切换到指定供应商
-                settings.current_provider = provider
-                
-                # 获取指定供应商的配置
-                from config import get_current_provider_config, PROVIDERS
-                provider_config = get_current_provider_config()
-                
-                # 创建临时客户端，避免代理问题
-                original_all_proxy = os.environ.get('ALL_PROXY')
-                original_all_proxy_lower = os.environ.get('all_proxy')
-                
-                # 清除可能导致问题的socks代理
-                if original_all_proxy and 'socks' in original_all_proxy.lower():
-                    os.environ.pop('ALL_PROXY', None)
-                if original_all_proxy_lower and 'socks' in original_all_proxy_lower.lower():
-                    os.environ.pop('all_proxy', None)
-                
-                try:
-                    temp_client = OpenAI(
-                        api_key=provider_config["api_key"],
-                        base_url=provider_config["base_url"]
-                    )
-                finally:
-                    # 恢复原始环境变量
-                    if original_all_proxy:
-                        os.environ['ALL_PROXY'] = original_all_proxy
-                    if original_all_proxy_lower:
-                        os.environ['all_proxy'] = original_all_proxy_lower
-                client_to_use = temp_client
-            else:
-                # 使用当前客户端
-                if not self.client:
-                    raise Exception("OpenAI客户端未配置")
-                client_to_use = self.client
+            client_to_use = self.get_client(provider)
             
-            # 尝试使用标准OpenAI API获取模型列表
+            # 尝试使用标准OpenAI API获取模型列表（临时故障按重试策略重试）
             loop = asyncio.get_event_loop()
-            models = await loop.run_in_executor(
-                None, 
-                lambda: client_to_use.models.list()
-            )
+            
+            async def list_models(remaining: float):
+                return await loop.run_in_executor(
+                    None, 
+                    lambda: client_to_use.models.list(timeout=remaining)
+                )
+            
+            models = await retry_policy.run(list_models, name="get_models")
             
             # 返回获取到的模型列表
             model_list = []
@@ -155,97 +182,478 @@ class OpenAIService:
             # 如果API不支持获取模型列表，返回空列表
             # 让用户在设置中手动输入模型ID
             return []
+    
+    async def embed(self, texts: List[str], model: str, provider: str = None,
+                    policy: Optional[RetryPolicy] = None) -> List[List[float]]:
+        """计算文本向量
+        
+        Args:
+            texts: 待计算的文本
+            model: 嵌入模型ID
+            provider: 供应商名称，如果不指定则使用当前供应商
+            policy: 重试策略，不指定时使用默认策略；请求路径上的调用应使用较短的时间预算
+        
+        Raises:
+            UpstreamError: 重试耗尽或遇到不可重试的错误
+        """
+        client_to_use = self.get_client(provider)
+        loop = asyncio.get_event_loop()
+        
+        async def create_embeddings(remaining: float):
+            return await loop.run_in_executor(
+                None,
+                lambda: client_to_use.embeddings.create(model=model, input=texts, timeout=remaining)
+            )
+        
+        response = await (policy or retry_policy).run(create_embeddings, name="embed")
+        return [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
+    
+    def _build_messages(self, request: ChatRequest) -> List[Dict[str, str]]:
+        """转换消息格式"""
+        return [
+            {"role": msg.role.value, "content": msg.content}
+            for msg in request.messages
+        ]
+    
+    def get_sampling_params(self, request: ChatRequest) -> Dict[str, Any]:
+        """采样参数，未指定温度时使用默认值"""
+        params = {"temperature": request.temperature if request.temperature is not None else DEFAULT_TEMPERATURE}
+        if request.top_p is not None:
+            params["top_p"] = request.top_p
+        return params
+    
+    def _extract_content(self, choice) -> str:
+        """提取增量内容（兼容推理模型的reasoning_content）"""
+        if hasattr(choice.delta, 'content') and choice.delta.content:
+            return choice.delta.content
+        if hasattr(choice.delta, 'reasoning_content') and choice.delta.reasoning_content:
+            return choice.delta.reasoning_content
+        return ""
+    
+    def _close_stream(self, stream):
+        """关闭上游流式连接"""
+        try:
+            response = getattr(stream, 'response', None)
+            if response is not None:
+                response.close()
+        except Exception as e:
+            print(f"关闭上游流失败: {e}")
+    
+    async def _iter_stream(self, stream, lease: Optional[KeyLease] = None) -> AsyncIterator[str]:
+        """逐块读取同步流式响应，不阻塞事件循环；结束时释放密钥占用"""
+        loop = asyncio.get_event_loop()
+        iterator = iter(stream)
+        sentinel = object()
+        try:
+            while True:
+                chunk = await loop.run_in_executor(None, next, iterator, sentinel)
+                if chunk is sentinel:
+                    break
+                if not chunk.choices:
+                    continue
+                
+                choice = chunk.choices[0]
+                content = self._extract_content(choice)
+                if content:
+                    delta = StreamDelta(content)
+                    delta.chunk = chunk
+                    yield delta
+                
+                # 检查是否结束
+                if choice.finish_reason:
+                    break
         finally:
-            # 恢复原始供应商
-            if provider and provider != original_provider:
-                settings.current_provider = original_provider
+            self._close_stream(stream)
+            if lease:
+                lease.release()
     
-    async def chat_stream(self, request: ChatRequest) -> AsyncIterator[str]:
-        """流式聊天"""
-        if not self.client:
-            raise Exception("OpenAI客户端未配置")
+    async def _open_stream(self, lease: KeyLease, model: str, messages: List[Dict[str, str]],
+                           request: ChatRequest, timeout: Optional[float] = None) -> Tuple[AsyncIterator[str], Optional[str]]:
+        """使用指定密钥打开上游流并等待首个token
+        
+        Returns:
+            (剩余内容的迭代器, 首个token)；上游没有任何内容时首个token为None
+        """
+        loop = asyncio.get_event_loop()
+        cancelled = threading.Event()
+        holder = {}
+        
+        # 获取该密钥的并发名额，名额随密钥占用一起释放
+        limiter = concurrency_controller.get(lease.provider, lease.key_id)
+        try:
+            await limiter.acquire(settings.concurrency_queue_timeout)
+        except BaseException:
+            lease.release()
+            raise
+        lease.on_release(limiter.release)
+        start_time = time.perf_counter()
+        
+        def create_stream():
+            client = self.get_client(lease.provider, lease.key_id)
+            response = client.chat.completions.create(
+                model=model,
+                messages=messages,
+                stream=True,
+                **self.get_sampling_params(request),
+                max_tokens=request.max_tokens,
+                timeout=timeout
+            )
+            holder["response"] = response
+            # 请求在建立连接期间被取消（如对冲失败方），立即关闭
+            if cancelled.is_set():
+                self._close_stream(response)
+            return response
         
         try:
-            # 转换消息格式
-            messages = [
-                {"role": msg.role.value, "content": msg.content}
-                for msg in request.messages
-            ]
-            
             # 在异步上下文中运行同步代码
-            loop = asyncio.get_event_loop()
-            
-            def create_stream():
-                return self.client.chat.completions.create(
-                    model=request.model or settings.current_model,
-                    messages=messages,
-                    stream=True,
-                    temperature=0.7,
-                    max_tokens=request.max_tokens
-                )
-            
             response = await loop.run_in_executor(None, create_stream)
-            
-            # 处理流式响应
-            def process_stream():
-                for chunk in response:
-                    if not chunk.choices:
+        except asyncio.CancelledError:
+            cancelled.set()
+            if "response" in holder:
+                self._close_stream(holder["response"])
+            lease.release()
+            raise
+        except BaseException:
+            lease.release()
+            raise
+        
+        chunks = self._iter_stream(response, lease)
+        try:
+            first_chunk = await chunks.__anext__()
+        except StopAsyncIteration:
+            return chunks, None
+        except BaseException:
+            await chunks.aclose()
+            raise
+        limiter.record_success(time.perf_counter() - start_time)
+        return chunks, first_chunk
+    
+    def _discard_attempt(self, task: asyncio.Task):
+        """取消未胜出的请求，已经建立的上游流会被关闭"""
+        def close_if_opened(finished: asyncio.Task):
+            if finished.cancelled() or finished.exception() is not None:
+                return
+            chunks, _ = finished.result()
+            asyncio.ensure_future(chunks.aclose())
+        
+        if not task.done():
+            task.cancel()
+        task.add_done_callback(close_if_opened)
+    
+    async def _acquire_first_token(self, request: ChatRequest, model: str, messages: List[Dict[str, str]],
+                                   meta: Dict[str, Any], user_key: str,
+                                   timeout: Optional[float] = None) -> Tuple[str, AsyncIterator[str], Optional[str], float]:
+        """沿备用链获取首个token
+        
+        首个token之前失败会切换到下一个供应商；启用对冲时，如果在对冲延迟内没有收到首个token，
+        会向下一个供应商并发发送一份相同请求，先产出token的一方胜出，另一方被取消。
+        
+        Returns:
+            (供应商, 剩余内容迭代器, 首个token, 该次尝试的TTFT)
+        """
+        chain = await provider_router.get_fallback_chain(model)
+        # 本次请求占用的半开试探名额，尝试结束但没有记录成功或失败时释放
+        probes: Dict[str, int] = {}
+        providers = provider_router.iter_providers(chain, probes)
+        retry_providers: List[str] = []
+        tried_keys: Dict[str, set] = {}
+        pending: Dict[asyncio.Task, Tuple[KeyLease, float, bool]] = {}
+        last_error = None
+        hedged = False
+        hedge_acquired = False
+        meta.setdefault("attempts", [])
+        # 重试预算的截止时间，对冲和故障转移的尝试都只使用剩余的时间
+        deadline = time.perf_counter() + timeout if timeout is not None else None
+        
+        def launch(is_hedge: bool) -> bool:
+            """发起一次尝试：对冲优先使用下一个供应商，没有时使用同一供应商的其他密钥"""
+            nonlocal last_error
+            remaining = None
+            if deadline is not None:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    # 预算已用完时不再发起注定超时的尝试，避免计入供应商熔断
+                    if not is_hedge:
+                        last_error = last_error or asyncio.TimeoutError("重试时间预算已用完")
+                    return False
+            while True:
+                if is_hedge:
+                    provider = next(providers, None)
+                    if provider is None and pending:
+                        provider = next(iter(pending.values()))[0].provider
+                else:
+                    provider = retry_providers.pop(0) if retry_providers else next(providers, None)
+                if provider is None:
+                    return False
+                
+                lease = key_pool.acquire(provider, exclude=tried_keys.get(provider, ()))
+                if lease is None:
+                    provider_router.release_probe(provider, probes)
+                    if is_hedge:
+                        return False
+                    last_error = last_error or ValueError(f"供应商 {provider} 没有可用的API Key")
+                    continue
+                
+                tried_keys.setdefault(provider, set()).add(lease.key_id)
+                meta["attempts"].append(f"{provider}:{lease.key_id}")
+                task = asyncio.create_task(self._open_stream(lease, model, messages, request, remaining))
+                pending[task] = (lease, time.perf_counter(), is_hedge)
+                return True
+        
+        launch(False)
+        try:
+            while pending:
+                hedge_wait = None
+                if settings.hedging_enabled and not hedged and len(pending) == 1:
+                    lease, attempt_start, _ = next(iter(pending.values()))
+                    elapsed = time.perf_counter() - attempt_start
+                    hedge_wait = max(0.0, get_hedge_delay(lease.provider, model) - elapsed)
+                
+                done, _ = await asyncio.wait(pending, timeout=hedge_wait, return_when=asyncio.FIRST_COMPLETED)
+                
+                if not done:
+                    # 超过对冲延迟仍未收到首个token，发送对冲请求（每个请求最多一次）
+                    hedged = True
+                    if not hedge_budget.acquire(user_key):
+                        metrics.incr("hedge.capped")
                         continue
-                    
-                    choice = chunk.choices[0]
-                    content = ""
-                    
-                    if hasattr(choice.delta, 'content') and choice.delta.content:
-                        content = choice.delta.content
-                    elif hasattr(choice.delta, 'reasoning_content') and choice.delta.reasoning_content:
-                        content = choice.delta.reasoning_content
-                    
-                    if content:
-                        yield content
-                    
-                    # 检查是否结束
-                    if choice.finish_reason:
-                        break
-            
-            # 异步生成器
-            for content in await loop.run_in_executor(None, lambda: list(process_stream())):
-                yield content
+                    if launch(True):
+                        hedge_acquired = True
+                        meta["hedged"] = True
+                        metrics.incr("hedge.triggered", model=provider_router.model_label(model))
+                    else:
+                        hedge_budget.release(user_key)
+                    continue
                 
-        except Exception as e:
+                winner = None
+                for task in done:
+                    lease, attempt_start, is_hedge = pending.pop(task)
+                    if winner is not None:
+                        self._discard_attempt(task)
+                        provider_router.release_probe(lease.provider, probes)
+                        continue
+                    try:
+                        chunks, first_chunk = task.result()
+                    except Exception as e:
+                        print(f"供应商 {lease.provider} 流式响应失败，尝试下一个供应商: {e}")
+                        self._record_failure(lease.provider, lease.key_id, model, e)
+                        provider_router.release_probe(lease.provider, probes)
+                        # 被限流的密钥已冷却，优先用同一供应商的其他密钥重试
+                        if get_status_code(e) == 429 and key_pool.has_available(
+                                lease.provider, exclude=tried_keys.get(lease.provider, ())):
+                            retry_providers.append(lease.provider)
+                        last_error = e
+                        continue
+                    winner = (lease.provider, chunks, first_chunk, time.perf_counter() - attempt_start)
+                    meta["key_id"] = lease.key_id
+                    if hedged:
+                        metrics.incr("hedge.win" if is_hedge else "hedge.loss", provider=lease.provider)
+                
+                if winner is not None:
+                    provider_router.breaker(winner[0]).record_success()
+                    return winner
+                
+                # 所有进行中的请求都失败了，切换到下一个密钥或供应商
+                if not pending:
+                    launch(False)
+            
+            raise last_error or Exception("没有可用的供应商")
+        finally:
+            # 被取消的尝试不计入熔断结果，释放其占用的半开试探名额
+            for task, (lease, _, _) in pending.items():
+                self._discard_attempt(task)
+                provider_router.release_probe(lease.provider, probes)
+            if hedge_acquired:
+                hedge_budget.release(user_key)
+    
+    async def chat_stream(self, request: ChatRequest, meta: Optional[Dict[str, Any]] = None,
+                          user: Optional[User] = None) -> AsyncIterator[str]:
+        """流式聊天
+        
+        按模型的备用供应商链依次尝试，首个token之前的失败会透明切换到下一个健康供应商。
+        
+        Args:
+            request: 聊天请求
+            meta: 可选的字典，用于回传实际服务的供应商、排队时间等信息
+            user: 发起请求的用户，用于公平调度和对冲请求的按用户限额
+        """
+        if meta is None:
+            meta = {}
+        model = request.model or settings.current_model
+        messages = self._build_messages(request)
+        request_start = time.perf_counter()
+        meta["attempts"] = []
+        
+        # 公平调度：排队时间作为独立的延迟组成部分
+        try:
+            ticket = await fair_scheduler.acquire(user)
+        except SchedulerQueueTimeout as e:
             print(f"聊天流式响应错误: {e}")
+            meta["error"] = str(e)
             yield f"错误: {str(e)}"
-    
-    async def chat(self, request: ChatRequest) -> str:
-        """非流式聊天"""
-        if not self.client:
-            raise Exception("OpenAI客户端未配置")
+            return
+        meta["queue_wait"] = ticket.wait
         
         try:
-            # 转换消息格式
-            messages = [
-                {"role": msg.role.value, "content": msg.content}
-                for msg in request.messages
-            ]
+            # 首个token之前整条备用链都失败时，按重试策略退避后重新尝试
+            async def acquire(remaining: float):
+                return await self._acquire_first_token(
+                    request, model, messages, meta, f"user:{user.id}" if user else "anonymous", remaining
+                )
             
-            # 在异步上下文中运行同步代码
-            loop = asyncio.get_event_loop()
+            try:
+                provider, chunks, first_chunk, attempt_ttft = await retry_policy.run(acquire, name="chat_stream")
+            except Exception as e:
+                print(f"聊天流式响应错误: {e}")
+                meta["error"] = str(e)
+                yield f"错误: {str(e)}"
+                return
             
-            def create_completion():
-                return self.client.chat.completions.create(
-                    model=request.model or settings.current_model,
-                    messages=messages,
-                    stream=False,
-                    temperature=0.7,
-                    max_tokens=request.max_tokens
-                )
+            meta["provider"] = provider
+            if first_chunk is None:
+                # 上游正常结束但没有任何内容
+                return
             
-            response = await loop.run_in_executor(None, create_completion)
+            first_token_at = time.perf_counter()
+            meta["ttft"] = first_token_at - request_start
+            metrics.observe("chat.ttft", meta["ttft"], provider=provider)
+            metrics.observe("chat.upstream_ttft", meta["ttft"] - ticket.wait, provider=provider)
+            chunk_count = 1
             
-            return response.choices[0].message.content
+            try:
+                yield first_chunk
+                async for content in chunks:
+                    chunk_count += 1
+                    yield content
+            except Exception as e:
+                # 已经输出内容后无法透明切换供应商
+                print(f"聊天流式响应错误: {e}")
+                self._record_failure(provider, meta["key_id"], model, e)
+                meta["error"] = str(e)
+                yield f"错误: {str(e)}"
+                return
+            finally:
+                await chunks.aclose()
             
-        except Exception as e:
+            generation_time = time.perf_counter() - first_token_at
+            health_monitor.record(
+                provider, model, True, attempt_ttft,
+                chunk_count / generation_time if generation_time > 0 else None,
+                source="traffic"
+            )
+            meta["completed"] = True
+        finally:
+            ticket.release()
+    
+    async def _chat_once(self, request: ChatRequest, model: str, messages: List[Dict[str, str]],
+                         meta: Dict[str, Any], timeout: Optional[float] = None) -> str:
+        """沿备用链执行一次非流式聊天，全部失败时抛出最后一个错误"""
+        loop = asyncio.get_event_loop()
+        chain = await provider_router.get_fallback_chain(model)
+        last_error = None
+        
+        # 本次请求占用的半开试探名额，尝试结束但没有记录成功或失败时释放
+        probes: Dict[str, int] = {}
+        try:
+            for provider in provider_router.iter_providers(chain, probes):
+                tried_keys = set()
+                
+                # 同一供应商的密钥被限流时，换用其他密钥重试
+                while True:
+                    lease = key_pool.acquire(provider, exclude=tried_keys)
+                    if lease is None:
+                        last_error = last_error or ValueError(f"供应商 {provider} 没有可用的API Key")
+                        break
+                    tried_keys.add(lease.key_id)
+                    meta["attempts"].append(f"{provider}:{lease.key_id}")
+                    
+                    limiter = concurrency_controller.get(provider, lease.key_id)
+                    try:
+                        await limiter.acquire(settings.concurrency_queue_timeout)
+                    except Exception as e:
+                        lease.release()
+                        print(f"供应商 {provider} 聊天失败，尝试下一个供应商: {e}")
+                        last_error = e
+                        continue
+                    lease.on_release(limiter.release)
+                    
+                    def create_completion():
+                        client = self.get_client(provider, lease.key_id)
+                        return client.chat.completions.create(
+                            model=model,
+                            messages=messages,
+                            stream=False,
+                            **self.get_sampling_params(request),
+                            max_tokens=request.max_tokens,
+                            timeout=timeout
+                        )
+                    
+                    try:
+                        # 在异步上下文中运行同步代码
+                        start_time = time.perf_counter()
+                        response = await loop.run_in_executor(None, create_completion)
+                        limiter.record_success(time.perf_counter() - start_time)
+                    except Exception as e:
+                        print(f"供应商 {provider} 聊天失败，尝试下一个供应商: {e}")
+                        self._record_failure(provider, lease.key_id, model, e)
+                        last_error = e
+                        if get_status_code(e) == 429:
+                            continue
+                        break
+                    finally:
+                        lease.release()
+                    
+                    provider_router.breaker(provider).record_success()
+                    meta["provider"] = provider
+                    meta["key_id"] = lease.key_id
+                    if response.usage:
+                        meta["usage"] = {
+                            "prompt_tokens": response.usage.prompt_tokens,
+                            "completion_tokens": response.usage.completion_tokens
+                        }
+                    return response.choices[0].message.content
+            
+            raise last_error or Exception("没有可用的供应商")
+        finally:
+            for provider in list(probes):
+                provider_router.release_probe(provider, probes)
+    
+    async def chat(self, request: ChatRequest, meta: Optional[Dict[str, Any]] = None,
+                   user: Optional[User] = None) -> str:
+        """非流式聊天
+        
+        整条备用链都因临时故障失败时按重试策略退避重试。
+        
+        Args:
+            request: 聊天请求
+            meta: 可选的字典，用于回传实际服务的供应商、排队时间等信息
+            user: 发起请求的用户，用于公平调度
+        
+        Raises:
+            UpstreamError: 重试耗尽或遇到不可重试的错误，携带HTTP状态码和重试建议
+        """
+        if meta is None:
+            meta = {}
+        model = request.model or settings.current_model
+        messages = self._build_messages(request)
+        meta["attempts"] = []
+        
+        async def attempt(remaining: float) -> str:
+            return await self._chat_once(request, model, messages, meta, remaining)
+        
+        try:
+            ticket = await fair_scheduler.acquire(user)
+        except SchedulerQueueTimeout as e:
+            raise UpstreamError(str(e), 503, retry_after=settings.retry_base_delay)
+        meta["queue_wait"] = ticket.wait
+        
+        try:
+            return await retry_policy.run(attempt, name="chat")
+        except UpstreamError as e:
             print(f"聊天错误: {e}")
-            return f"错误: {str(e)}"
+            raise
+        finally:
+            ticket.release()
 
 # 全局服务实例
 openai_service = OpenAIService()
\ No newline at end of file
@@ -0,0 +1,308 @@
+"""
+供应商故障转移路由
+根据模型在各供应商的可用性构建有序的备用链，并为每个供应商维护熔断器，
+在5xx、超时和429时熔断，避免持续向故障供应商发送请求
+"""
+
+import asyncio
+import re
+import time
+from email.utils import parsedate_to_datetime
+from typing import Dict, Iterator, List, Optional, Set, Tuple, Any
+import openai
+from config import settings, PROVIDERS, is_provider_configured
+from services.health_service import health_monitor
+
+def get_status_code(error: Exception) -> Optional[int]:
+    """获取上游错误的HTTP状态码"""
+    return getattr(error, "status_code", None)
+
+def _parse_duration(value: str) -> Optional[float]:
+    """解析限流重置时间，如 "1s"、"6m0s"、"20ms"、"1.5" """
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    parts = re.findall(r"(\d+(?:\.\d+)?)(ms|h|m|s)", value)
+    if not parts:
+        return None
+    units = {"h": 3600, "m": 60, "s": 1, "ms": 0.001}
+    return sum(float(number) * units[unit] for number, unit in parts)
+
+def get_retry_after(error: Exception) -> Optional[float]:
+    """解析上游建议的重试等待时间（秒）
+    
+    依次检查 retry-after-ms、Retry-After（秒数或HTTP日期），
+    429时再参考 x-ratelimit-reset-requests / x-ratelimit-reset-tokens
+    """
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+    
+    value = headers.get("retry-after-ms")
+    if value:
+        try:
+            return max(0.0, float(value) / 1000)
+        except ValueError:
+            pass
+    
+    value = headers.get("retry-after")
+    if value:
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            pass
+        try:
+            retry_at = parsedate_to_datetime(value)
+            return max(0.0, retry_at.timestamp() - time.time())
+        except (TypeError, ValueError):
+            pass
+    
+    if get_status_code(error) == 429:
+        resets = [_parse_duration(headers[name]) for name in ("x-ratelimit-reset-requests", "x-ratelimit-reset-tokens")
+                  if headers.get(name)]
+        resets = [reset for reset in resets if reset is not None]
+        if resets:
+            return max(resets)
+    return None
+
+def is_retryable_error(error: Exception) -> bool:
+    """判断错误是否属于应当熔断/重试的临时故障（5xx、超时、429、连接错误）"""
+    if isinstance(error, (openai.APITimeoutError, openai.APIConnectionError)):
+        return True
+    status_code = get_status_code(error)
+    return status_code is not None and (status_code == 429 or status_code >= 500)
+
+class CircuitBreaker:
+    """供应商熔断器：closed -> open -> half_open -> closed"""
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, name: str):
+        self.name = name
+        self.state = self.CLOSED
+        self.failure_count = 0
+        self.opened_at: Optional[float] = None
+        self.last_error: Optional[str] = None
+        self._half_open_in_flight = False
+        # 当前试探请求的编号和开始时间，只有占用名额的请求才能释放
+        self.probe_id = 0
+        self._probe_started = 0.0
+
+    def _probe_busy(self) -> bool:
+        """试探名额是否被占用；超过试探超时的名额视为已释放，避免未记录结果的试探永久占用"""
+        return self._half_open_in_flight and time.time() - self._probe_started < settings.circuit_probe_timeout
+
+    def is_available(self) -> bool:
+        """是否可用（不占用半开状态的试探名额）"""
+        if self.state == self.OPEN:
+            return time.time() - self.opened_at >= settings.circuit_recovery_timeout
+        if self.state == self.HALF_OPEN:
+            return not self._probe_busy()
+        return True
+
+    def allow_request(self) -> bool:
+        """是否允许向该供应商发送请求"""
+        if self.state == self.OPEN:
+            if time.time() - self.opened_at >= settings.circuit_recovery_timeout:
+                self.state = self.HALF_OPEN
+                self._half_open_in_flight = False
+            else:
+                return False
+        if self.state == self.HALF_OPEN:
+            # 半开状态只放行一个试探请求
+            if self._probe_busy():
+                return False
+            self._half_open_in_flight = True
+            self.probe_id += 1
+            self._probe_started = time.time()
+        return True
+
+    def release_probe(self, probe_id: int):
+        """试探请求结束但没有记录成功或失败（没有可用密钥、被限流、被取消等）时释放试探名额"""
+        if self.state == self.HALF_OPEN and self.probe_id == probe_id:
+            self._half_open_in_flight = False
+
+    def record_success(self):
+        """记录成功，关闭熔断器"""
+        self.state = self.CLOSED
+        self.failure_count = 0
+        self.opened_at = None
+        self._half_open_in_flight = False
+
+    def record_failure(self, error: Exception):
+        """记录失败，只有临时故障才计入熔断"""
+        self.last_error = str(error)
+        if self.state == self.HALF_OPEN:
+            self._half_open_in_flight = False
+        if not is_retryable_error(error):
+            return
+        self.failure_count += 1
+        if self.state == self.HALF_OPEN or self.failure_count >= settings.circuit_failure_threshold:
+            self.state = self.OPEN
+            self.opened_at = time.time()
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "state": self.state,
+            "failure_count": self.failure_count,
+            "opened_at": self.opened_at,
+            "last_error": self.last_error
+        }
+
+class ProviderRouter:
+    def __init__(self):
+        self._breakers: Dict[str, CircuitBreaker] = {}
+        # 供应商 -> (过期时间, 模型ID集合)
+        self._catalog: Dict[str, Tuple[float, Set[str]]] = {}
+        # 进行中的模型列表获取，同一供应商只有一个
+        self._refreshing: Dict[str, asyncio.Task] = {}
+        # 已配置API Key的供应商（读取需要解密配置文件），与模型列表使用相同的缓存时间
+        self._configured: Optional[Tuple[float, Set[str]]] = None
+
+    def breaker(self, provider: str) -> CircuitBreaker:
+        """获取供应商熔断器"""
+        if provider not in self._breakers:
+            self._breakers[provider] = CircuitBreaker(provider)
+        return self._breakers[provider]
+
+    async def _fetch_models(self, provider: str) -> Set[str]:
+        from services.openai_service import openai_service
+
+        models = await openai_service.get_models(provider)
+        model_ids = {model["id"] for model in models}
+        # 获取失败时空结果只缓存较短时间，避免每次请求都重新获取
+        ttl = settings.provider_catalog_ttl if model_ids else settings.provider_catalog_failure_ttl
+        self._catalog[provider] = (time.time() + ttl, model_ids)
+        return model_ids
+
+    def _refresh(self, provider: str) -> asyncio.Task:
+        """在后台获取供应商的模型列表，已在获取时复用进行中的任务"""
+        task = self._refreshing.get(provider)
+        if task is None:
+            task = asyncio.create_task(self._fetch_models(provider))
+            self._refreshing[provider] = task
+
+            def forget(done: asyncio.Task):
+                # 获取期间缓存被清除时，新的获取任务可能已经登记
+                if self._refreshing.get(provider) is done:
+                    del self._refreshing[provider]
+
+            task.add_done_callback(forget)
+        return task
+
+    async def _provider_models(self, provider: str) -> Set[str]:
+        """获取供应商的模型ID集合（带缓存，没有缓存或已过期时等待获取）"""
+        cached = self._catalog.get(provider)
+        if cached and time.time() < cached[0]:
+            return cached[1]
+        # 调用方被取消时不取消共享的获取任务
+        return await asyncio.shield(self._refresh(provider))
+
+    def _cached_models(self, provider: str) -> Set[str]:
+        """立即返回缓存的模型ID集合（可能已过期），没有缓存或已过期时在后台刷新，不阻塞请求"""
+        cached = self._catalog.get(provider)
+        if cached is None or time.time() >= cached[0]:
+            self._refresh(provider)
+        return cached[1] if cached else set()
+
+    def refresh_catalog(self):
+        """在后台获取所有已配置供应商的模型列表（应用启动时调用，使首批请求即可构建备用链）"""
+        for provider in self.configured_providers():
+            self._refresh(provider)
+
+    def configured_providers(self) -> Set[str]:
+        """获取已配置API Key的供应商集合（带缓存）"""
+        if self._configured is None or time.time() - self._configured[0] >= settings.provider_catalog_ttl:
+            self._configured = (time.time(), {provider for provider in PROVIDERS if is_provider_configured(provider)})
+        return self._configured[1]
+
+    async def get_catalog(self) -> Dict[str, Set[str]]:
+        """获取所有已配置供应商的模型ID集合"""
+        configured = self.configured_providers()
+        providers = [provider for provider in PROVIDERS if provider in configured]
+        catalogs = await asyncio.gather(*(self._provider_models(provider) for provider in providers))
+        return dict(zip(providers, catalogs))
+
+    def is_known_model(self, model: Optional[str]) -> bool:
+        """模型是否为配置中的模型（当前模型、降级模型、健康探测模型），或在已获取的供应商模型列表中"""
+        if not model:
+            return False
+        if model in (settings.current_model, settings.admission_degrade_model):
+            return True
+        if any(entry.split(":", 1)[-1].strip() == model for entry in settings.health_probe_models):
+            return True
+        return any(model in model_ids for _, model_ids in self._catalog.values())
+
+    def model_label(self, model: Optional[str]) -> str:
+        """指标标签中的模型名：未知模型归入other，客户端传入任意模型名时标签数量仍然有界"""
+        return model if self.is_known_model(model) else "other"
+
+    def invalidate_catalog(self, provider: str = None):
+        """清除模型列表缓存（供应商密钥配置变更时调用，同时清除已配置供应商缓存）"""
+        self._configured = None
+        if provider:
+            self._catalog.pop(provider, None)
+            self._refreshing.pop(provider, None)
+        else:
+            self._catalog.clear()
+            self._refreshing.clear()
+
+    async def get_fallback_chain(self, model: str) -> List[str]:
+        """构建模型的有序备用供应商链
+
+        当前供应商优先，其余提供该模型的已配置供应商按健康评分排序；
+        熔断中的供应商会被跳过，如果全部熔断则仍返回完整链路以免彻底不可用。
+        其他供应商的模型列表只读取缓存，过期时在后台刷新，不在请求路径上调用上游
+        """
+        primary = settings.current_provider
+        chain = [primary]
+
+        if settings.failover_enabled:
+            configured = self.configured_providers()
+            others = [provider for provider in PROVIDERS
+                      if provider != primary and provider in configured and self.breaker(provider).is_available()]
+            candidates = [provider for provider in others if model in self._cached_models(provider)]
+            candidates.sort(
+                key=lambda provider: health_monitor.get_score(provider, model) or 0,
+                reverse=True
+            )
+            chain.extend(candidates)
+
+        available = [provider for provider in chain if self.breaker(provider).is_available()]
+        return available or chain
+
+    def iter_providers(self, chain: List[str], probes: Optional[Dict[str, int]] = None) -> Iterator[str]:
+        """按顺序产出允许尝试的供应商，熔断器在真正尝试时才占用半开名额
+
+        Args:
+            chain: 备用供应商链
+            probes: 可选的字典，记录本次请求占用的半开试探名额（供应商 -> 试探编号），
+                调用方在尝试结束时用release_probe释放
+        """
+        attempted = False
+        for provider in chain:
+            breaker = self.breaker(provider)
+            if breaker.allow_request():
+                if probes is not None and breaker.state == CircuitBreaker.HALF_OPEN:
+                    probes[provider] = breaker.probe_id
+                attempted = True
+                yield provider
+        if not attempted and chain:
+            yield chain[0]
+
+    def release_probe(self, provider: str, probes: Dict[str, int]):
+        """释放本次请求在供应商上占用的半开试探名额（已记录成功或失败时不产生影响）"""
+        probe_id = probes.pop(provider, None)
+        if probe_id is not None:
+            self.breaker(provider).release_probe(probe_id)
+
+    def status(self) -> Dict[str, Dict[str, Any]]:
+        """获取所有供应商熔断器状态"""
+        return {provider: self.breaker(provider).to_dict() for provider in PROVIDERS}
+
+# 全局路由实例
+provider_router = ProviderRouter()
@@ -0,0 +1,180 @@
+"""
+按用户/匿名IP的令牌桶限流
+每个身份有两个桶：每分钟请求数和每天token数，检查为O(1)。
+默认使用进程内存储；多worker部署可配置Redis共享存储（可选依赖），
+MemoryBackend实现相同接口，可在测试中替代共享存储
+"""
+
+import math
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+from config import settings
+from models import User, UserRole
+from services.metrics import metrics
+
+class RateLimitExceeded(Exception):
+    """超出限流，携带建议的重试等待时间"""
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+    def headers(self) -> Dict[str, str]:
+        return {"Retry-After": str(max(1, math.ceil(self.retry_after)))}
+
+class RateLimitBackend(ABC):
+    """令牌桶存储接口"""
+
+    @abstractmethod
+    async def consume(self, key: str, capacity: float, refill_rate: float,
+                      cost: float, force: bool = False) -> Tuple[bool, float]:
+        """尝试从桶中扣除cost个令牌
+
+        Args:
+            key: 桶标识
+            capacity: 桶容量
+            refill_rate: 每秒补充的令牌数
+            cost: 扣除数量，0表示只查询
+            force: 令牌不足时仍然扣除（事后记账，允许余额为负）
+
+        Returns:
+            (是否允许, 操作后剩余令牌数)
+        """
+
+class MemoryBackend(RateLimitBackend):
+    """进程内令牌桶存储
+
+    桶按最近使用顺序保存，数量达到上限时从最久未使用的一端淘汰：
+    先淘汰已经补满的空闲桶（淘汰后重建的桶同样是满的，不影响限流），仍然超出时淘汰最久未使用的桶
+    """
+
+    MAX_BUCKETS = 100000
+
+    def __init__(self):
+        # 桶标识 -> [令牌数, 更新时间, 补满时间]
+        self._buckets: "OrderedDict[str, List[float]]" = OrderedDict()
+
+    async def consume(self, key: str, capacity: float, refill_rate: float,
+                      cost: float, force: bool = False) -> Tuple[bool, float]:
+        now = time.monotonic()
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            if len(self._buckets) >= self.MAX_BUCKETS:
+                self._evict(now)
+            bucket = self._buckets[key] = [capacity, now, now]
+        else:
+            self._buckets.move_to_end(key)
+
+        tokens = min(capacity, bucket[0] + (now - bucket[1]) * refill_rate)
+        allowed = tokens >= cost
+        if allowed or force:
+            tokens -= cost
+        bucket[0], bucket[1] = tokens, now
+        bucket[2] = now + (capacity - tokens) / refill_rate if refill_rate > 0 else math.inf
+        return allowed, tokens
+
+    def _evict(self, now: float):
+        """淘汰桶直到低于上限，每次淘汰为O(1)"""
+        while self._buckets:
+            key, bucket = next(iter(self._buckets.items()))
+            if bucket[2] > now:
+                break
+            del self._buckets[key]
+        while len(self._buckets) >= self.MAX_BUCKETS:
+            self._buckets.popitem(last=False)
+
+class RedisBackend(RateLimitBackend):
+    """基于Redis的共享令牌桶存储（需要安装redis包）"""
+
+    _SCRIPT = """
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+local now = tonumber(ARGV[4])
+local force = tonumber(ARGV[5])
+local data = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(data[1]) or capacity
+local ts = tonumber(data[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate)
+local allowed = 0
+if tokens >= cost then allowed = 1 end
+if allowed == 1 or force == 1 then tokens = tokens - cost end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate) + 60)
+return {allowed, tostring(tokens)}
+"""
+
+    def __init__(self, url: str):
+        import redis.asyncio as redis_asyncio
+        self._client = redis_asyncio.from_url(url)
+        self._script = self._client.register_script(self._SCRIPT)
+
+    async def consume(self, key: str, capacity: float, refill_rate: float,
+                      cost: float, force: bool = False) -> Tuple[bool, float]:
+        allowed, tokens = await self._script(
+            keys=[f"ratelimit:{key}"],
+            args=[capacity, refill_rate, cost, time.time(), 1 if force else 0]
+        )
+        return bool(allowed), float(tokens)
+
+def _create_backend() -> RateLimitBackend:
+    """根据配置创建存储，Redis不可用时回退到进程内存储"""
+    if settings.rate_limit_backend == "redis" and settings.rate_limit_redis_url:
+        try:
+            return RedisBackend(settings.rate_limit_redis_url)
+        except ImportError:
+            print("⚠️  未安装redis，限流回退到进程内存储")
+    return MemoryBackend()
+
+class RateLimiter:
+    def __init__(self, backend: Optional[RateLimitBackend] = None):
+        self.backend = backend or _create_backend()
+
+    def identity(self, user: Optional[User], client_ip: Optional[str]) -> str:
+        """限流身份：登录用户按用户ID，匿名请求按IP"""
+        if user:
+            return f"user:{user.id}"
+        return f"ip:{client_ip or 'unknown'}"
+
+    def _limits(self, identity: str) -> Tuple[int, int]:
+        """返回 (每分钟请求数, 每天token数)"""
+        if identity.startswith("user:"):
+            return settings.rate_limit_requests_per_minute, settings.rate_limit_tokens_per_day
+        return settings.rate_limit_anonymous_requests_per_minute, settings.rate_limit_anonymous_tokens_per_day
+
+    def is_exempt(self, user: Optional[User]) -> bool:
+        return (not settings.rate_limit_enabled
+                or (user is not None and settings.rate_limit_admin_exempt and user.role == UserRole.ADMIN))
+
+    async def check(self, identity: str):
+        """请求进入时检查：扣除一次请求配额，并确认当天token配额未用完
+
+        Raises:
+            RateLimitExceeded: 超出任一配额
+        """
+        requests_per_minute, tokens_per_day = self._limits(identity)
+
+        if tokens_per_day > 0:
+            daily_rate = tokens_per_day / 86400
+            _, remaining = await self.backend.consume(f"{identity}:tpd", tokens_per_day, daily_rate, 0)
+            if remaining <= 0:
+                metrics.incr("ratelimit.rejected", limit="tokens_per_day")
+                raise RateLimitExceeded("今日token配额已用完", (1 - remaining) / daily_rate)
+
+        if requests_per_minute > 0:
+            minute_rate = requests_per_minute / 60
+            allowed, remaining = await self.backend.consume(f"{identity}:rpm", requests_per_minute, minute_rate, 1)
+            if not allowed:
+                metrics.incr("ratelimit.rejected", limit="requests_per_minute")
+                raise RateLimitExceeded("请求过于频繁，请稍后再试", (1 - remaining) / minute_rate)
+
+    async def charge_tokens(self, identity: str, tokens: int):
+        """请求完成后按实际用量扣除token配额（允许透支，透支部分随时间补回）"""
+        _, tokens_per_day = self._limits(identity)
+        if tokens_per_day > 0 and tokens > 0:
+            await self.backend.consume(f"{identity}:tpd", tokens_per_day, tokens_per_day / 86400, tokens, force=True)
+
+# 全局限流实例
+rate_limiter = RateLimiter()
@@ -0,0 +1,198 @@
+"""
+精确匹配响应缓存
+以供应商、模型、消息、max_tokens和采样参数的规范化哈希为键缓存完整回答。
+内存层为LRU，可选SQLite磁盘层；每个条目有独立的过期时间，两层都按大小淘汰
+"""
+
+import asyncio
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+from config import settings
+from services.metrics import metrics
+
+def make_cache_key(provider: str, model: str, messages: List[Dict[str, str]],
+                   max_tokens: Optional[int], sampling: Dict[str, Any]) -> str:
+    """生成规范化的缓存键（字段排序、紧凑分隔符，保证同一请求得到同一哈希）"""
+    payload = {
+        "provider": provider,
+        "model": model,
+        "messages": messages,
+        "max_tokens": max_tokens,
+        "sampling": sampling
+    }
+    canonical = json.dumps(payload, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+class _DiskTier:
+    """SQLite磁盘缓存层，按最近访问时间淘汰"""
+
+    def __init__(self, path: Path, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(path), check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS response_cache ("
+            "key TEXT PRIMARY KEY, content TEXT NOT NULL, size INTEGER NOT NULL, "
+            "expires_at REAL NOT NULL, last_access REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_response_cache_access ON response_cache(last_access)")
+        self._conn.commit()
+        self.total_bytes = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM response_cache").fetchone()[0]
+
+    def get(self, key: str) -> Optional[Tuple[str, float]]:
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT content, expires_at, size FROM response_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            content, expires_at, size = row
+            if expires_at <= now:
+                self._conn.execute("DELETE FROM response_cache WHERE key = ?", (key,))
+                self.total_bytes -= size
+            else:
+                self._conn.execute("UPDATE response_cache SET last_access = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+            return (content, expires_at) if expires_at > now else None
+
+    def set(self, key: str, content: str, size: int, expires_at: float):
+        now = time.time()
+        with self._lock:
+            old = self._conn.execute("SELECT size FROM response_cache WHERE key = ?", (key,)).fetchone()
+            if old:
+                self.total_bytes -= old[0]
+            self._conn.execute(
+                "INSERT OR REPLACE INTO response_cache (key, content, size, expires_at, last_access) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (key, content, size, expires_at, now)
+            )
+            self.total_bytes += size
+            if self.total_bytes > self.max_bytes:
+                self._evict(now)
+            self._conn.commit()
+
+    def _evict(self, now: float):
+        """先清理过期条目，仍超出上限时删除最久未访问的条目"""
+        expired = self._conn.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM response_cache WHERE expires_at <= ?", (now,)
+        ).fetchone()[0]
+        self._conn.execute("DELETE FROM response_cache WHERE expires_at <= ?", (now,))
+        self.total_bytes -= expired
+
+        cursor = self._conn.execute("SELECT key, size FROM response_cache ORDER BY last_access ASC")
+        victims = []
+        for key, size in cursor:
+            if self.total_bytes <= self.max_bytes:
+                break
+            victims.append((key,))
+            self.total_bytes -= size
+        self._conn.executemany("DELETE FROM response_cache WHERE key = ?", victims)
+        metrics.incr("response_cache.evicted", len(victims), tier="disk")
+
+    def count(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM response_cache").fetchone()[0]
+
+class ResponseCache:
+    def __init__(self):
+        # key -> (content, expires_at, size)
+        self._memory: "OrderedDict[str, Tuple[str, float, int]]" = OrderedDict()
+        self._memory_bytes = 0
+        self._disk: Optional[_DiskTier] = None
+        self._disk_initialized = False
+
+    def is_enabled(self, requested: Optional[bool] = None) -> bool:
+        """请求显式指定时以请求为准，否则按全局配置"""
+        return settings.response_cache_enabled if requested is None else requested
+
+    def _get_disk(self) -> Optional[_DiskTier]:
+        if not self._disk_initialized:
+            self._disk_initialized = True
+            if settings.response_cache_disk_enabled:
+                path = Path(settings.response_cache_disk_path)
+                if not path.is_absolute():
+                    path = Path(__file__).parent.parent / path
+                try:
+                    self._disk = _DiskTier(path, settings.response_cache_disk_max_bytes)
+                except sqlite3.Error as e:
+                    print(f"响应缓存磁盘层初始化失败，仅使用内存缓存: {e}")
+        return self._disk
+
+    def _memory_set(self, key: str, content: str, expires_at: float, size: int):
+        if key in self._memory:
+            self._memory_bytes -= self._memory.pop(key)[2]
+        self._memory[key] = (content, expires_at, size)
+        self._memory_bytes += size
+        while self._memory and (len(self._memory) > settings.response_cache_max_entries
+                                or self._memory_bytes > settings.response_cache_max_bytes):
+            _, (_, _, evicted_size) = self._memory.popitem(last=False)
+            self._memory_bytes -= evicted_size
+            metrics.incr("response_cache.evicted", tier="memory")
+
+    async def get(self, key: str) -> Optional[str]:
+        """查询缓存，磁盘层命中时提升到内存层"""
+        entry = self._memory.get(key)
+        if entry is not None:
+            content, expires_at, size = entry
+            if expires_at > time.time():
+                self._memory.move_to_end(key)
+                metrics.incr("response_cache.hit", tier="memory")
+                return content
+            del self._memory[key]
+            self._memory_bytes -= size
+
+        disk = self._get_disk()
+        if disk is not None:
+            loop = asyncio.get_event_loop()
+            result = await loop.run_in_executor(None, disk.get, key)
+            if result is not None:
+                content, expires_at = result
+                self._memory_set(key, content, expires_at, len(content.encode("utf-8")))
+                metrics.incr("response_cache.hit", tier="disk")
+                return content
+
+        metrics.incr("response_cache.miss")
+        return None
+
+    async def set(self, key: str, content: str, ttl: Optional[int] = None):
+        """写入缓存
+
+        Args:
+            key: 缓存键
+            content: 完整回答
+            ttl: 条目有效期（秒），不指定时使用默认值
+        """
+        ttl = ttl if ttl is not None else settings.response_cache_ttl
+        if ttl <= 0 or not content:
+            return
+        expires_at = time.time() + ttl
+        size = len(content.encode("utf-8"))
+        self._memory_set(key, content, expires_at, size)
+
+        disk = self._get_disk()
+        if disk is not None:
+            loop = asyncio.get_event_loop()
+            await loop.run_in_executor(None, disk.set, key, content, size, expires_at)
+
+    def status(self) -> Dict[str, Any]:
+        disk = self._get_disk()
+        return {
+            "enabled": settings.response_cache_enabled,
+            "memory_entries": len(self._memory),
+            "memory_bytes": self._memory_bytes,
+            "disk_entries": disk.count() if disk else None,
+            "disk_bytes": disk.total_bytes if disk else None,
+            "hits": metrics.get_counter("response_cache.hit", tier="memory")
+                    + metrics.get_counter("response_cache.hit", tier="disk"),
+            "misses": metrics.get_counter("response_cache.miss")
+        }
+
+# 全局响应缓存实例
+response_cache = ResponseCache()
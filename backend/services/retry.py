@@ -0,0 +1,98 @@
+"""
+上游调用重试策略
+用于幂等调用（非流式聊天、模型列表、健康探测）：指数退避加随机抖动，
+优先遵循上游的Retry-After和限流重置头，并受总时间预算约束
+"""
+
+import asyncio
+import math
+import random
+import time
+from typing import Awaitable, Callable, Dict, Optional, TypeVar
+import openai
+from config import settings
+from services.concurrency import ConcurrencyLimitExceeded
+from services.metrics import metrics
+from services.provider_router import get_retry_after, get_status_code, is_retryable_error
+
+T = TypeVar("T")
+
+class UpstreamError(Exception):
+    """重试耗尽后的上游错误，携带应返回给客户端的状态码和重试建议"""
+
+    def __init__(self, message: str, status_code: int = 502, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+    def headers(self) -> Dict[str, str]:
+        """生成响应头（Retry-After取整秒，至少1秒）"""
+        if self.retry_after is None:
+            return {}
+        return {"Retry-After": str(max(1, math.ceil(self.retry_after)))}
+
+def is_transient_error(error: Exception) -> bool:
+    """是否值得重试：上游临时故障或本地排队超时"""
+    return is_retryable_error(error) or isinstance(error, ConcurrencyLimitExceeded)
+
+def to_upstream_error(error: Exception, retry_after: Optional[float] = None) -> UpstreamError:
+    """把上游异常转换为带HTTP状态码的错误"""
+    if isinstance(error, UpstreamError):
+        return error
+    status_code = get_status_code(error)
+    if status_code == 429:
+        code = 429
+    elif isinstance(error, openai.APITimeoutError):
+        code = 504
+    elif is_transient_error(error):
+        code = 503
+    else:
+        code = 502
+    return UpstreamError(f"上游服务错误: {error}", code, retry_after)
+
+class RetryPolicy:
+    def __init__(self, max_attempts: int = None, base_delay: float = None,
+                 max_delay: float = None, deadline: float = None):
+        self.max_attempts = max_attempts or settings.retry_max_attempts
+        self.base_delay = base_delay if base_delay is not None else settings.retry_base_delay
+        self.max_delay = max_delay if max_delay is not None else settings.retry_max_delay
+        self.deadline = deadline if deadline is not None else settings.retry_deadline
+
+    def compute_delay(self, attempt: int, error: Exception) -> float:
+        """计算第attempt次失败后的等待时间：优先上游建议，否则全抖动指数退避"""
+        retry_after = get_retry_after(error)
+        if retry_after is not None:
+            return retry_after
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+
+    async def run(self, func: Callable[[float], Awaitable[T]], name: str = "upstream") -> T:
+        """执行调用，失败时按策略重试
+
+        Args:
+            func: 接收剩余时间预算（秒）的异步函数
+            name: 指标名称前缀
+
+        Raises:
+            UpstreamError: 不可重试的错误、重试次数耗尽或超出时间预算
+        """
+        deadline_at = time.monotonic() + self.deadline
+        for attempt in range(self.max_attempts):
+            remaining = deadline_at - time.monotonic()
+            try:
+                return await func(remaining)
+            except Exception as e:
+                if not is_transient_error(e):
+                    raise to_upstream_error(e)
+
+                delay = self.compute_delay(attempt, e)
+                remaining = deadline_at - time.monotonic()
+                if attempt == self.max_attempts - 1 or delay >= remaining:
+                    metrics.incr("retry.exhausted", call=name)
+                    raise to_upstream_error(e, retry_after=delay)
+
+                metrics.incr("retry.attempt", call=name)
+                print(f"{name} 调用失败，{delay:.2f}秒后重试（第{attempt + 1}次）: {e}")
+                await asyncio.sleep(delay)
+
+# 全局默认重试策略
+retry_policy = RetryPolicy()
@@ -0,0 +1,177 @@
+"""
+上游请求公平调度
+在OpenAIService前面限制同时进行的上游请求总数；名额不足时按优先级类别（由User.role决定）
+严格优先，同一类别内按用户做加权赤字轮询(DRR)，避免单个用户的大量并发请求占满所有名额
+"""
+
+import asyncio
+import time
+from collections import OrderedDict, deque
+from typing import Deque, Dict, Optional, Any
+from config import settings
+from models import User
+from services.metrics import metrics
+
+class SchedulerQueueTimeout(Exception):
+    """在调度队列中等待超时"""
+    pass
+
+class _Flow:
+    """一个用户在某个优先级类别中的请求队列"""
+    __slots__ = ("key", "weight", "deficit", "queue")
+
+    def __init__(self, key: str, weight: float):
+        self.key = key
+        self.weight = weight
+        self.deficit = 0.0
+        self.queue: Deque[asyncio.Future] = deque()
+
+class SchedulerTicket:
+    """调度名额，上游请求结束时释放"""
+
+    def __init__(self, scheduler: "FairScheduler", wait: float, counted: bool = True):
+        self.wait = wait
+        self._scheduler = scheduler
+        self._released = not counted
+
+    def release(self):
+        if not self._released:
+            self._released = True
+            self._scheduler._release()
+
+class FairScheduler:
+    def __init__(self):
+        self.in_flight = 0
+        # 近期排队时间的指数加权平均（秒）
+        self.avg_wait = 0.0
+        # 排队中的请求 -> 开始排队的时间（按排队顺序），供过载保护计算最早排队请求的等待时间
+        self._waiting: Dict[asyncio.Future, float] = {}
+        # 优先级 -> 有排队请求的用户（按轮询顺序）
+        self._classes: Dict[int, "OrderedDict[str, _Flow]"] = {}
+
+    def _flow_identity(self, user: Optional[User]):
+        """根据用户确定调度队列、优先级和权重"""
+        if user is None:
+            return "anonymous", settings.scheduler_priority_classes.get("anonymous", 2), settings.scheduler_default_weight
+        priority = settings.scheduler_priority_classes.get(user.role, settings.scheduler_priority_classes.get("user", 1))
+        weight = settings.scheduler_user_weights.get(user.username, settings.scheduler_default_weight)
+        return f"user:{user.id}", priority, weight
+
+    def _queued(self) -> int:
+        return sum(
+            sum(1 for waiter in flow.queue if not waiter.done())
+            for flows in self._classes.values() for flow in flows.values()
+        )
+
+    async def acquire(self, user: Optional[User] = None, timeout: float = None) -> SchedulerTicket:
+        """获取上游请求名额，返回的票据记录了排队时间"""
+        if not settings.scheduler_enabled:
+            return SchedulerTicket(self, 0.0, counted=False)
+
+        flow_key, priority, weight = self._flow_identity(user)
+        if self.in_flight < settings.scheduler_max_concurrent and not self._queued():
+            self.in_flight += 1
+            self._record_wait(0.0, priority)
+            return SchedulerTicket(self, 0.0)
+
+        start = time.perf_counter()
+        waiter = asyncio.get_event_loop().create_future()
+        flows = self._classes.setdefault(priority, OrderedDict())
+        if flow_key not in flows:
+            flows[flow_key] = _Flow(flow_key, max(weight, 0.01))
+        flows[flow_key].queue.append(waiter)
+
+        timeout = settings.scheduler_queue_timeout if timeout is None else timeout
+        self._waiting[waiter] = start
+        try:
+            await asyncio.wait({waiter}, timeout=timeout)
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                self._release()
+            else:
+                waiter.cancel()
+            raise
+        finally:
+            self._waiting.pop(waiter, None)
+
+        wait = time.perf_counter() - start
+        self._record_wait(wait, priority)
+        if not waiter.done():
+            waiter.cancel()
+            metrics.incr("scheduler.timeout", priority=priority)
+            raise SchedulerQueueTimeout(f"上游请求排队超时（{timeout}秒）")
+        return SchedulerTicket(self, wait)
+
+    def oldest_wait(self) -> float:
+        """当前排队最久的请求已等待的时间（秒），没有排队请求时为0
+
+        与平均排队时间不同，该值随排队请求的离开立即回落，拒绝新请求时不会停留在过载状态
+        """
+        for start in self._waiting.values():
+            return time.perf_counter() - start
+        return 0.0
+
+    def _record_wait(self, wait: float, priority: int):
+        self.avg_wait = self.avg_wait * 0.9 + wait * 0.1
+        metrics.observe("scheduler.queue_wait", wait, priority=priority)
+
+    def _release(self):
+        self.in_flight -= 1
+        self._dispatch()
+
+    def _dispatch(self):
+        """把空闲名额分配给排队的请求"""
+        while self.in_flight < settings.scheduler_max_concurrent:
+            waiter = self._next_waiter()
+            if waiter is None:
+                break
+            self.in_flight += 1
+            waiter.set_result(True)
+
+    def _next_waiter(self) -> Optional[asyncio.Future]:
+        """高优先级类别严格优先；类别内按赤字轮询选择用户，每个请求成本为1"""
+        for priority in sorted(self._classes):
+            flows = self._classes[priority]
+            while flows:
+                flow_key, flow = next(iter(flows.items()))
+                while flow.queue and flow.queue[0].done():
+                    flow.queue.popleft()
+                if not flow.queue:
+                    del flows[flow_key]
+                    continue
+
+                if flow.deficit < 1:
+                    flow.deficit += flow.weight
+                if flow.deficit < 1:
+                    # 权重小于1的用户需要多轮累积
+                    flows.move_to_end(flow_key)
+                    continue
+
+                flow.deficit -= 1
+                waiter = flow.queue.popleft()
+                if not flow.queue:
+                    del flows[flow_key]
+                elif flow.deficit < 1:
+                    flows.move_to_end(flow_key)
+                return waiter
+        return None
+
+    def status(self) -> Dict[str, Any]:
+        """获取调度器状态"""
+        return {
+            "enabled": settings.scheduler_enabled,
+            "in_flight": self.in_flight,
+            "max_concurrent": settings.scheduler_max_concurrent,
+            "avg_wait_ms": round(self.avg_wait * 1000, 2),
+            "oldest_wait_ms": round(self.oldest_wait() * 1000, 2),
+            "queued": {
+                str(priority): {
+                    flow_key: sum(1 for waiter in flow.queue if not waiter.done())
+                    for flow_key, flow in flows.items()
+                }
+                for priority, flows in self._classes.items()
+            }
+        }
+
+# 全局调度器实例
+fair_scheduler = FairScheduler()
@@ -0,0 +1,202 @@
+"""
+语义响应缓存
+对单轮提问（可带系统提示词）计算最后一条用户消息的向量，在同一租户、同一模型、
+同一系统提示词的命名空间内做余弦相似度top-k检索，相似度超过模型阈值时直接返回缓存回答。
+每个命名空间的条目数和命名空间总数都有上限，内存占用有界
+"""
+
+import asyncio
+import hashlib
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+from config import settings
+from models import ChatRequest, MessageRole, User
+from services.metrics import metrics
+from services.provider_router import provider_router
+from services.retry import RetryPolicy
+from services.token_counter import estimate_tokens, estimate_messages_tokens
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+class _VectorIndex:
+    """单个命名空间的向量索引：预分配矩阵，按需倍增，满后淘汰最久未命中的条目"""
+
+    def __init__(self, dim: int, max_entries: int):
+        self.dim = dim
+        self.max_entries = max_entries
+        self.size = 0
+        self._vectors = np.zeros((min(64, max_entries), dim), dtype=np.float32)
+        self._answers: List[Optional[str]] = []
+        self._expires_at = np.zeros(self._vectors.shape[0], dtype=np.float64)
+        self._last_access = np.zeros(self._vectors.shape[0], dtype=np.float64)
+
+    def search(self, query, top_k: int, now: float) -> List[Tuple[int, float]]:
+        """返回未过期的最相似条目 [(位置, 相似度)]，按相似度降序"""
+        if self.size == 0:
+            return []
+        scores = self._vectors[:self.size] @ query
+        scores[self._expires_at[:self.size] <= now] = -1.0
+        k = min(top_k, self.size)
+        candidates = np.argpartition(-scores, k - 1)[:k]
+        candidates = candidates[np.argsort(-scores[candidates])]
+        return [(int(index), float(scores[index])) for index in candidates if scores[index] > -1.0]
+
+    def get(self, index: int, now: float) -> str:
+        self._last_access[index] = now
+        return self._answers[index]
+
+    def add(self, vector, answer: str, expires_at: float, now: float):
+        if self.size < self.max_entries:
+            if self.size == self._vectors.shape[0]:
+                self._grow()
+            index = self.size
+            self.size += 1
+            self._answers.append(answer)
+        else:
+            # 优先替换已过期的条目，其次替换最久未访问的条目
+            expired = np.flatnonzero(self._expires_at[:self.size] <= now)
+            index = int(expired[0]) if expired.size else int(np.argmin(self._last_access[:self.size]))
+            self._answers[index] = answer
+            metrics.incr("semantic_cache.evicted")
+        self._vectors[index] = vector
+        self._expires_at[index] = expires_at
+        self._last_access[index] = now
+
+    def _grow(self):
+        capacity = min(self.max_entries, self._vectors.shape[0] * 2)
+        vectors = np.zeros((capacity, self.dim), dtype=np.float32)
+        vectors[:self.size] = self._vectors[:self.size]
+        self._vectors = vectors
+        self._expires_at = np.resize(self._expires_at, capacity)
+        self._last_access = np.resize(self._last_access, capacity)
+
+class SemanticLookup:
+    """一次语义缓存查询的结果，未命中时用于在上游返回后写入缓存"""
+
+    def __init__(self, namespace: Tuple[str, str, str], vector, prompt_tokens: int):
+        self.namespace = namespace
+        self.vector = vector
+        self.prompt_tokens = prompt_tokens
+        self.content: Optional[str] = None
+        self.similarity: Optional[float] = None
+
+class SemanticCache:
+    def __init__(self):
+        # (租户, 模型, 系统提示词哈希) -> 向量索引，按最近使用排序
+        self._indexes: "OrderedDict[Tuple[str, str, str], _VectorIndex]" = OrderedDict()
+        self._warned = False
+
+    def is_enabled(self, requested: Optional[bool] = None) -> bool:
+        if not settings.semantic_cache_enabled or requested is False:
+            return False
+        if np is None:
+            if not self._warned:
+                self._warned = True
+                print("⚠️  未安装numpy，语义缓存不可用")
+            return False
+        return True
+
+    def get_threshold(self, model: str) -> float:
+        return settings.semantic_cache_thresholds.get(model, settings.semantic_cache_default_threshold)
+
+    def _namespace(self, request: ChatRequest, model: str, user: Optional[User]) -> Optional[Tuple[str, str, str]]:
+        """只缓存单轮提问：除系统提示词外只有一条用户消息"""
+        system_prompts = [msg.content for msg in request.messages if msg.role == MessageRole.SYSTEM]
+        turns = [msg for msg in request.messages if msg.role != MessageRole.SYSTEM]
+        if len(turns) != 1 or turns[0].role != MessageRole.USER:
+            return None
+        tenant = f"user:{user.id}" if user else "anonymous"
+        system_hash = hashlib.sha256("\n".join(system_prompts).encode("utf-8")).hexdigest()
+        return tenant, model, system_hash
+
+    async def lookup(self, request: ChatRequest, user: Optional[User] = None) -> Optional[SemanticLookup]:
+        """查询语义缓存
+
+        Returns:
+            不适用语义缓存或计算向量失败时返回None；否则返回查询结果，命中时content不为空
+        """
+        from services.openai_service import openai_service
+
+        model = request.model or settings.current_model
+        namespace = self._namespace(request, model, user)
+        if namespace is None:
+            return None
+
+        # 计算向量在请求的关键路径上：只尝试一次并限制总时间，超时按未命中处理
+        timeout = settings.semantic_cache_embed_timeout
+        try:
+            embedding = (await asyncio.wait_for(openai_service.embed(
+                [request.messages[-1].content], settings.semantic_cache_embedding_model,
+                policy=RetryPolicy(max_attempts=1, deadline=timeout)
+            ), timeout))[0]
+        except asyncio.TimeoutError:
+            print(f"语义缓存计算向量超时（{timeout}秒），按未命中处理")
+            metrics.incr("semantic_cache.embed_timeout")
+            return None
+        except Exception as e:
+            print(f"语义缓存计算向量失败: {e}")
+            metrics.incr("semantic_cache.embed_error")
+            return None
+
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        if norm == 0:
+            return None
+        result = SemanticLookup(
+            namespace, vector / norm,
+            estimate_messages_tokens(msg.content for msg in request.messages)
+        )
+
+        label = provider_router.model_label(model)
+        metrics.incr("semantic_cache.lookup", model=label)
+        index = self._indexes.get(namespace)
+        if index is not None and index.dim == vector.shape[0]:
+            self._indexes.move_to_end(namespace)
+            now = time.time()
+            threshold = self.get_threshold(model)
+            for position, similarity in index.search(result.vector, settings.semantic_cache_top_k, now):
+                if similarity < threshold:
+                    break
+                result.content = index.get(position, now)
+                result.similarity = similarity
+                metrics.incr("semantic_cache.hit", model=label)
+                metrics.observe("semantic_cache.similarity", similarity, model=label)
+                # 省下的上游开销按提示词和回答的估算token数计
+                metrics.incr("semantic_cache.tokens_saved",
+                             result.prompt_tokens + estimate_tokens(result.content), model=label)
+                return result
+        return result
+
+    def add(self, lookup: SemanticLookup, content: str):
+        """上游返回后写入缓存"""
+        if not content:
+            return
+        index = self._indexes.get(lookup.namespace)
+        if index is None or index.dim != lookup.vector.shape[0]:
+            index = _VectorIndex(lookup.vector.shape[0], settings.semantic_cache_max_entries)
+            self._indexes[lookup.namespace] = index
+            while len(self._indexes) > settings.semantic_cache_max_namespaces:
+                self._indexes.popitem(last=False)
+        self._indexes.move_to_end(lookup.namespace)
+        now = time.time()
+        index.add(lookup.vector, content, now + settings.semantic_cache_ttl, now)
+
+    def status(self) -> Dict[str, Any]:
+        lookups = metrics.sum_counter("semantic_cache.lookup")
+        hits = metrics.sum_counter("semantic_cache.hit")
+        return {
+            "enabled": settings.semantic_cache_enabled and np is not None,
+            "namespaces": len(self._indexes),
+            "entries": sum(index.size for index in self._indexes.values()),
+            "lookups": lookups,
+            "hits": hits,
+            "hit_rate": round(hits / lookups, 4) if lookups else None,
+            "tokens_saved": metrics.sum_counter("semantic_cache.tokens_saved")
+        }
+
+# 全局语义缓存实例
+semantic_cache = SemanticCache()
@@ -0,0 +1,65 @@
+"""
+JSON序列化
+基于orjson的响应类和SSE帧编码，路由和流式输出共用。
+服务端自行构造并已校验的输出模型通过TrustedJSONResponse直接序列化，
+不再经过response_model的重新校验和jsonable_encoder转换；response_model仍保留用于接口文档
+"""
+
+from typing import Any, Dict, Optional
+import orjson
+from fastapi.responses import ORJSONResponse
+from pydantic import BaseModel
+
+# 预构建的SSE帧片段：增量内容帧只需序列化内容字符串本身
+_SSE_PREFIX = b"data: "
+_SSE_SUFFIX = b"\n\n"
+_CONTENT_FRAME_PREFIX = b'data: {"content":'
+_CONTENT_FRAME_SUFFIX = b',"type":"content"}\n\n'
+SSE_DONE = b"data: [DONE]\n\n"
+
+# 模型类 -> 是否为普通字段模型（没有别名、计算字段和自定义序列化器）
+_plain_models: Dict[type, bool] = {}
+
+def _is_plain_model(model_class: type) -> bool:
+    plain = _plain_models.get(model_class)
+    if plain is None:
+        decorators = model_class.__pydantic_decorators__
+        plain = _plain_models[model_class] = (
+            not decorators.computed_fields
+            and not decorators.field_serializers
+            and not decorators.model_serializers
+            and all(field.alias is None and field.serialization_alias is None
+                    for field in model_class.model_fields.values())
+        )
+    return plain
+
+def _default(obj: Any) -> Any:
+    if isinstance(obj, BaseModel):
+        # 普通字段模型直接交给orjson序列化字段字典，比逐个model_dump快数倍
+        return obj.__dict__ if _is_plain_model(type(obj)) else obj.model_dump()
+    raise TypeError(f"无法序列化的类型: {type(obj).__name__}")
+
+def dumps(obj: Any) -> bytes:
+    """序列化为JSON字节串，支持pydantic模型、datetime和枚举"""
+    return orjson.dumps(obj, default=_default)
+
+def sse_frame(event: Dict[str, Any]) -> bytes:
+    """编码一个SSE帧"""
+    if len(event) == 2 and event.get("type") == "content":
+        return _CONTENT_FRAME_PREFIX + orjson.dumps(event["content"]) + _CONTENT_FRAME_SUFFIX
+    return _SSE_PREFIX + dumps(event) + _SSE_SUFFIX
+
+class TrustedJSONResponse(ORJSONResponse):
+    """可信输出的JSON响应，内容可以是pydantic模型或模型列表"""
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+def trusted_response(content: Any, headers: Optional[Dict[str, str]] = None) -> TrustedJSONResponse:
+    """返回可信输出，跳过response_model校验
+
+    Args:
+        content: 服务端构造的模型、模型列表或字典
+        headers: 附加的响应头（直接返回响应对象时，注入的Response参数上设置的头不会生效）
+    """
+    return TrustedJSONResponse(content, headers=headers)
@@ -0,0 +1,54 @@
+"""
+会话更新事件
+会话新增消息、改名或删除时，推送给该用户所有已连接的WebSocket
+"""
+
+import asyncio
+from typing import Any, Dict, Set
+from models import ChatSession
+
+class SessionEventHub:
+    def __init__(self):
+        # 用户ID -> 连接的发送队列
+        self._subscribers: Dict[int, Set[asyncio.Queue]] = {}
+
+    def subscribe(self, user_id: int, queue: asyncio.Queue):
+        self._subscribers.setdefault(user_id, set()).add(queue)
+
+    def unsubscribe(self, user_id: int, queue: asyncio.Queue):
+        queues = self._subscribers.get(user_id)
+        if queues is None:
+            return
+        queues.discard(queue)
+        if not queues:
+            del self._subscribers[user_id]
+
+    def publish(self, user_id: int, event: Dict[str, Any]):
+        for queue in self._subscribers.get(user_id, ()):
+            queue.put_nowait(event)
+
+    def publish_session(self, session: ChatSession, action: str = "updated"):
+        """推送会话更新事件
+
+        Args:
+            session: 更新的会话
+            action: updated（新消息或改名）或 deleted
+        """
+        if session.user_id not in self._subscribers:
+            return
+        self.publish(session.user_id, {
+            "type": "session_updated",
+            "action": action,
+            "session_id": session.session_id,
+            "title": session.title,
+            "updated_at": session.updated_at.isoformat() if session.updated_at else None
+        })
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "users": len(self._subscribers),
+            "connections": sum(len(queues) for queues in self._subscribers.values())
+        }
+
+# 全局会话事件实例
+session_events = SessionEventHub()
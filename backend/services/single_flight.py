@@ -0,0 +1,149 @@
+"""
+相同请求合并（single-flight）
+同一时刻进行中的相同请求（规范化哈希相同且采样参数确定）共享一次上游调用，
+流式请求把同一份增量分发给所有订阅者；单个订阅者断开不影响其他订阅者，
+所有订阅者都断开后才取消上游调用
+"""
+
+import asyncio
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple
+from config import settings
+from models import ChatRequest, User
+from services.chat_cache import get_request_fingerprint
+from services.metrics import metrics
+
+class _Flight:
+    """一次共享的上游流"""
+
+    def __init__(self, key: str):
+        self.key = key
+        self.chunks: List[str] = []
+        self.meta: Dict[str, Any] = {}
+        self.done = False
+        self.subscribers = 0
+        self.changed = asyncio.Event()
+        self.task: Optional[asyncio.Task] = None
+
+    def notify(self):
+        changed, self.changed = self.changed, asyncio.Event()
+        changed.set()
+
+class SingleFlight:
+    def __init__(self):
+        self._flights: Dict[str, _Flight] = {}
+        self._calls: Dict[str, Tuple[asyncio.Task, Dict[str, Any]]] = {}
+
+    def is_eligible(self, request: ChatRequest) -> bool:
+        """只有采样参数确定（温度为0）的请求才合并，除非配置为不要求确定性"""
+        if not settings.single_flight_enabled:
+            return False
+        return not settings.single_flight_require_deterministic or request.temperature == 0
+
+    async def _produce(self, flight: _Flight, factory: Callable[[Dict[str, Any]], AsyncIterator[str]]):
+        try:
+            async for chunk in factory(flight.meta):
+                flight.chunks.append(chunk)
+                flight.notify()
+        finally:
+            flight.done = True
+            if self._flights.get(flight.key) is flight:
+                del self._flights[flight.key]
+            flight.notify()
+
+    def is_in_flight(self, key: str) -> bool:
+        return key in self._flights or key in self._calls
+
+    async def stream(self, key: str, factory: Callable[[Dict[str, Any]], AsyncIterator[str]],
+                     meta: Dict[str, Any], cancel_when_idle: bool = True) -> AsyncIterator[str]:
+        """订阅共享的上游流
+
+        Args:
+            key: 请求的规范化哈希
+            factory: 接收共享meta字典、返回上游内容迭代器的函数，只在首个订阅者时调用
+            meta: 调用方的meta字典，同步为共享调用的供应商、完成状态等信息
+            cancel_when_idle: 所有订阅者断开后是否取消上游调用
+        """
+        flight = self._flights.get(key)
+        if flight is None:
+            flight = self._flights[key] = _Flight(key)
+            flight.task = asyncio.create_task(self._produce(flight, factory))
+            metrics.incr("single_flight.leader")
+        else:
+            metrics.incr("single_flight.coalesced")
+        flight.subscribers += 1
+
+        index = 0
+        try:
+            while True:
+                if index < len(flight.chunks):
+                    meta.update(flight.meta)
+                    chunk = flight.chunks[index]
+                    index += 1
+                    yield chunk
+                    continue
+                if flight.done:
+                    break
+                await flight.changed.wait()
+        finally:
+            meta.update(flight.meta)
+            flight.subscribers -= 1
+            if flight.subscribers == 0 and not flight.done and cancel_when_idle:
+                # 没有订阅者了，取消上游调用；之后到达的相同请求重新发起
+                if self._flights.get(key) is flight:
+                    del self._flights[key]
+                flight.task.cancel()
+
+    async def call(self, key: str, factory: Callable[[Dict[str, Any]], Awaitable[Any]],
+                   meta: Dict[str, Any]) -> Any:
+        """合并非流式调用，调用方被取消时不影响共享的上游调用"""
+        entry = self._calls.get(key)
+        if entry is None:
+            shared_meta: Dict[str, Any] = {}
+            task = asyncio.create_task(factory(shared_meta))
+            entry = self._calls[key] = (task, shared_meta)
+            task.add_done_callback(lambda _: self._calls.pop(key, None))
+            metrics.incr("single_flight.leader")
+        else:
+            metrics.incr("single_flight.coalesced")
+
+        task, shared_meta = entry
+        try:
+            return await asyncio.shield(task)
+        finally:
+            meta.update(shared_meta)
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "enabled": settings.single_flight_enabled,
+            "streams": {key[:12]: flight.subscribers for key, flight in self._flights.items()},
+            "calls": len(self._calls),
+            "coalesced": metrics.get_counter("single_flight.coalesced")
+        }
+
+# 全局请求合并实例
+single_flight = SingleFlight()
+
+def coalesced_chat_stream(request: ChatRequest, meta: Dict[str, Any],
+                          user: Optional[User] = None) -> AsyncIterator[str]:
+    """流式聊天，相同的进行中请求共享上游流"""
+    from services.openai_service import openai_service
+
+    if not single_flight.is_eligible(request):
+        return openai_service.chat_stream(request, meta, user)
+    return single_flight.stream(
+        get_request_fingerprint(request),
+        lambda shared_meta: openai_service.chat_stream(request, shared_meta, user),
+        meta
+    )
+
+async def coalesced_chat(request: ChatRequest, meta: Dict[str, Any], user: Optional[User] = None) -> str:
+    """非流式聊天，相同的进行中请求共享上游调用"""
+    from services.openai_service import openai_service
+
+    if not single_flight.is_eligible(request):
+        return await openai_service.chat(request, meta, user)
+    return await single_flight.call(
+        get_request_fingerprint(request),
+        lambda shared_meta: openai_service.chat(request, shared_meta, user),
+        meta
+    )
@@ -0,0 +1,24 @@
+"""
+Token计数
+上游流式响应不返回用量时，按字符估算token数：中日韩字符每个约1个token，其余字符约4个一个token
+"""
+
+import re
+from typing import Iterable
+
+_CJK_PATTERN = re.compile(r"[぀-ヿ㐀-䶿一-鿿가-힯豈-﫿]")
+
+# 每条消息的格式开销（角色、分隔符）
+MESSAGE_OVERHEAD_TOKENS = 4
+
+def estimate_tokens(text: str) -> int:
+    """估算文本的token数"""
+    if not text:
+        return 0
+    cjk_count = len(_CJK_PATTERN.findall(text))
+    other_count = len(text) - cjk_count
+    return cjk_count + (other_count + 3) // 4
+
+def estimate_messages_tokens(contents: Iterable[str]) -> int:
+    """估算一组消息（提示词）的token数"""
+    return sum(estimate_tokens(content) + MESSAGE_OVERHEAD_TOKENS for content in contents)
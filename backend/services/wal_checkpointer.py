@@ -0,0 +1,79 @@
+"""
+SQLite WAL检查点管理
+WAL模式下提交只追加到WAL文件，需要定期把WAL中的页回写到数据库文件。
+默认关闭提交时的自动检查点，由后台协程定期在线程中执行PASSIVE检查点：不等待也不阻塞读者和写者，
+读者仍在使用旧快照时只回写能回写的部分，下次继续；应用关闭时执行TRUNCATE检查点并清空WAL文件
+"""
+
+import asyncio
+import time
+from typing import Any, Dict, Optional
+from config import settings
+from database import checkpoint_wal
+
+class WalCheckpointer:
+    def __init__(self):
+        self._task: Optional[asyncio.Task] = None
+        self._runs = 0
+        self._failures = 0
+        self._last: Optional[Dict[str, Any]] = None
+
+    @staticmethod
+    def enabled() -> bool:
+        return settings.sqlite_journal_mode.upper() == "WAL"
+
+    async def checkpoint(self, mode: str = "PASSIVE") -> Optional[Dict[str, Any]]:
+        """在线程中执行一次检查点"""
+        start_time = time.perf_counter()
+        try:
+            busy, wal_pages, checkpointed = await asyncio.to_thread(checkpoint_wal, mode)
+        except Exception as e:
+            self._failures += 1
+            print(f"WAL检查点失败: {e}")
+            return None
+        self._runs += 1
+        self._last = {
+            "mode": mode,
+            "busy": bool(busy),
+            "wal_pages": wal_pages,
+            "checkpointed_pages": checkpointed,
+            "duration_ms": round((time.perf_counter() - start_time) * 1000, 2),
+            "at": time.time()
+        }
+        return self._last
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(settings.sqlite_checkpoint_interval)
+            await self.checkpoint()
+
+    def start(self):
+        """启动后台检查点"""
+        if self.enabled() and settings.sqlite_checkpoint_interval > 0 and self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """停止后台检查点，并回写WAL、清空WAL文件（在写后持久化队列写完之后调用）"""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self.enabled():
+            await self.checkpoint("TRUNCATE")
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "journal_mode": settings.sqlite_journal_mode,
+            "synchronous": settings.sqlite_synchronous,
+            "running": self._task is not None,
+            "interval": settings.sqlite_checkpoint_interval,
+            "runs": self._runs,
+            "failures": self._failures,
+            "last": self._last
+        }
+
+# 全局WAL检查点实例
+wal_checkpointer = WalCheckpointer()
@@ -0,0 +1,231 @@
+"""
+会话和消息的写后持久化
+聊天过程中的会话创建、消息保存、回答检查点和会话更新时间不在请求协程中提交，
+而是放入写入队列，由专用写入协程合并为批量事务，在线程中提交，SQLite的fsync不再阻塞流式输出。
+写入按提交顺序执行；读取会话前等待该会话已排队的写入提交（读己之写），应用关闭时写完队列中的所有写入
+"""
+
+import asyncio
+import time
+import uuid
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from sqlalchemy import update
+from sqlalchemy.orm import Session
+from config import settings
+from database import SessionLocal
+from models import ChatSession, MessageRecord
+
+WriteOp = Callable[[Session], None]
+
+def session_pk(session: ChatSession) -> Callable[[], int]:
+    """返回在写入线程中获取会话主键的函数
+
+    已保存的会话立即取出主键；新会话的主键在创建写入执行后回填，由之后执行的写入读取
+    """
+    pk = session.id
+    if pk is not None:
+        return lambda: pk
+    return lambda: session.id
+
+class WriteBehindQueue:
+    def __init__(self):
+        self._queue: Optional[asyncio.Queue] = None
+        self._writer: Optional[asyncio.Task] = None
+        # 会话/用户 -> 最后一个已排队写入的完成Future
+        self._last: Dict[str, asyncio.Future] = {}
+        self._batches = 0
+        self._writes = 0
+        self._failures = 0
+        self._commit_seconds = 0.0
+
+    @staticmethod
+    def _keys(session: ChatSession) -> Tuple[str, str]:
+        return f"session:{session.session_id}", f"user:{session.user_id}"
+
+    def _apply(self, ops: List[WriteOp]) -> List[Optional[Exception]]:
+        """在一个事务中执行一批写入；批量提交失败时逐条重试，只有出错的写入失败"""
+        db = SessionLocal()
+        try:
+            try:
+                for op in ops:
+                    op(db)
+                db.commit()
+                return [None] * len(ops)
+            except Exception as e:
+                db.rollback()
+                if len(ops) == 1:
+                    return [e]
+            errors = []
+            for op in ops:
+                try:
+                    op(db)
+                    db.commit()
+                    errors.append(None)
+                except Exception as e:
+                    db.rollback()
+                    errors.append(e)
+            return errors
+        finally:
+            db.close()
+
+    def _settle(self, batch: List[Tuple[WriteOp, asyncio.Future]], errors: List[Optional[Exception]]):
+        self._batches += 1
+        self._writes += len(batch)
+        for (_, future), error in zip(batch, errors):
+            if future.done():
+                continue
+            if error is None:
+                future.set_result(None)
+            else:
+                self._failures += 1
+                print(f"写后持久化写入失败: {error}")
+                future.set_exception(error)
+
+    def _forget(self, keys: Tuple[str, str], future: asyncio.Future):
+        if not future.cancelled():
+            # 标记异常已读取，失败已在_settle中记录
+            future.exception()
+        for key in keys:
+            if self._last.get(key) is future:
+                del self._last[key]
+
+    def submit(self, session: ChatSession, op: WriteOp) -> asyncio.Future:
+        """提交属于会话的写入
+
+        写入协程未运行时（启动前、关闭后）直接同步执行
+
+        Returns:
+            写入提交后完成的Future，写入失败时带有异常
+        """
+        future = asyncio.get_running_loop().create_future()
+        if self._writer is None:
+            self._settle([(op, future)], self._apply([op]))
+            return future
+        keys = self._keys(session)
+        for key in keys:
+            self._last[key] = future
+        future.add_done_callback(lambda done: self._forget(keys, done))
+        self._queue.put_nowait((op, future))
+        return future
+
+    async def _run(self):
+        stopping = False
+        while True:
+            if stopping and self._queue.empty():
+                # 在本协程内摘除写入协程，之后提交的写入同步执行，不会留在已停止的队列中
+                self._writer = None
+                return
+            item = await self._queue.get()
+            if item is None:
+                stopping = True
+                continue
+            batch = [item]
+            if settings.write_behind_max_delay_ms > 0 and not stopping:
+                await asyncio.sleep(settings.write_behind_max_delay_ms / 1000)
+            while len(batch) < settings.write_behind_batch_size and not self._queue.empty():
+                item = self._queue.get_nowait()
+                if item is None:
+                    stopping = True
+                    continue
+                batch.append(item)
+            start_time = time.perf_counter()
+            try:
+                errors = await asyncio.to_thread(self._apply, [op for op, _ in batch])
+            except Exception as e:
+                errors = [e] * len(batch)
+            self._commit_seconds += time.perf_counter() - start_time
+            self._settle(batch, errors)
+
+    def start(self):
+        """启动写入协程"""
+        if self._writer is not None:
+            return
+        self._queue = asyncio.Queue()
+        self._writer = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """写完队列中的所有写入后停止写入协程"""
+        writer = self._writer
+        if writer is None:
+            return
+        pending = self._queue.qsize()
+        self._queue.put_nowait(None)
+        await writer
+        if pending:
+            print(f"ℹ️  关闭前写入 {pending} 条排队的会话数据")
+
+    async def _wait(self, key: str):
+        future = self._last.get(key)
+        if future is not None:
+            # 只等待完成，写入失败不影响读取
+            await asyncio.wait([future])
+
+    async def wait_session(self, session_id: Optional[str]):
+        """等待会话已排队的写入提交"""
+        if session_id:
+            await self._wait(f"session:{session_id}")
+
+    async def wait_user(self, user_id: int):
+        """等待用户所有会话已排队的写入提交"""
+        await self._wait(f"user:{user_id}")
+
+    def create_session(self, user_id: int, title: str, model_used: Optional[str] = None) -> Tuple[ChatSession, asyncio.Future]:
+        """创建会话：立即返回带会话ID的会话对象，主键在写入提交后回填"""
+        session = ChatSession(
+            session_id=str(uuid.uuid4()),
+            user_id=user_id,
+            title=title,
+            model_used=model_used,
+            created_at=datetime.utcnow(),
+            is_active=True
+        )
+        fields = {
+            "session_id": session.session_id,
+            "user_id": user_id,
+            "title": title,
+            "model_used": model_used,
+            "created_at": session.created_at,
+            "is_active": True
+        }
+
+        def op(db: Session):
+            row = ChatSession(**fields)
+            db.add(row)
+            db.flush()
+            session.id = row.id
+
+        return session, self.submit(session, op)
+
+    def add_message(self, session: ChatSession, **fields: Any) -> asyncio.Future:
+        """保存消息"""
+        pk = session_pk(session)
+
+        def op(db: Session):
+            db.add(MessageRecord(session_id=pk(), **fields))
+
+        return self.submit(session, op)
+
+    def touch_session(self, session: ChatSession) -> asyncio.Future:
+        """更新会话的更新时间"""
+        pk = session_pk(session)
+        updated_at = session.updated_at = datetime.utcnow()
+
+        def op(db: Session):
+            db.execute(update(ChatSession).where(ChatSession.id == pk()).values(updated_at=updated_at))
+
+        return self.submit(session, op)
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "running": self._writer is not None,
+            "pending": self._queue.qsize() if self._queue is not None else 0,
+            "batches": self._batches,
+            "writes": self._writes,
+            "failures": self._failures,
+            "avg_batch_size": round(self._writes / self._batches, 2) if self._batches else 0,
+            "avg_commit_ms": round(self._commit_seconds / self._batches * 1000, 2) if self._batches else 0
+        }
+
+# 全局写后持久化实例
+write_behind = WriteBehindQueue()